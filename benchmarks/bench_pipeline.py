@@ -0,0 +1,157 @@
+"""Times and measures the peak memory of each stage of the valuation and PnL
+computation, on synthetic histories from a thousand to millions of trades.
+
+Prices come from a deterministic SyntheticPriceDownloader, so that only
+coin2086 itself is measured. Each stage is run twice: once to time it, once
+with tracemalloc to measure its peak memory, as tracemalloc slows down
+allocations. Results are written as JSON lines, one per stage and size.
+
+Usage: python -m benchmarks.bench_pipeline [--max-trades N] [--cryptos N]
+           [--sell-ratio R] [--output results.jsonl]
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from coin2086 import pnl
+from coin2086 import valuation
+from coin2086.validation import check_trades
+
+from .synthetic import SyntheticPriceDownloader, make_trades
+
+
+STAGES = [
+    "check_trades",
+    "unstack_portfolio_composition",
+    "add_public_prices",
+    "merge_rates_and_valuate",
+    "compute_purchase_price_fraction",
+    "compute_taxable_pnls",
+]
+
+
+def run_stages(trades, measure):
+    """Runs the stages in order on a copy of trades, and returns the
+    measure of each one. measure(func, *args) calls func(*args) and returns
+    the measure, with the result of func."""
+    trades = trades.copy()
+    price_downloader = SyntheticPriceDownloader()
+    results = {}
+    results["check_trades"], _ = measure(check_trades, trades)
+    sales = trades[trades["trade_side"] == "SELL"]
+    results["unstack_portfolio_composition"], portfolio = measure(
+        valuation.unstack_portfolio_composition, trades, sales, None
+    )
+    valuation.add_sell_prices(portfolio, sales)
+    results["add_public_prices"], _ = measure(
+        valuation.add_public_prices,
+        portfolio,
+        sales,
+        price_downloader=price_downloader,
+    )
+    results["merge_rates_and_valuate"], _ = measure(
+        valuation.merge_rates_and_valuate, portfolio
+    )
+    purchase_price = trades[["trade_side", "amount", "fee"]].copy()
+    pnl.add_portfolio_purchase_price(purchase_price, 0.0)
+    inputs = [
+        sales["amount"].values,
+        portfolio.total,
+        purchase_price["portfolio_purchase_price"].values[sales.index],
+    ]
+    outputs = [np.zeros(len(sales)) for _ in range(3)]
+    results["compute_purchase_price_fraction"], _ = measure(
+        pnl.compute_purchase_price_fraction, *inputs, *outputs
+    )
+    year = trades["datetime"].iloc[-1].year
+    results["compute_taxable_pnls"], _ = measure(
+        pnl.compute_taxable_pnls,
+        trades,
+        year,
+        price_downloader=price_downloader,
+    )
+    return results
+
+
+def measure_time(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def measure_peak_memory(func, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def benchmark(n_trades, n_cryptos, sell_ratio):
+    """Returns one record per stage for a synthetic history of n_trades"""
+    trades = make_trades(n_trades, n_cryptos, sell_ratio)
+    n_sales = int((trades["trade_side"] == "SELL").sum())
+    seconds = run_stages(trades, measure_time)
+    peak_bytes = run_stages(trades, measure_peak_memory)
+    return [
+        {
+            "stage": stage,
+            "trades": n_trades,
+            "sales": n_sales,
+            "cryptos": n_cryptos,
+            "sell_ratio": sell_ratio,
+            "seconds": seconds[stage],
+            "peak_bytes": peak_bytes[stage],
+        }
+        for stage in STAGES
+    ]
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "jit": pnl.get_compute_purchase_price_fraction_jit() is not None,
+        "machine": platform.machine(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-trades", type=int, default=1000)
+    parser.add_argument("--max-trades", type=int, default=10**7)
+    parser.add_argument("--cryptos", type=int, default=5)
+    parser.add_argument("--sell-ratio", type=float, default=0.3)
+    parser.add_argument("--output", help="Path of the JSON lines output file")
+    args = parser.parse_args(argv)
+    out = open(args.output, "w") if args.output else sys.stdout
+    jit = pnl.get_compute_purchase_price_fraction_jit()
+    if jit is not None:
+        # Compile before timing
+        arrays = [np.ones(10) for _ in range(6)]
+        jit(*arrays)
+    try:
+        env = environment()
+        n = args.min_trades
+        while n <= args.max_trades:
+            for record in benchmark(n, args.cryptos, args.sell_ratio):
+                record.update(env)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+            n *= 10
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Times the implementations of compute_purchase_price_fraction on synthetic
+sales, from a thousand to millions of sales.
+
+Usage: python -m benchmarks.bench_purchase_price_fraction [max_sales]
+"""
+import sys
+import time
+
+import numpy as np
+
+from coin2086 import pnl
+
+
+def make_sales(n, seed=2086):
+    rng = np.random.default_rng(seed)
+    value = rng.uniform(1000.0, 5000.0, n)
+    amount = value * rng.uniform(0.0, 0.5, n)
+    purchase_price = np.cumsum(rng.uniform(0.0, 100.0, n))
+    return amount, value, purchase_price
+
+
+def time_compute(compute, amount, value, purchase_price):
+    outputs = [np.zeros(len(amount)) for _ in range(3)]
+    start = time.perf_counter()
+    compute(amount, value, purchase_price, *outputs)
+    return time.perf_counter() - start
+
+
+def main(max_sales=10**7):
+    implementations = {
+        "loop": pnl.compute_purchase_price_fraction_loop,
+        "vectorized": pnl.compute_purchase_price_fraction_vectorized,
+    }
+    jit = pnl.get_compute_purchase_price_fraction_jit()
+    if jit is not None:
+        implementations["jit"] = jit
+        # Compile before timing
+        time_compute(jit, *make_sales(10))
+    print("sales," + ",".join(implementations))
+    n = 1000
+    while n <= max_sales:
+        sales = make_sales(n)
+        timings = [time_compute(impl, *sales) for impl in implementations.values()]
+        print(f"{n}," + ",".join(f"{t:.6f}" for t in timings))
+        n *= 10
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,91 @@
+"""Synthetic trade histories and prices, to benchmark coin2086 on histories
+much larger than the reference data, without any network access."""
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from coin2086.pricedownload import PriceDownloader
+from coin2086.validation import SUPPORTED_CRYPTOS
+
+START = dt.datetime(2020, 1, 1)
+FEE_RATE = 0.005
+
+
+def synthetic_price(crypto_codes, minutes):
+    """Returns the price of the crypto-currencies of index crypto_codes in
+    SUPPORTED_CRYPTOS, at the given numbers of minutes since START. Prices
+    oscillate with a period of a week around a level specific to each
+    crypto-currency."""
+    crypto_codes = np.asarray(crypto_codes)
+    level = 10.0 ** (1 + crypto_codes % 4)
+    phase = crypto_codes * 0.7
+    return level * (1.0 + 0.2 * np.sin(2 * np.pi * minutes / (7 * 24 * 60) + phase))
+
+
+class SyntheticPriceDownloader(PriceDownloader):
+    """A deterministic price downloader, that computes the close price of the
+    minute with synthetic_price instead of downloading it."""
+
+    def __init__(self):
+        self.codes = {c: code for code, c in enumerate(SUPPORTED_CRYPTOS)}
+
+    @property
+    def supported_crypto_list(self):
+        return list(SUPPORTED_CRYPTOS)
+
+    def download_price(self, crypto, dtime):
+        minute = round((dtime - START).total_seconds() / 60)
+        return float(synthetic_price(self.codes[crypto], minute))
+
+    def download_prices(self, crypto, dtimes):
+        if len(dtimes) == 0:
+            return []
+        elapsed = pd.DatetimeIndex(dtimes) - pd.Timestamp(START)
+        minutes = np.round(elapsed.total_seconds().values / 60)
+        return list(synthetic_price(self.codes[crypto], minutes))
+
+
+def make_trades(n_trades, n_cryptos=5, sell_ratio=0.3, seed=2086):
+    """Generates a valid history of n_trades trades of the first n_cryptos
+    crypto-currencies of SUPPORTED_CRYPTOS, of which about sell_ratio are
+    sales, traded at the prices of SyntheticPriceDownloader.
+
+    The k-th sale of a crypto-currency sells half of the quantity bought
+    before it, divided by (k + 1) ** 2, so that holdings never go negative.
+    """
+    if not 1 <= n_cryptos <= len(SUPPORTED_CRYPTOS):
+        raise ValueError(f"n_cryptos must be between 1 and {len(SUPPORTED_CRYPTOS)}")
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, n_cryptos, n_trades)
+    is_sale = rng.random(n_trades) < sell_ratio
+    # The first trade of each crypto-currency is a purchase
+    _, first_positions = np.unique(codes, return_index=True)
+    is_sale[first_positions] = False
+    seconds = np.cumsum(rng.integers(1, 120, n_trades))
+    dtimes = pd.Timestamp(START) + pd.to_timedelta(seconds, unit="s")
+    minutes = np.round(seconds / 60)
+    price = synthetic_price(codes, minutes)
+    quantity = rng.uniform(0.1, 10.0, n_trades)
+    for code in range(n_cryptos):
+        positions = np.flatnonzero(codes == code)
+        sales = is_sale[positions]
+        bought = np.where(sales, 0.0, quantity[positions])
+        bought_before = np.cumsum(bought)
+        sale_rank = np.maximum(np.cumsum(sales) - 1, 0)
+        sold = 0.5 * bought_before / (sale_rank + 1.0) ** 2
+        quantity[positions[sales]] = sold[sales]
+    amount = quantity * price
+    cryptos = np.array(SUPPORTED_CRYPTOS[:n_cryptos], dtype=object)
+    return pd.DataFrame(
+        {
+            "datetime": dtimes,
+            "trade_side": np.where(is_sale, "SELL", "BUY").astype(object),
+            "cryptocurrency": cryptos[codes],
+            "quantity": quantity,
+            "price": price,
+            "base_currency": "EUR",
+            "amount": amount,
+            "fee": amount * FEE_RATE,
+        }
+    )
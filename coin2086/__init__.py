@@ -1,4 +1,13 @@
 __version__ = "0.1.0"
 
 from .valuation import valuate_portfolio
-from .pnl import compute_taxable_pnls, compute_taxable_pnls_detailed
+from .pnl import (
+    compute_taxable_pnls,
+    compute_taxable_pnls_detailed,
+    compute_taxable_pnls_by_year,
+)
+from .incremental import IncrementalPnlEngine
+from .validation import validate_trades
+from .metrics import collect_metrics
+from .aio import valuate_portfolio_async, compute_taxable_pnls_detailed_async
+from .batch import compute_taxable_pnls_batch
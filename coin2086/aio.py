@@ -0,0 +1,214 @@
+"""asyncio variants of the valuation and PnL functions, for applications
+running an event loop, that must not be blocked by price downloads."""
+import abc
+import weakref
+import asyncio
+import functools
+
+from . import metrics
+from . import pricedownload
+from . import pnl
+from . import valuation
+from .validation import unwrap_trades
+
+
+class AsyncPriceDownloader(abc.ABC):
+    """The asyncio counterpart of :py:class:`coin2086.pricedownload.PriceDownloader`"""
+
+    @abc.abstractmethod
+    async def download_price(self, crypto, dtime):
+        pass
+
+    async def download_prices(self, crypto, dtimes):
+        """Returns the prices of crypto at each of dtimes, downloading the
+        missing ones concurrently"""
+        await self.prefetch(crypto, dtimes)
+        return await asyncio.gather(*[self.download_price(crypto, d) for d in dtimes])
+
+    async def prefetch(self, crypto, dtimes):
+        pass
+
+    def cached_price(self, crypto, dtime):
+        """Returns the price of crypto at dtime if it is known without
+        blocking the event loop, or None"""
+        return None
+
+
+class ThreadedAsyncPriceDownloader(AsyncPriceDownloader):
+    """Runs the blocking downloads of a PriceDownloader on a thread pool, at
+    most max_concurrency at a time, so that they do not block the event loop.
+    Prices cached in memory are returned without leaving the event loop
+    thread. Looking up the others, in the price store or on the exchanges,
+    runs on the thread pool.
+
+    Args:
+        price_downloader (coin2086.pricedownload.PriceDownloader): The
+            downloader to run. Defaults to the reference price downloader.
+        max_concurrency (int): The maximum number of downloads in flight.
+        executor (concurrent.futures.Executor): The pool downloads run on.
+            Defaults to the default executor of the event loop.
+    """
+
+    def __init__(self, price_downloader=None, max_concurrency=8, executor=None):
+        if price_downloader is None:
+            price_downloader = pricedownload.reference_price_downloader()
+        self.price_downloader = price_downloader
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        # Semaphores are bound to the event loop they are first used in. Called
+        # from coroutines only, where get_event_loop returns the running loop
+        loop = asyncio.get_event_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def _run(self, func, *args):
+        async with self._semaphore():
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args)
+            )
+
+    def cached_price(self, crypto, dtime):
+        return self.price_downloader.memory_cached_prices(crypto, [dtime])[0]
+
+    async def download_price(self, crypto, dtime):
+        price = self.cached_price(crypto, dtime)
+        if price is not None:
+            return price
+        return await self._run(self.price_downloader.download_price, crypto, dtime)
+
+    async def prefetch(self, crypto, dtimes):
+        missing = [d for d in dtimes if self.cached_price(crypto, d) is None]
+        if len(missing) > 0:
+            await self._run(self.price_downloader.prefetch, crypto, missing)
+
+    async def download_prices(self, crypto, dtimes):
+        prices = self.price_downloader.memory_cached_prices(crypto, dtimes)
+        if all(price is not None for price in prices):
+            return prices
+        # Download the groups of prices planned by the price downloader
+        # concurrently
+        groups = await self._run(self.price_downloader.plan_downloads, crypto, dtimes)
+        group_prices = await asyncio.gather(
+            *[
+                self._run(self.price_downloader.download_prices, crypto, group)
+                for group in groups
+            ]
+        )
+        prices = {
+            dtime: price
+            for group, prices in zip(groups, group_prices)
+            for dtime, price in zip(group, prices)
+        }
+        return [prices[d] for d in dtimes]
+
+
+def as_async_price_downloader(price_downloader, max_concurrency):
+    if isinstance(price_downloader, AsyncPriceDownloader):
+        return price_downloader
+    return ThreadedAsyncPriceDownloader(price_downloader, max_concurrency)
+
+
+async def add_public_prices_async(portfolio, sales, sparse, price_downloader):
+    plan = valuation.plan_public_prices(portfolio, sales, sparse)
+    prices = await asyncio.gather(
+        *[price_downloader.download_prices(c, dtimes) for c, dtimes in plan.items()]
+    )
+    prices = {
+        (crypto, dtime): price
+        for (crypto, dtimes), crypto_prices in zip(plan.items(), prices)
+        for dtime, price in zip(dtimes, crypto_prices)
+    }
+    valuation.fill_public_prices(portfolio, sales, plan, prices, sparse)
+
+
+async def valuate_portfolio_arrays_async(
+    trades, initial_portfolio=None, sparse=False, price_downloader=None
+):
+    sales = trades[trades["trade_side"] == "SELL"]
+    with metrics.stage("unstack_portfolio_composition"):
+        portfolio = valuation.unstack_portfolio_composition(
+            trades, sales, initial_portfolio
+        )
+    with metrics.stage("add_sell_prices"):
+        valuation.add_sell_prices(portfolio, sales)
+    with metrics.stage("add_public_prices"):
+        await add_public_prices_async(portfolio, sales, sparse, price_downloader)
+    with metrics.stage("merge_rates_and_valuate"):
+        valuation.merge_rates_and_valuate(portfolio)
+    return portfolio
+
+
+async def valuate_portfolio_async(
+    trades,
+    initial_portfolio=None,
+    sparse=False,
+    price_downloader=None,
+    max_concurrency=8,
+):
+    """Determines the valuation of the porfolio before each sale, as
+    :py:func:`coin2086.valuate_portfolio` does, downloading prices without
+    blocking the event loop::
+
+        valuation = await coin2086.valuate_portfolio_async(trades)
+
+    Args:
+        trades (pandas.DataFrame): .. include:: ../../docs/includes/arg_trades.rst
+        initial_portfolio (dict):  .. include:: ../../docs/includes/arg_initial_portfolio.rst
+        sparse (bool): See :py:func:`coin2086.valuate_portfolio`
+        price_downloader (coin2086.aio.AsyncPriceDownloader or coin2086.pricedownload.PriceDownloader):
+            The source of public prices. A PriceDownloader is run on a
+            thread pool. Defaults to the reference price downloader.
+        max_concurrency (int): The maximum number of price downloads in
+            flight, when price_downloader is not an AsyncPriceDownloader.
+
+    Returns:
+        pandas.DataFrame: The same DataFrame as :py:func:`coin2086.valuate_portfolio`
+    """
+    trades = unwrap_trades(trades)
+    price_downloader = as_async_price_downloader(price_downloader, max_concurrency)
+    portfolio = await valuate_portfolio_arrays_async(
+        trades, initial_portfolio, sparse, price_downloader
+    )
+    with metrics.stage("to_frame"):
+        return portfolio.to_frame()
+
+
+async def compute_taxable_pnls_detailed_async(
+    trades,
+    initial_portfolio=None,
+    initial_purchase_price=0.0,
+    price_downloader=None,
+    max_concurrency=8,
+):
+    """Computes your taxable PnL for each sale, as
+    :py:func:`coin2086.compute_taxable_pnls_detailed` does, downloading
+    prices without blocking the event loop::
+
+        sales = await coin2086.compute_taxable_pnls_detailed_async(trades)
+
+    Args:
+        trades (pandas.DataFrame): .. include:: ../../docs/includes/arg_trades.rst
+        initial_portfolio (dict):  .. include:: ../../docs/includes/arg_initial_portfolio.rst
+        initial_purchase_price (float): The purchase price of the initial_portfolio
+        price_downloader (coin2086.aio.AsyncPriceDownloader or coin2086.pricedownload.PriceDownloader):
+            See :py:func:`coin2086.valuate_portfolio_async`
+        max_concurrency (int): See :py:func:`coin2086.valuate_portfolio_async`
+
+    Returns:
+        pandas.DataFrame: The same DataFrame as
+        :py:func:`coin2086.compute_taxable_pnls_detailed`
+    """
+    trades = unwrap_trades(trades).copy()
+    price_downloader = as_async_price_downloader(price_downloader, max_concurrency)
+    with metrics.stage("add_portfolio_purchase_price"):
+        pnl.add_portfolio_purchase_price(trades, initial_purchase_price)
+    portfolio = await valuate_portfolio_arrays_async(
+        trades, initial_portfolio, sparse=True, price_downloader=price_downloader
+    )
+    sales = pnl.filter_sales_join_portfolio_value(trades, portfolio)
+    return pnl.compute_pnls_of_sales(sales)
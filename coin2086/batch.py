@@ -0,0 +1,135 @@
+"""Computes the taxable PnLs of many portfolios at once, on a pool of
+processes sharing a single price store."""
+import os
+import logging
+import tempfile
+import collections
+import concurrent.futures
+
+import pandas as pd
+
+from . import pnl
+from . import pricedownload
+from . import pricestore
+from . import valuation
+
+logger = logging.getLogger(__name__)
+
+
+BatchPortfolio = collections.namedtuple(
+    "BatchPortfolio",
+    ["trades", "initial_portfolio", "initial_purchase_price"],
+)
+# The defaults argument of namedtuple was added in Python 3.7
+BatchPortfolio.__new__.__defaults__ = (None, 0.0)
+BatchPortfolio.__doc__ = """The trades of a portfolio computed by
+compute_taxable_pnls_batch, with its initial portfolio and purchase price"""
+
+
+def as_batch_portfolio(portfolio):
+    if isinstance(portfolio, BatchPortfolio):
+        return portfolio
+    return BatchPortfolio(portfolio)
+
+
+def load_trades(trades):
+    """Returns trades, reading it with pandas.read_csv if it is a path"""
+    if isinstance(trades, (str, os.PathLike)):
+        return pd.read_csv(trades)
+    return trades
+
+
+def plan_batch_prices(portfolios, sparse=True):
+    """Returns a dict mapping each crypto-currency to the union of the
+    datetimes at which its price is needed to compute the PnLs of portfolios,
+    or to valuate them with valuate_portfolio if sparse is False"""
+    union = collections.defaultdict(set)
+    for portfolio in portfolios:
+        trades = load_trades(portfolio.trades)
+        plan = valuation.plan_trades_prices(
+            trades, portfolio.initial_portfolio, sparse=sparse
+        )
+        for crypto, dtimes in plan.items():
+            union[crypto].update(dtimes)
+    return {crypto: sorted(dtimes) for crypto, dtimes in union.items()}
+
+
+# The price downloaders of each worker process, by price store path
+_worker_price_downloaders = {}
+
+
+def worker_price_downloader(store_path):
+    """Returns the price downloader of the worker process reading the store at
+    store_path, instantiated on first use"""
+    price_downloader = _worker_price_downloaders.get(store_path)
+    if price_downloader is None:
+        store = pricestore.SQLitePriceStore(store_path)
+        price_downloader = pricedownload.instantiate_reference_price_downloader(store)
+        _worker_price_downloaders[store_path] = price_downloader
+    return price_downloader
+
+
+def compute_portfolio(portfolio, years, store_path):
+    return pnl.compute_taxable_pnls_by_year(
+        load_trades(portfolio.trades),
+        years,
+        portfolio.initial_portfolio,
+        portfolio.initial_purchase_price,
+        price_downloader=worker_price_downloader(store_path),
+    )
+
+
+def compute_taxable_pnls_batch(
+    portfolios, years=None, max_processes=None, max_workers=None, store=None
+):
+    """Computes the taxable PnLs of many portfolios, for instance the trades
+    of many clients, on a pool of processes::
+
+        reports = coin2086.compute_taxable_pnls_batch(
+            {"alice": "alice.csv", "bob": bob_trades}, years=[2021]
+        )
+        form2086, taxable_profit = reports["alice"][2021]
+
+    The prices needed by all the portfolios are first downloaded once, with
+    as few requests as possible, into a price store that all the processes
+    then read from. A price shared by several portfolios is downloaded once.
+
+    Args:
+        portfolios (dict): Maps a name of your choice to the trades of each
+            portfolio: a DataFrame of trades as described in :ref:`Input
+            Format`, a path to a CSV file of such trades, or a
+            :py:class:`coin2086.batch.BatchPortfolio` to also give its
+            initial portfolio and purchase price.
+        years (list of int): The years to report, as for
+            :py:func:`coin2086.compute_taxable_pnls_by_year`.
+        max_processes (int): The number of processes computing the PnLs. By
+            default, the number of processors.
+        max_workers (int): If given, prices are downloaded concurrently on a
+            pool of max_workers threads (see :py:func:`coin2086.valuate_portfolio`)
+        store (coin2086.pricestore.SQLitePriceStore): The store shared by the
+            processes. Defaults to the store given by the COIN2086_PRICE_STORE
+            environment variable, or to a temporary store if it is not set.
+
+    Returns:
+        dict: Maps each name of portfolios to the dict returned by
+        :py:func:`coin2086.compute_taxable_pnls_by_year` for it
+    """
+    portfolios = {name: as_batch_portfolio(p) for name, p in portfolios.items()}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if store is None:
+            store = pricestore.default_price_store()
+        if store is None:
+            store = pricestore.SQLitePriceStore(os.path.join(tmp_dir, "prices.sqlite"))
+        price_downloader = pricedownload.instantiate_reference_price_downloader(store)
+        plan = plan_batch_prices(portfolios.values())
+        logger.info(
+            f"Downloading {sum(len(d) for d in plan.values())} prices for "
+            f"{len(portfolios)} portfolios"
+        )
+        valuation.download_planned_prices(plan, price_downloader, max_workers)
+        with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
+            futures = {
+                name: executor.submit(compute_portfolio, portfolio, years, store.path)
+                for name, portfolio in portfolios.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
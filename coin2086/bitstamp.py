@@ -1,12 +1,57 @@
 import pandas as pd
 
+from .columnar import ColumnarTradesWriter
 
-def split_column_get_value(col):
-    return col.str.split().str[0].astype(float)
+BITSTAMP_COLUMNS = ["Type", "Datetime", "Amount", "Value", "Rate", "Fee", "Sub Type"]
 
+NORMALIZED_COLUMNS = [
+    "datetime",
+    "trade_side",
+    "cryptocurrency",
+    "quantity",
+    "price",
+    "base_currency",
+    "amount",
+    "fee",
+]
 
-def split_column_get_unit(col):
-    return col.str.split().str[1]
+CATEGORICAL_COLUMNS = ["trade_side", "cryptocurrency", "base_currency"]
+
+# As in "Jan. 04, 2021, 10:23 AM"
+BITSTAMP_DATETIME_FORMAT = "%b. %d, %Y, %I:%M %p"
+
+
+def parse_datetimes(col):
+    """Parses the datetimes of Bitstamp exports with their known format,
+    falling back on guessing the format of each datetime"""
+    try:
+        return pd.to_datetime(col, format=BITSTAMP_DATETIME_FORMAT)
+    except ValueError:
+        return pd.to_datetime(col)
+
+
+def split_column(col):
+    """Splits a column of "value unit" strings once, and returns the values
+    as floats and the units"""
+    parts = col.str.split(n=1, expand=True).reindex(columns=[0, 1])
+    return parts[0].astype(float), parts[1]
+
+
+def normalize_trades(trans, start_date, categorical=False):
+    # Select only trade (Market) transaction and ignore Deposits, Withdrawals etc.
+    trans = trans[trans["Type"] == "Market"]
+    datetime = parse_datetimes(trans["Datetime"])
+    trans = trans[datetime > pd.to_datetime(start_date)]
+    trades = pd.DataFrame({"datetime": datetime[trans.index]})
+    trades["trade_side"] = trans["Sub Type"].str.upper()
+    trades["quantity"], trades["cryptocurrency"] = split_column(trans["Amount"])
+    trades["price"], _ = split_column(trans["Rate"])
+    trades["amount"], trades["base_currency"] = split_column(trans["Value"])
+    trades["fee"], _ = split_column(trans["Fee"])
+    trades = trades[NORMALIZED_COLUMNS]
+    if categorical:
+        trades = trades.astype({col: "category" for col in CATEGORICAL_COLUMNS})
+    return trades
 
 
 def normalize_bitstamp_transactions(trans, start_date):
@@ -31,27 +76,62 @@ def normalize_bitstamp_transactions(trans, start_date):
         pandas.DataFrame: A DataFrame of normalized crypto-currency buy and sell
         trades, that can be used by coin2086 public API functions.
     """
-    # Select only trade (Market) transaction and ignore Deposits, Withdrawals etc.
-    trades = trans[trans["Type"] == "Market"].copy()
-    trades["datetime"] = pd.to_datetime(trades["Datetime"])
-    trades["quantity"] = split_column_get_value(trades["Amount"])
-    trades["cryptocurrency"] = split_column_get_unit(trades["Amount"])
-    trades["price"] = split_column_get_value(trades["Rate"])
-    trades["rate_unit"] = split_column_get_unit(trades["Rate"])
-    trades["amount"] = split_column_get_value(trades["Value"])
-    trades["base_currency"] = split_column_get_unit(trades["Value"])
-    trades["fee"] = split_column_get_value(trades["Fee"])
-    trades["fee_unit"] = split_column_get_unit(trades["Fee"])
-    trades["trade_side"] = trades["Sub Type"].str.upper()
-    cols = [
-        "datetime",
-        "trade_side",
-        "cryptocurrency",
-        "quantity",
-        "price",
-        "base_currency",
-        "amount",
-        "fee",
-    ]
-    trades = trades[trades["datetime"] > pd.to_datetime(start_date)].reset_index()
-    return trades[cols]
+    trades = normalize_trades(trans, start_date)
+    trades.index = pd.RangeIndex(len(trades))
+    return trades
+
+
+def iter_bitstamp_transactions(csv, start_date, chunksize=100000):
+    """
+    Reads a CSV file of transactions exported by Bitstamp in chunks of
+    chunksize lines, and yields batches of normalized trades, so that exports
+    of any size are normalized in bounded memory. The trades, units and
+    crypto-currencies columns are categorical.
+
+    The index of the batches runs on from one batch to the next, so that
+    concatenating them gives the same trades as
+    :py:func:`normalize_bitstamp_transactions`.
+
+    Args:
+        csv (str, pathlib.Path or file-like): The CSV file exported from your
+            Bitstamp profile.
+        start_date(timestamp, str or datetime): See
+            :py:func:`normalize_bitstamp_transactions`.
+        chunksize (int): The number of lines of the CSV file read at once.
+
+    Yields:
+        pandas.DataFrame: Batches of normalized trades.
+    """
+    start = 0
+    chunks = pd.read_csv(csv, usecols=BITSTAMP_COLUMNS, dtype=str, chunksize=chunksize)
+    for chunk in chunks:
+        trades = normalize_trades(chunk, start_date, categorical=True)
+        if len(trades) == 0:
+            continue
+        trades.index = pd.RangeIndex(start, start + len(trades))
+        start += len(trades)
+        yield trades
+
+
+def write_bitstamp_transactions(csv, directory, start_date, chunksize=100000):
+    """
+    Normalizes a CSV file of transactions exported by Bitstamp chunk by chunk,
+    as :py:func:`iter_bitstamp_transactions` does, and writes the trades to
+    a compact columnar file, that is read back with
+    :py:func:`coin2086.columnar.read_columnar_trades`.
+
+    Args:
+        csv (str, pathlib.Path or file-like): The CSV file exported from your
+            Bitstamp profile.
+        directory (str or pathlib.Path): The directory of the columnar file.
+        start_date(timestamp, str or datetime): See
+            :py:func:`normalize_bitstamp_transactions`.
+        chunksize (int): The number of lines of the CSV file read at once.
+
+    Returns:
+        int: The number of trades written.
+    """
+    with ColumnarTradesWriter(directory) as writer:
+        for batch in iter_bitstamp_transactions(csv, start_date, chunksize):
+            writer.append(batch)
+    return writer.length
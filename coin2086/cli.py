@@ -0,0 +1,174 @@
+"""The coin2086 command line.
+
+coin2086 prefetch
+    Downloads ahead of time into a price store all the prices needed to
+    valuate the portfolios of trades files, so that valuating them later is
+    served from the store::
+
+        coin2086 prefetch --store prices.sqlite alice.csv bob.csv
+
+    Prices are saved in the store as they are downloaded: an interrupted
+    prefetch is resumed by running it again.
+"""
+import sys
+import time
+import logging
+import argparse
+import collections
+
+from . import batch
+from . import pricedownload
+from . import pricestore
+
+logger = logging.getLogger(__name__)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours > 0:
+        return f"{hours}h{minutes:02d}m"
+    if minutes > 0:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    """Prints how many of total prices were downloaded, at which rate, and
+    the estimated time left"""
+
+    def __init__(self, total, out=None, clock=time.monotonic):
+        self.total = total
+        self.done = 0
+        self.out = sys.stderr if out is None else out
+        self.clock = clock
+        self.start = clock()
+
+    def update(self, count, crypto):
+        self.done += count
+        elapsed = self.clock() - self.start
+        rate = self.done / elapsed if elapsed > 0 else float("inf")
+        left = (self.total - self.done) / rate if rate > 0 else float("inf")
+        width = len(str(self.total))
+        self.out.write(
+            f"[{self.done:>{width}}/{self.total}] {100 * self.done / self.total:5.1f}% "
+            f"{crypto:<6} {rate:8.1f} prices/s  ETA {format_duration(left)}\n"
+        )
+        self.out.flush()
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def plan_files_prices(paths, sparse):
+    """Returns the union of the prices needed to valuate the trades of each
+    path, and the list of the paths whose trades could not be read or are
+    not valid"""
+    union = collections.defaultdict(set)
+    invalid = []
+    for path in paths:
+        try:
+            portfolio = batch.BatchPortfolio(batch.load_trades(path))
+            plan = batch.plan_batch_prices([portfolio], sparse)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+            invalid.append(path)
+            continue
+        for crypto, dtimes in plan.items():
+            union[crypto].update(dtimes)
+    return {crypto: sorted(dtimes) for crypto, dtimes in union.items()}, invalid
+
+
+def prefetch(paths, store, sparse=False, chunk_size=500, price_downloader=None):
+    """Downloads into store the prices needed to valuate the trades files at
+    paths, and returns the number of failures: the prices that could not be
+    downloaded, and the files that could not be read"""
+    if price_downloader is None:
+        price_downloader = pricedownload.instantiate_reference_price_downloader(store)
+    plan, invalid = plan_files_prices(paths, sparse)
+    missing = {}
+    for crypto, dtimes in plan.items():
+        cached = price_downloader.cached_prices(crypto, dtimes)
+        dtimes = [d for d, price in zip(dtimes, cached) if price is None]
+        if len(dtimes) > 0:
+            missing[crypto] = dtimes
+    total = sum(len(d) for d in plan.values())
+    left = sum(len(d) for d in missing.values())
+    print(
+        f"{total} prices needed by {len(paths) - len(invalid)} files, "
+        f"{total - left} already in the store, {left} to download",
+        file=sys.stderr,
+    )
+    failed = 0
+    progress = Progress(left)
+    for crypto, dtimes in missing.items():
+        for chunk in chunks(dtimes, chunk_size):
+            try:
+                price_downloader.download_prices(crypto, chunk)
+            except Exception as e:
+                # The prices downloaded before the error were stored
+                cached = price_downloader.cached_prices(crypto, chunk)
+                missed = sum(price is None for price in cached)
+                logger.warning(f"Could not download {missed} {crypto} prices: {e}")
+                failed += missed
+            progress.update(len(chunk), crypto)
+    if failed > 0:
+        print(
+            f"Could not download {failed} prices, run again to retry", file=sys.stderr
+        )
+    return failed + len(invalid)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="coin2086", description=__doc__.split("\n")[0]
+    )
+    commands = parser.add_subparsers(dest="command")
+    # Not a keyword argument of add_subparsers before Python 3.7
+    commands.required = True
+    prefetch_parser = commands.add_parser(
+        "prefetch",
+        help="Download the prices needed to valuate trades files into a price store",
+    )
+    prefetch_parser.add_argument(
+        "trades", nargs="+", help="CSV files of trades in the coin2086 input format"
+    )
+    prefetch_parser.add_argument(
+        "--store",
+        help="The SQLite price store to fill. Defaults to the "
+        f"{pricestore.PRICE_STORE_ENV_VAR} environment variable",
+    )
+    prefetch_parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Only download the prices needed to compute the taxable PnLs, "
+        "as valuate_portfolio(sparse=True) does",
+    )
+    prefetch_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=500,
+        help="The number of prices downloaded between progress reports",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s: %(message)s")
+    if args.store is not None:
+        store = pricestore.SQLitePriceStore(args.store)
+    else:
+        store = pricestore.default_price_store()
+    if store is None:
+        print(
+            f"No price store to fill: pass --store, or set the "
+            f"{pricestore.PRICE_STORE_ENV_VAR} environment variable",
+            file=sys.stderr,
+        )
+        return 2
+    failures = prefetch(args.trades, store, args.sparse, args.chunk_size)
+    return 1 if failures > 0 else 0
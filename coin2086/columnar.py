@@ -0,0 +1,106 @@
+"""A compact columnar file format for trades, that can be written batch by
+batch and read back without parsing.
+
+A columnar trades file is a directory holding one raw binary file per
+column, and a meta.json file describing them. Categorical columns are stored
+as integer codes, with their categories in meta.json.
+"""
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+CODES_DTYPE = np.dtype("int16")
+
+
+class ColumnarTradesWriter:
+    """Appends batches of trades to a columnar trades file, without holding
+    more than one batch in memory::
+
+        with ColumnarTradesWriter("trades.columns") as writer:
+            for batch in batches:
+                writer.append(batch)
+
+    Args:
+        directory (str or pathlib.Path): The directory of the file. It is
+            created if needed, and any file it holds is overwritten.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.length = 0
+        self.columns = None
+        self._files = {}
+
+    def _column_path(self, name):
+        return self.directory / (name + ".bin")
+
+    def _open(self, batch):
+        self.columns = {}
+        for name, dtype in batch.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                self.columns[name] = {"dtype": "category", "categories": []}
+            else:
+                self.columns[name] = {"dtype": np.dtype(dtype).str}
+            self._files[name] = open(self._column_path(name), "wb")
+
+    def append(self, batch):
+        """Appends the trades of the DataFrame batch, that must have the same
+        columns and dtypes as the previous batches"""
+        if self.columns is None:
+            self._open(batch)
+        for name, column in self.columns.items():
+            values = batch[name]
+            if column["dtype"] == "category":
+                categories = column["categories"]
+                new = [c for c in values.cat.categories if c not in categories]
+                categories.extend(new)
+                values = pd.Categorical(values, categories=categories).codes
+                values = values.astype(CODES_DTYPE)
+            else:
+                values = values.values.astype(column["dtype"])
+            self._files[name].write(np.ascontiguousarray(values).tobytes())
+        self.length += len(batch)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        meta = {"length": self.length, "columns": self.columns or {}}
+        (self.directory / "meta.json").write_text(json.dumps(meta))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_columnar_trades(directory, mmap=False):
+    """Reads a columnar trades file written by ColumnarTradesWriter
+
+    Args:
+        directory (str or pathlib.Path): The directory of the file.
+        mmap (bool): If True, numeric columns are memory-mapped instead of
+            read in memory.
+
+    Returns:
+        pandas.DataFrame: The trades, with a RangeIndex.
+    """
+    directory = pathlib.Path(directory)
+    meta = json.loads((directory / "meta.json").read_text())
+    length = meta["length"]
+    data = {}
+    for name, column in meta["columns"].items():
+        path = directory / (name + ".bin")
+        is_category = column["dtype"] == "category"
+        dtype = CODES_DTYPE if is_category else np.dtype(column["dtype"])
+        if mmap and length > 0:
+            values = np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+        else:
+            values = np.fromfile(path, dtype=dtype, count=length)
+        if is_category:
+            values = pd.Categorical.from_codes(values, column["categories"])
+        data[name] = values
+    return pd.DataFrame(data, index=pd.RangeIndex(length))
@@ -0,0 +1,171 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+from . import pricedownload
+from .validation import check_trade
+
+
+COPIED_COLUMNS = [
+    "datetime",
+    "trade_side",
+    "cryptocurrency",
+    "quantity",
+    "amount",
+    "fee",
+]
+
+
+DETAILED_PNL_COLUMNS = [
+    "datetime",
+    "trade_side",
+    "cryptocurrency",
+    "quantity",
+    "amount",
+    "fee",
+    "amount_net",
+    "portfolio_value",
+    "portfolio_purchase_price",
+    "purchase_price_fraction",
+    "purchase_price_fraction_sum",
+    "portfolio_purchase_price_net",
+    "pnl",
+]
+
+
+class IncrementalPnlEngine:
+    """Computes taxable PnLs incrementally, one trade at a time
+
+    :py:func:`coin2086.compute_taxable_pnls_detailed` processes the whole
+    history of trades on every call. This engine instead holds the running
+    state of the portfolio (the quantity of each crypto-currency, the
+    portfolio purchase price and the sum of the purchase price fractions
+    sold), so that appending trades to an history costs as much as the new
+    trades only. Each sale produces the same line as
+    :py:func:`coin2086.compute_taxable_pnls_detailed`::
+
+        engine = coin2086.IncrementalPnlEngine()
+        sales = engine.push_many(trades)
+        # Later on, when new trades are known
+        new_sales = engine.push_many(new_trades)
+
+    Args:
+        initial_portfolio (dict): .. include:: ../../docs/includes/arg_initial_portfolio.rst
+        initial_purchase_price (float): The purchase price of the initial_portfolio
+        price_downloader (coin2086.pricedownload.PriceDownloader): The source of
+            public prices used to valuate the portfolio. Defaults to the
+            reference price downloader used by :py:func:`coin2086.valuate_portfolio`.
+    """
+
+    def __init__(
+        self, initial_portfolio=None, initial_purchase_price=0.0, price_downloader=None
+    ):
+        self.initial_portfolio = dict(initial_portfolio or {})
+        self.initial_purchase_price = initial_purchase_price
+        self.price_downloader = price_downloader
+        # The running sums are kept apart from the initial portfolio, and
+        # added to it when used, as compute_taxable_pnls_detailed does
+        self.traded_quantities = collections.defaultdict(float)
+        self.bought_purchase_price = 0.0
+        self.purchase_price_fraction_sum = 0.0
+        self.last_datetime = None
+
+    @property
+    def quantities(self):
+        """The quantity of each crypto-currency currently in the portfolio"""
+        cryptos = set(self.initial_portfolio) | set(self.traded_quantities)
+        return {c: self._quantity(c) for c in sorted(cryptos)}
+
+    @property
+    def portfolio_purchase_price(self):
+        """The total purchase price of the portfolio, not accounting for sales"""
+        return self.bought_purchase_price + self.initial_purchase_price
+
+    def _quantity(self, crypto):
+        return self.traded_quantities[crypto] + self.initial_portfolio.get(crypto, 0.0)
+
+    def _portfolio_value(self, sold_crypto, sell_price, dtime):
+        price_downloader = self.price_downloader
+        if price_downloader is None:
+            price_downloader = pricedownload.reference_price_downloader()
+        values = []
+        for crypto, quantity in self.quantities.items():
+            if quantity == 0:
+                values.append(0.0)
+            elif crypto == sold_crypto:
+                values.append(sell_price * quantity)
+            else:
+                price = price_downloader.download_price(crypto, dtime)
+                values.append(price * quantity)
+        return np.sum(values)
+
+    def push(self, trade):
+        """Adds a trade to the portfolio
+
+        Args:
+            trade (dict or pandas.Series): A trade, with the columns described
+                in :ref:`Input Format`. Trades must be pushed by increasing
+                datetime.
+
+        Returns:
+            dict: For a sale, the line that
+            :py:func:`coin2086.compute_taxable_pnls_detailed` would output for
+            it. None for a purchase.
+        """
+        check_trade(trade, self.last_datetime)
+        dtime = pd.to_datetime(trade["datetime"])
+        self.last_datetime = dtime
+        crypto = trade["cryptocurrency"]
+        if trade["trade_side"] == "BUY":
+            self.traded_quantities[crypto] += trade["quantity"]
+            self.bought_purchase_price += trade["amount"] + trade["fee"]
+            return None
+        value = self._portfolio_value(crypto, trade["price"], dtime.to_pydatetime())
+        self.traded_quantities[crypto] += -trade["quantity"]
+        purchase_price = self.portfolio_purchase_price
+        fraction_sum = self.purchase_price_fraction_sum
+        purchase_price_net = purchase_price - fraction_sum
+        fraction = purchase_price_net * (trade["amount"] / value)
+        self.purchase_price_fraction_sum += fraction
+        amount_net = trade["amount"] - trade["fee"]
+        return {
+            "datetime": dtime,
+            "trade_side": trade["trade_side"],
+            "cryptocurrency": crypto,
+            "quantity": trade["quantity"],
+            "amount": trade["amount"],
+            "fee": trade["fee"],
+            "amount_net": amount_net,
+            "portfolio_value": value,
+            "portfolio_purchase_price": purchase_price,
+            "purchase_price_fraction": fraction,
+            "purchase_price_fraction_sum": fraction_sum,
+            "portfolio_purchase_price_net": purchase_price_net,
+            "pnl": amount_net - fraction,
+        }
+
+    def push_many(self, trades):
+        """Adds a DataFrame of trades to the portfolio
+
+        Args:
+            trades (pandas.DataFrame): The trades, sorted by increasing
+                datetime, with the columns described in :ref:`Input Format`.
+
+        Returns:
+            pandas.DataFrame: The lines that
+            :py:func:`coin2086.compute_taxable_pnls_detailed` would output for
+            the sales in trades, indexed by the indexes of these sales.
+        """
+        index = []
+        rows = []
+        for idx, trade in zip(trades.index, trades.to_dict(orient="records")):
+            row = self.push(trade)
+            if row is not None:
+                index.append(idx)
+                rows.append(row)
+        sales = pd.DataFrame(rows, index=index, columns=DETAILED_PNL_COLUMNS)
+        # Also give the right types to the columns when there is no sale
+        dtypes = {col: np.dtype(float) for col in DETAILED_PNL_COLUMNS}
+        dtypes.update({col: trades[col].dtype for col in COPIED_COLUMNS})
+        return sales.astype(dtypes)
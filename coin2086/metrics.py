@@ -0,0 +1,150 @@
+"""Counters describing where a run of coin2086 spends its time.
+
+Metrics are only recorded while a collector is active::
+
+    with coin2086.collect_metrics() as metrics:
+        coin2086.compute_taxable_pnls(trades, 2021)
+    metrics.as_dict()
+
+To act on events as they happen, subclass Metrics, override its on_* hooks
+and pass an instance to collect_metrics.
+"""
+import time
+import threading
+import contextlib
+import collections
+
+_collectors = ()
+_collectors_lock = threading.Lock()
+
+
+class Metrics:
+    """The counters recorded while collect_metrics is active.
+
+    Attributes:
+        stages (dict): Maps each stage of the valuation and PnL computation
+            to its number of calls and total wall time in seconds.
+        cache (dict): Maps each price source to its number of cache hits and
+            misses. A miss is a price that had to be downloaded.
+        http (dict): Maps each exchange API endpoint to its number of
+            requests and errors, its total latency in seconds, and the number
+            of bytes received.
+        fallbacks (dict): Maps each price source to the number of times it
+            failed to download a price, and the next source was tried.
+        counts (dict): Maps the name of other counters to their total, such
+            as sparse_skipped_lookups, the number of public prices a sparse
+            valuation did not look up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = collections.defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+        self.cache = collections.defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.http = collections.defaultdict(
+            lambda: {"requests": 0, "errors": 0, "seconds": 0.0, "bytes": 0}
+        )
+        self.fallbacks = collections.defaultdict(int)
+        self.counts = collections.defaultdict(int)
+
+    def on_stage(self, name, seconds):
+        with self._lock:
+            stage = self.stages[name]
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+
+    def on_cache(self, source, hit):
+        with self._lock:
+            self.cache[source]["hits" if hit else "misses"] += 1
+
+    def on_http(self, endpoint, seconds, nbytes, error):
+        with self._lock:
+            http = self.http[endpoint]
+            http["requests"] += 1
+            http["errors"] += int(error)
+            http["seconds"] += seconds
+            http["bytes"] += nbytes
+
+    def on_fallback(self, source, crypto):
+        with self._lock:
+            self.fallbacks[source] += 1
+
+    def on_count(self, name, count):
+        with self._lock:
+            self.counts[name] += count
+
+    def cache_hit_rate(self, source):
+        """Returns the fraction of the prices of source served from cache"""
+        counts = self.cache[source]
+        total = counts["hits"] + counts["misses"]
+        return counts["hits"] / total if total > 0 else float("nan")
+
+    def as_dict(self):
+        """Returns all the counters as plain dicts, e.g. to dump them as JSON"""
+        with self._lock:
+            return {
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "cache": {k: dict(v) for k, v in self.cache.items()},
+                "http": {k: dict(v) for k, v in self.http.items()},
+                "fallbacks": dict(self.fallbacks),
+                "counts": dict(self.counts),
+            }
+
+
+@contextlib.contextmanager
+def collect_metrics(metrics=None):
+    """Records metrics about everything coin2086 does in the with block, in
+    all threads, and yields the Metrics holding them.
+
+    Args:
+        metrics (coin2086.metrics.Metrics): The collector to record into,
+            for instance an instance of a subclass overriding the on_*
+            hooks. A new Metrics by default.
+    """
+    global _collectors
+    metrics = Metrics() if metrics is None else metrics
+    with _collectors_lock:
+        _collectors = _collectors + (metrics,)
+    try:
+        yield metrics
+    finally:
+        with _collectors_lock:
+            _collectors = tuple(c for c in _collectors if c is not metrics)
+
+
+def is_collecting():
+    return len(_collectors) > 0
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Records the wall time of the with block as stage name"""
+    if not is_collecting():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        for collector in _collectors:
+            collector.on_stage(name, seconds)
+
+
+def record_cache(source, hit):
+    for collector in _collectors:
+        collector.on_cache(source, hit)
+
+
+def record_http(endpoint, seconds, nbytes, error=False):
+    for collector in _collectors:
+        collector.on_http(endpoint, seconds, nbytes, error)
+
+
+def record_fallback(source, crypto):
+    for collector in _collectors:
+        collector.on_fallback(source, crypto)
+
+
+def record_count(name, count):
+    for collector in _collectors:
+        collector.on_count(name, count)
@@ -1,8 +1,13 @@
 import logging
-import datetime as dt
+import threading
 
+import numpy as np
+import pandas as pd
+
+from . import metrics
+from . import resultcache
 from . import valuation
-from .validation import check_trades
+from .validation import unwrap_trades, validate_trades
 
 logger = logging.getLogger(__name__)
 
@@ -16,16 +21,29 @@ def add_portfolio_purchase_price(trades, initial_purchase_price):
     trades["portfolio_purchase_price"] += initial_purchase_price
 
 
-def filter_sales_add_portfolio_value(trades, initial_portfolio):
-    portfolio = valuation.valuate_portfolio(trades, initial_portfolio)
-    print("Valuate done")
-    value = portfolio["value", "TOTAL"]
-    value = value.rename("portfolio_value").to_frame()
-    sales = trades.join(value, how="inner")
+def filter_sales_add_portfolio_value(
+    trades, initial_portfolio, max_workers=None, price_downloader=None
+):
+    # Only the total value is used: skip the prices that do not contribute to
+    # it, and do not build the valuation DataFrame
+    portfolio = valuation.valuate_portfolio_arrays(
+        trades,
+        initial_portfolio,
+        max_workers,
+        sparse=True,
+        price_downloader=price_downloader,
+    )
+    return filter_sales_join_portfolio_value(trades, portfolio)
+
+
+def filter_sales_join_portfolio_value(trades, portfolio):
+    total = portfolio.total.astype(portfolio.dtypes.get("value", float))
+    value = pd.Series(total, index=portfolio.index, name="portfolio_value")
+    sales = trades.join(value.to_frame(), how="inner")
     return sales
 
 
-def compute_purchase_price_fraction(
+def compute_purchase_price_fraction_loop(
     amount, value, purchase_price, purchase_price_net, fraction, fraction_sum
 ):
     frac_sum = 0
@@ -42,8 +60,95 @@ def compute_purchase_price_fraction(
         frac_sum += fraction[i]
 
 
+# Prefix scans are restarted before the running product of the unsold
+# percentages falls below this, so that dividing by it cannot overflow. All
+# the terms of the scan are positive, so the scan does not lose precision.
+MIN_SCAN_DECAY = 1e-150
+MIN_SCAN_SIZE = 16
+MAX_SCAN_SIZE = 1 << 16
+
+
+def compute_purchase_price_fraction_vectorized(
+    amount, value, purchase_price, purchase_price_net, fraction, fraction_sum
+):
+    # With r the percentage sold and P the purchase price, the sum of fractions
+    # follows the linear recurrence S[i + 1] = (1 - r[i]) * S[i] + P[i] * r[i].
+    # Over a range starting at lo, with C[j] the running product of (1 - r)
+    # from lo to j, this is S[j + 1] = C[j] * (S[lo] + cumsum(P * r / C)[j]),
+    # which is computed with array operations on successive ranges.
+    percentage_sold = amount / value
+    decay = 1.0 - percentage_sold
+    weighted = purchase_price * percentage_sold
+    n = len(amount)
+    frac_sum = 0.0
+    lo = 0
+    size = MIN_SCAN_SIZE
+    while lo < n:
+        hi = min(lo + size, n)
+        prod = np.cumprod(decay[lo:hi])
+        small = np.flatnonzero(np.abs(prod) < MIN_SCAN_DECAY)
+        stop = hi if len(small) == 0 else lo + small[0]
+        if stop > lo:
+            prod = prod[: stop - lo]
+            sums = prod * (frac_sum + np.cumsum(weighted[lo:stop] / prod))
+            fraction_sum[lo] = frac_sum
+            fraction_sum[lo + 1 : stop] = sums[:-1]
+            frac_sum = sums[-1]
+        if stop < hi:
+            # This sale sells (almost) all the portfolio: step over it
+            fraction_sum[stop] = frac_sum
+            frac_sum = decay[stop] * frac_sum + weighted[stop]
+            stop += 1
+        size = min(max(2 * (stop - lo), MIN_SCAN_SIZE), MAX_SCAN_SIZE)
+        lo = stop
+    purchase_price_net[:] = purchase_price - fraction_sum
+    fraction[:] = purchase_price_net * percentage_sold
+
+
+# Below this number of sales, compiling the JIT variant is not worth it
+MIN_JIT_SALES = 100000
+
+# compute_purchase_price_fraction_loop compiled by numba, False if numba is
+# not installed, or None until first needed
+_compute_purchase_price_fraction_jit = None
+_jit_lock = threading.Lock()
+
+
+def get_compute_purchase_price_fraction_jit():
+    """Returns compute_purchase_price_fraction_loop compiled by numba, or None
+    if numba is not installed. numba is only imported when first needed, as
+    importing it takes longer than importing coin2086."""
+    global _compute_purchase_price_fraction_jit
+    with _jit_lock:
+        if _compute_purchase_price_fraction_jit is None:
+            try:
+                import numba
+            except ImportError:
+                _compute_purchase_price_fraction_jit = False
+            else:
+                _compute_purchase_price_fraction_jit = numba.njit(cache=True)(
+                    compute_purchase_price_fraction_loop
+                )
+        return _compute_purchase_price_fraction_jit or None
+
+
+def compute_purchase_price_fraction(
+    amount, value, purchase_price, purchase_price_net, fraction, fraction_sum
+):
+    compute = None
+    if len(amount) >= MIN_JIT_SALES:
+        compute = get_compute_purchase_price_fraction_jit()
+    if compute is None:
+        compute = compute_purchase_price_fraction_vectorized
+    compute(amount, value, purchase_price, purchase_price_net, fraction, fraction_sum)
+
+
 def compute_taxable_pnls_detailed(
-    trades, initial_portfolio=None, initial_purchase_price=0.0
+    trades,
+    initial_portfolio=None,
+    initial_purchase_price=0.0,
+    max_workers=None,
+    price_downloader=None,
 ):
     """Computes your taxable PnL for each sale in the trades DataFrame
 
@@ -172,16 +277,41 @@ def compute_taxable_pnls_detailed(
         trades (pandas.DataFrame): .. include:: ../../docs/includes/arg_trades.rst
         initial_portfolio (dict):  .. include:: ../../docs/includes/arg_initial_portfolio.rst
         initial_purchase_price (float): The purchase price of the initial_portfolio
+        max_workers (int): If given, prices are downloaded concurrently on a
+            pool of max_workers threads (see :py:func:`coin2086.valuate_portfolio`)
+        price_downloader (coin2086.pricedownload.PriceDownloader): The source of
+            public prices used to valuate the portfolio (see
+            :py:func:`coin2086.valuate_portfolio`)
 
     Returns:
         pandas.DataFrame: The DataFrame containing the information to be reported
         on form 2086 for each sale in the trades DataFrame.
     """
 
-    check_trades(trades)
-    trades = trades.copy()
-    add_portfolio_purchase_price(trades, initial_purchase_price)
-    sales = filter_sales_add_portfolio_value(trades, initial_portfolio)
+    trades = unwrap_trades(trades)
+
+    def compute():
+        purchases = trades.copy()
+        with metrics.stage("add_portfolio_purchase_price"):
+            add_portfolio_purchase_price(purchases, initial_purchase_price)
+        sales = filter_sales_add_portfolio_value(
+            purchases, initial_portfolio, max_workers, price_downloader
+        )
+        return compute_pnls_of_sales(sales)
+
+    parameters = {
+        "initial_portfolio": initial_portfolio,
+        "initial_purchase_price": initial_purchase_price,
+    }
+    return resultcache.memoize(
+        "compute_taxable_pnls_detailed", trades, parameters, price_downloader, compute
+    )
+
+
+def compute_pnls_of_sales(sales):
+    """Computes the PnL of each sale, given the portfolio_value and
+    portfolio_purchase_price before it, and returns the DataFrame output by
+    compute_taxable_pnls_detailed"""
     sales = sales[
         [
             "datetime",
@@ -197,14 +327,15 @@ def compute_taxable_pnls_detailed(
     sales["portfolio_purchase_price_net"] = 0.0
     sales["purchase_price_fraction_sum"] = 0.0
     sales["purchase_price_fraction"] = 0.0
-    compute_purchase_price_fraction(
-        sales["amount"].values,
-        sales["portfolio_value"].values,
-        sales["portfolio_purchase_price"].values,
-        sales["portfolio_purchase_price_net"].values,
-        sales["purchase_price_fraction"].values,
-        sales["purchase_price_fraction_sum"].values,
-    )
+    with metrics.stage("compute_purchase_price_fraction"):
+        compute_purchase_price_fraction(
+            sales["amount"].values,
+            sales["portfolio_value"].values,
+            sales["portfolio_purchase_price"].values,
+            sales["portfolio_purchase_price_net"].values,
+            sales["purchase_price_fraction"].values,
+            sales["purchase_price_fraction_sum"].values,
+        )
     sales["amount_net"] = sales["amount"] - sales["fee"]
     sales["pnl"] = sales["amount_net"] - sales["purchase_price_fraction"]
     sales = sales[
@@ -228,7 +359,12 @@ def compute_taxable_pnls_detailed(
 
 
 def compute_taxable_pnls(
-    trades, year, initial_portfolio=None, initial_purchase_price=0.0
+    trades,
+    year,
+    initial_portfolio=None,
+    initial_purchase_price=0.0,
+    max_workers=None,
+    price_downloader=None,
 ):
     """
     Computes your taxable PnL for each sale in the trades DataFrame
@@ -309,19 +445,80 @@ def compute_taxable_pnls(
             last year.
         initial_portfolio (dict): .. include:: ../../docs/includes/arg_initial_portfolio.rst
         initial_purchase_price (float): The purchase price of the initial_portfolio
+        max_workers (int): If given, prices are downloaded concurrently on a
+            pool of max_workers threads (see :py:func:`coin2086.valuate_portfolio`)
+        price_downloader (coin2086.pricedownload.PriceDownloader): The source of
+            public prices used to valuate the portfolio (see
+            :py:func:`coin2086.valuate_portfolio`)
 
     Returns:
         (pandas.DataFrame, float): The DataFrame containing the information
         to be reported on form 2086 for each sale in the ``trades`` DataFrame,
         with the sum of the PnLs (Plus et moins values)
     """
-    check_trades(trades)
+    reports = compute_taxable_pnls_by_year(
+        trades,
+        [year],
+        initial_portfolio,
+        initial_purchase_price,
+        max_workers,
+        price_downloader,
+    )
+    return reports[year]
+
+
+def compute_taxable_pnls_by_year(
+    trades,
+    years=None,
+    initial_portfolio=None,
+    initial_purchase_price=0.0,
+    max_workers=None,
+    price_downloader=None,
+):
+    """
+    Computes your taxable PnL for each sale in the trades DataFrame, for
+    several years at once
+
+    This returns the same DataFrame and sum of PnLs as
+    :py:func:`coin2086.compute_taxable_pnls` for each year, but the trades
+    are valuated only once for all the years::
+
+        reports = coin2086.compute_taxable_pnls_by_year(trades, [2020, 2021])
+        form2086, taxable_profit = reports[2021]
+
+    Args:
+        trades (pandas.DataFrame): .. include:: ../../docs/includes/arg_trades.rst
+        years (list of int): The years to report your trades for. By default,
+            all the years in which you sold crypto-currencies are reported.
+        initial_portfolio (dict): .. include:: ../../docs/includes/arg_initial_portfolio.rst
+        initial_purchase_price (float): The purchase price of the initial_portfolio
+        max_workers (int): If given, prices are downloaded concurrently on a
+            pool of max_workers threads (see :py:func:`coin2086.valuate_portfolio`)
+        price_downloader (coin2086.pricedownload.PriceDownloader): The source of
+            public prices used to valuate the portfolio (see
+            :py:func:`coin2086.valuate_portfolio`)
+
+    Returns:
+        dict: A dict mapping each year to the (pandas.DataFrame, float) pair
+        returned by :py:func:`coin2086.compute_taxable_pnls` for this year
+    """
+    trades = validate_trades(trades)
     sales = compute_taxable_pnls_detailed(
-        trades, initial_portfolio, initial_purchase_price
+        trades, initial_portfolio, initial_purchase_price, max_workers, price_downloader
     )
-    start_date = dt.datetime.combine(dt.date(year, 1, 1), dt.time.min)
-    end_date = dt.datetime.combine(dt.date(year, 12, 31), dt.time.max)
-    sales = sales[(sales["datetime"] >= start_date) & (sales["datetime"] <= end_date)]
+    sale_years = sales["datetime"].dt.year.values
+    positions_by_year = pd.Series(sale_years).groupby(sale_years).indices
+    if years is None:
+        years = sorted(positions_by_year.keys())
+    reports = {}
+    for year in years:
+        positions = positions_by_year.get(year, [])
+        with metrics.stage("format_form_2086"):
+            reports[year] = format_form_2086(sales.iloc[positions].copy())
+    return reports
+
+
+def format_form_2086(sales):
     total_pnl = sales["pnl"].sum()
     sales["Description"] = sales["description"] = (
         sales["trade_side"]
@@ -0,0 +1,170 @@
+"""The in-memory cache of the prices of a price downloader, optionally bounded
+in size.
+
+Prices are cached by blocks holding the prices of one crypto-currency during
+one day, and are evicted block by block, so that the prices of the periods a
+portfolio trades in stay cached together.
+"""
+import os
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+
+PRICE_CACHE_MAX_ENTRIES_ENV_VAR = "COIN2086_PRICE_CACHE_MAX_ENTRIES"
+PRICE_CACHE_POLICY_ENV_VAR = "COIN2086_PRICE_CACHE_POLICY"
+
+POLICIES = ("lru", "lfu")
+
+
+class PriceCache:
+    """Thread-safe in-memory cache of the prices of crypto-currencies.
+
+    When the cache holds more than max_entries prices, whole blocks (the
+    prices of one crypto-currency during one day) are evicted until it holds
+    at most max_entries prices again. The blocks a price was just stored in
+    are never evicted, so that the cache may exceed max_entries if a single
+    put stores more prices:
+
+    - with the "lru" policy, the least recently used blocks are evicted first,
+    - with the "lfu" policy, the least frequently used blocks are evicted
+      first, and the least recently used among those.
+
+    Args:
+        max_entries (int): The maximum number of prices held. Unbounded if
+            None.
+        policy (str): The eviction policy, "lru" or "lfu".
+    """
+
+    def __init__(self, max_entries=None, policy="lru"):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Unknown cache policy {policy}, expected one of {POLICIES}"
+            )
+        if max_entries is not None and max_entries < 1:
+            raise ValueError(f"max_entries must be positive, got {max_entries}")
+        self.max_entries = max_entries
+        self.policy = policy
+        # Blocks are ordered from the least to the most recently used
+        self._blocks = collections.OrderedDict()
+        self._uses = {}
+        self._entries = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_entries = 0
+
+    @staticmethod
+    def block_key(crypto, dtime):
+        return (crypto, dtime.date())
+
+    def __len__(self):
+        return self._entries
+
+    def _use(self, key):
+        self._blocks.move_to_end(key)
+        self._uses[key] += 1
+
+    def get(self, crypto, dtime):
+        """Returns the cached price of crypto at dtime, or None"""
+        key = self.block_key(crypto, dtime)
+        with self._lock:
+            block = self._blocks.get(key)
+            price = None if block is None else block.get(dtime)
+            if price is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._use(key)
+            return price
+
+    def get_many(self, crypto, dtimes):
+        """Returns a dict mapping those of dtimes whose price of crypto is
+        cached to their price"""
+        prices = {}
+        with self._lock:
+            for dtime in dtimes:
+                key = self.block_key(crypto, dtime)
+                block = self._blocks.get(key)
+                price = None if block is None else block.get(dtime)
+                if price is None:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                self._use(key)
+                prices[dtime] = price
+        return prices
+
+    def put(self, crypto, prices):
+        """Caches prices, an iterable of (datetime, price) pairs, of crypto"""
+        with self._lock:
+            used = {}
+            for dtime, price in prices:
+                key = self.block_key(crypto, dtime)
+                block = self._blocks.get(key)
+                if block is None:
+                    block = self._blocks[key] = {}
+                    self._uses[key] = 0
+                if dtime not in block:
+                    self._entries += 1
+                block[dtime] = price
+                used[key] = None
+            # Storing many prices in a block counts as a single use
+            for key in used:
+                self._use(key)
+            self._evict(keep=used)
+
+    def _evict(self, keep):
+        """Evicts blocks other than the ones in keep until the cache holds at
+        most max_entries prices"""
+        if self.max_entries is None:
+            return
+        while self._entries > self.max_entries:
+            candidates = (key for key in self._blocks if key not in keep)
+            if self.policy == "lru":
+                key = next(candidates, None)
+            else:
+                # min returns the first least used block, in LRU order
+                key = min(candidates, key=self._uses.__getitem__, default=None)
+            if key is None:
+                break
+            block = self._blocks.pop(key)
+            del self._uses[key]
+            self._entries -= len(block)
+            self.evictions += 1
+            self.evicted_entries += len(block)
+            logger.debug(f"Evicted {len(block)} cached prices of {key}")
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._uses.clear()
+            self._entries = 0
+
+    def stats(self):
+        """Returns a dict with the number of prices and blocks cached, the
+        number of hits and misses, and the number of blocks and prices
+        evicted"""
+        with self._lock:
+            return {
+                "entries": self._entries,
+                "blocks": len(self._blocks),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "evicted_entries": self.evicted_entries,
+            }
+
+
+def default_price_cache(max_entries=None, policy=None):
+    """Returns a new PriceCache. Unless given, max_entries and policy are read
+    from the COIN2086_PRICE_CACHE_MAX_ENTRIES and COIN2086_PRICE_CACHE_POLICY
+    environment variables, and default to an unbounded LRU cache"""
+    if max_entries is None:
+        max_entries = os.environ.get(PRICE_CACHE_MAX_ENTRIES_ENV_VAR) or None
+    if policy is None:
+        policy = os.environ.get(PRICE_CACHE_POLICY_ENV_VAR) or "lru"
+    return PriceCache(None if max_entries is None else int(max_entries), policy)
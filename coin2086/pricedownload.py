@@ -1,18 +1,31 @@
+import bisect
 import collections
 import logging
 import abc
 import threading
 import datetime as dt
 
-import requests
+import numpy as np
 import pandas as pd
 
+from . import metrics
+from . import pricecache
+from . import pricestore
+from . import transport
+
 logger = logging.getLogger(__name__)
 
 
 TradingPair = collections.namedtuple("TradingPair", ["base", "quote"])
 
 
+class MissingPriceError(RuntimeError):
+    """Raised when a source answered, but does not have the price of a
+    crypto-currency at a datetime: no bin or trade covers it"""
+
+    pass
+
+
 class PriceDownloader(abc.ABC):
     @abc.abstractmethod
     def download_price(self, crypto, dtime):
@@ -22,23 +35,238 @@ class PriceDownloader(abc.ABC):
     def supported_crypto_list(self):
         pass
 
+    def download_prices(self, crypto, dtimes):
+        """Returns the list of the prices of crypto at each of dtimes. Sources
+        that can download several prices at once override this method to
+        download the missing prices with as few requests as possible."""
+        self.prefetch(crypto, dtimes)
+        return [self.download_price(crypto, d) for d in dtimes]
+
+    def plan_downloads(self, crypto, dtimes):
+        """Splits dtimes into groups whose prices may be downloaded
+        independently, for instance concurrently, with one download_prices
+        call per group. Sources that download several prices at once override
+        this method to split dtimes along the requests they would send."""
+        return [list(dtimes)]
+
+    def prefetch(self, crypto, dtimes):
+        """Downloads ahead of time, with as few requests as possible, the
+        prices of crypto at all the given datetimes, so that later calls to
+        download_price are served from the cache. Sources that cannot download
+        several prices at once do not need to override this method."""
+        pass
+
+    def cached_price(self, crypto, dtime):
+        """Returns the price of crypto at dtime if it is known without any
+        download, or None"""
+        return None
+
+    def cached_prices(self, crypto, dtimes):
+        """Returns the list of the cached_price of crypto at each of dtimes"""
+        return [self.cached_price(crypto, d) for d in dtimes]
+
+    def memory_cached_prices(self, crypto, dtimes):
+        """Returns the list of the prices of crypto at each of dtimes that are
+        known without any I/O, such as reading a price store, or None"""
+        return [None] * len(dtimes)
+
 
 class CachedPriceDownloader(PriceDownloader):
     """Base class for crypto-currency price downloader classes.
     This class maintains a cache so that child classes can avoid
-    hitting exchange or data providers  APIs too often
+    hitting exchange or data providers  APIs too often.
+
+    The cache lives in memory (see :py:class:`coin2086.pricecache.PriceCache`),
+    and is optionally backed by a persistent price store (see
+    :py:class:`coin2086.pricestore.SQLitePriceStore`) that is checked before
+    any download, and that is shared across processes and runs. The cache may
+    be used concurrently from several threads.
+
+    The list of supported crypto-currencies is only discovered when first
+    needed, and is also kept in the price store for SUPPORTED_CRYPTOS_TTL.
+
+    When several threads miss the same price at the same time, it is
+    downloaded by the first of them only, the others waiting for it.
     """
 
-    def __init__(self):
-        self.cache = collections.defaultdict(dict)
+    SOURCE_NAME = None
+    SUPPORTED_CRYPTOS_TTL = dt.timedelta(days=1)
+
+    def __init__(self, store=None, cache=None):
+        self.cache = pricecache.default_price_cache() if cache is None else cache
+        self.store = store
+        # Maps the (crypto, datetime) keys being downloaded to an Event set
+        # once they are
+        self._downloading = {}
+        self._downloading_lock = threading.Lock()
+        self._supported_crypto_list = None
+        self._supported_crypto_list_lock = threading.Lock()
+
+    @property
+    def supported_crypto_list(self):
+        with self._supported_crypto_list_lock:
+            if self._supported_crypto_list is None:
+                self._supported_crypto_list = self._load_supported_crypto_list()
+        return self._supported_crypto_list
+
+    def _load_supported_crypto_list(self):
+        if self.store is not None:
+            cryptos = self.store.get_supported_cryptos(
+                self.SOURCE_NAME, self.SUPPORTED_CRYPTOS_TTL
+            )
+            if cryptos is not None:
+                return cryptos
+        cryptos = self._download_supported_crypto_list()
+        if self.store is not None:
+            self.store.put_supported_cryptos(self.SOURCE_NAME, cryptos)
+        return cryptos
+
+    def _round_datetime(self, dtime):
+        """Returns the datetime prices are cached at for dtime"""
+        return dtime
+
+    def _round_datetimes(self, dtimes):
+        """Returns the list of the _round_datetime of each of dtimes"""
+        return [self._round_datetime(d) for d in dtimes]
+
+    def cached_price(self, crypto, dtime):
+        return self.find_price_in_cache(crypto, self._round_datetime(dtime))
+
+    def cached_prices(self, crypto, dtimes):
+        dtimes = self._round_datetimes(dtimes)
+        prices = self.find_prices_in_cache(crypto, dict.fromkeys(dtimes))
+        return [prices.get(d) for d in dtimes]
+
+    def memory_cached_prices(self, crypto, dtimes):
+        dtimes = self._round_datetimes(dtimes)
+        prices = self.cache.get_many(crypto, dict.fromkeys(dtimes))
+        return [prices.get(d) for d in dtimes]
+
+    def plan_downloads(self, crypto, dtimes):
+        rounded = self._round_datetimes(dtimes)
+        cached = self.find_prices_in_cache(crypto, dict.fromkeys(rounded))
+        missing = sorted(set(d for d in rounded if d not in cached))
+        group_of = dict(zip(missing, self._plan_missing_downloads(missing)))
+        groups = collections.defaultdict(list)
+        for dtime, rounded_dtime in zip(dtimes, rounded):
+            groups[group_of.get(rounded_dtime)].append(dtime)
+        return list(groups.values())
+
+    def _plan_missing_downloads(self, dtimes):
+        """Returns the group of each of the rounded and sorted dtimes, whose
+        prices are not cached. Each price is downloaded on its own by
+        default."""
+        return range(len(dtimes))
+
+    def download_prices(self, crypto, dtimes):
+        dtimes = self._round_datetimes(dtimes)
+        distinct = list(dict.fromkeys(dtimes))
+        prices = self.find_prices_in_cache(crypto, distinct)
+        for dtime in distinct:
+            metrics.record_cache(self.SOURCE_NAME, dtime in prices)
+        missing = [d for d in distinct if d not in prices]
+        if len(missing) > 0:
+            self._download_once(
+                crypto,
+                sorted(missing),
+                lambda dtimes: self._download_prices_add_to_cache(crypto, dtimes),
+            )
+            prices.update(self.find_prices_in_cache(crypto, missing))
+        for dtime in missing:
+            if dtime not in prices:
+                raise MissingPriceError(f"No price for {crypto} at {dtime}")
+        return [prices[d] for d in dtimes]
+
+    def download_price(self, crypto, dtime):
+        dtime = self._round_datetime(dtime)
+        cached_price = self.find_price_in_cache(crypto, dtime)
+        metrics.record_cache(self.SOURCE_NAME, cached_price is not None)
+        if cached_price is None:
+            self._download_once(
+                crypto,
+                [dtime],
+                lambda dtimes: self._download_price_add_to_cache(crypto, dtimes[0]),
+            )
+            cached_price = self.find_price_in_cache(crypto, dtime)
+        if cached_price is None:
+            raise MissingPriceError(f"No price for {crypto} at {dtime}")
+        return cached_price
+
+    def _download_once(self, crypto, dtimes, download):
+        """Calls download with those of the missing dtimes that no other
+        thread is downloading, and waits for the other threads to download
+        the others. The prices other threads failed to download are then
+        downloaded again."""
+        own = []
+        others = {}
+        with self._downloading_lock:
+            for dtime in dtimes:
+                done = self._downloading.get((crypto, dtime))
+                if done is None:
+                    self._downloading[(crypto, dtime)] = threading.Event()
+                    own.append(dtime)
+                else:
+                    others[dtime] = done
+        try:
+            if len(own) > 0:
+                download(own)
+        finally:
+            with self._downloading_lock:
+                for dtime in own:
+                    self._downloading.pop((crypto, dtime)).set()
+        if len(others) == 0:
+            return
+        for done in others.values():
+            done.wait()
+        found = self.find_prices_in_cache(crypto, list(others))
+        failed = [d for d in others if d not in found]
+        if len(failed) > 0:
+            download(failed)
+
+    @abc.abstractmethod
+    def _download_price_add_to_cache(self, crypto, dtime):
+        """Downloads the price of crypto at the rounded dtime, and adds it to
+        the cache"""
+        pass
+
+    def _download_prices_add_to_cache(self, crypto, dtimes):
+        """Downloads the prices of crypto at the rounded and sorted dtimes,
+        and adds them to the cache. One price is downloaded at a time by
+        default, skipping the ones a previous download added to the cache."""
+        for dtime in dtimes:
+            if self.find_price_in_cache(crypto, dtime) is None:
+                self._download_price_add_to_cache(crypto, dtime)
 
     def _add_price_to_cache(self, crypto, dtime, price):
-        crypto_cache = self.cache[crypto]
-        crypto_cache[dtime] = price
+        self._add_prices_to_cache(crypto, [(dtime, price)])
+
+    def _add_prices_to_cache(self, crypto, prices):
+        self.cache.put(crypto, prices)
+        if self.store is not None:
+            self.store.put_prices(self.SOURCE_NAME, crypto, prices)
 
     def find_price_in_cache(self, crypto, dtime):
-        crypto_cache = self.cache[crypto]
-        return crypto_cache.get(dtime)
+        price = self.cache.get(crypto, dtime)
+        if price is None and self.store is not None:
+            price = self.store.get_price(self.SOURCE_NAME, crypto, dtime)
+            if price is not None:
+                self.cache.put(crypto, [(dtime, price)])
+        return price
+
+    def find_prices_in_cache(self, crypto, dtimes):
+        """Returns a dict mapping those of the rounded dtimes whose price is
+        in the cache or in the store to their price"""
+        prices = self.cache.get_many(crypto, dtimes)
+        if self.store is not None:
+            stored = []
+            for dtime in dtimes:
+                if dtime not in prices:
+                    price = self.store.get_price(self.SOURCE_NAME, crypto, dtime)
+                    if price is not None:
+                        stored.append((dtime, price))
+            self.cache.put(crypto, stored)
+            prices.update(stored)
+        return prices
 
 
 def round_datetime(dtime, interval):
@@ -54,35 +282,47 @@ def is_fiat_currency(code):
 
 def bitstamp_download_supported_pairs():
     PAIRS_URL = "https://www.bitstamp.net/api/v2/trading-pairs-info/"
-    resp = requests.get(PAIRS_URL)
+    resp = transport.get_json(PAIRS_URL, endpoint="bitstamp/trading-pairs-info")
     pairs = []
-    for pinfo in resp.json():
+    for pinfo in resp:
         name = pinfo["name"]
         base, quote = name.split("/")
         pairs.append(TradingPair(base=base, quote=quote))
     return pairs
 
 
+BITSTAMP_OHLC_MAX_LIMIT = 1000
+
+
+def plan_minute_bin_requests(minutes, max_limit):
+    """Groups sorted minutes into the fewest (start, limit) OHLC range requests
+    of at most max_limit minute bins that cover all of them"""
+    max_span = dt.timedelta(minutes=max_limit)
+    groups = []
+    for minute in minutes:
+        if len(groups) == 0 or minute - groups[-1][0] >= max_span:
+            groups.append([minute, minute])
+        groups[-1][1] = minute
+    return [
+        (first, int((last - first).total_seconds()) // 60 + 1) for first, last in groups
+    ]
+
+
 def bitstamp_download_minute_bins(crypto, dtime, limit=100):
     OHLC_URL = "https://www.bitstamp.net/api/v2/ohlc/{pair}/".format(
         pair=crypto.lower() + "eur"
     )
     parameters = {"start": int(dtime.timestamp()), "step": 60, "limit": limit}
     logger.info(f"Downloading prices from {OHLC_URL}, parameters: {parameters}")
-    resp = requests.get(OHLC_URL, params=parameters)
-    return resp.json()
+    return transport.get_json(OHLC_URL, parameters, endpoint="bitstamp/ohlc")
 
 
 class BitstampMinuteClosePriceDownloader(CachedPriceDownloader):
+    SOURCE_NAME = "bitstamp"
     TIME_INTERVAL = "min"
 
-    def __init__(self):
-        super().__init__()
-        self._supported_crypto_list = self._download_supported_crypto_list()
-
-    @property
-    def supported_crypto_list(self):
-        return self._supported_crypto_list
+    def __init__(self, store=None, cache=None):
+        super().__init__(store, cache)
 
     @staticmethod
     def _download_supported_crypto_list():
@@ -91,20 +331,45 @@ class BitstampMinuteClosePriceDownloader(CachedPriceDownloader):
             [p.base for p in pairs if p.quote == "EUR" and not is_fiat_currency(p.base)]
         )
 
-    def download_price(self, crypto, dtime):
-        dtime = round_datetime(dtime, self.TIME_INTERVAL)
-        cached_price = self.find_price_in_cache(crypto, dtime)
-        if cached_price is None:
-            self._download_price_add_to_cache(crypto, dtime)
-        cached_price = self.find_price_in_cache(crypto, dtime)
-        if cached_price is None:
-            raise RuntimeError(f"Could not download price for {crypto} at {dtime}")
-        return cached_price
-
-    def _download_price_add_to_cache(self, crypto, dtime):
-        resp = bitstamp_download_minute_bins(crypto, dtime)
+    def _round_datetime(self, dtime):
+        return round_datetime(dtime, self.TIME_INTERVAL)
+
+    def _round_datetimes(self, dtimes):
+        if len(dtimes) == 0:
+            return []
+        rounded = pd.DatetimeIndex(dtimes).round(self.TIME_INTERVAL)
+        return list(rounded.to_pydatetime())
+
+    def prefetch(self, crypto, dtimes):
+        minutes = list(dict.fromkeys(self._round_datetimes(dtimes)))
+        cached = self.find_prices_in_cache(crypto, minutes)
+        missing = sorted(m for m in minutes if m not in cached)
+        plan = plan_minute_bin_requests(missing, BITSTAMP_OHLC_MAX_LIMIT)
+        logger.info(
+            f"Prefetching {len(missing)} {crypto} prices with {len(plan)} requests"
+        )
+        for start, limit in plan:
+            try:
+                self._download_price_add_to_cache(crypto, start, limit)
+            except Exception as e:
+                # Missing prices will be downloaded one by one by download_price
+                logger.warning(f"Could not prefetch {crypto} prices at {start}: {e}")
+
+    def _plan_missing_downloads(self, dtimes):
+        # One group per OHLC range request
+        plan = plan_minute_bin_requests(dtimes, BITSTAMP_OHLC_MAX_LIMIT)
+        starts = [start for start, _ in plan]
+        return [bisect.bisect_right(starts, d) - 1 for d in dtimes]
+
+    def _download_prices_add_to_cache(self, crypto, dtimes):
+        for start, limit in plan_minute_bin_requests(dtimes, BITSTAMP_OHLC_MAX_LIMIT):
+            self._download_price_add_to_cache(crypto, start, limit)
+
+    def _download_price_add_to_cache(self, crypto, dtime, limit=100):
+        resp = bitstamp_download_minute_bins(crypto, dtime, limit)
         assert resp["data"]["pair"] == crypto.upper() + "/EUR"
         bins = resp["data"]["ohlc"]
+        prices = []
         for b in bins:
             dtime = dt.datetime.fromtimestamp(int(b["timestamp"]))
             rounded = round_datetime(dtime, self.TIME_INTERVAL)
@@ -113,7 +378,8 @@ class BitstampMinuteClosePriceDownloader(CachedPriceDownloader):
                     f"Bitstamp API returned a bin time that "
                     "is not rounded to {self.time_interval}: {dtime}"
                 )
-            self._add_price_to_cache(crypto, dtime, float(b["close"]))
+            prices.append((dtime, float(b["close"])))
+        self._add_prices_to_cache(crypto, prices)
 
 
 KRAKEN_TO_USUAL_CODEBOOK = {
@@ -160,9 +426,9 @@ def convert_kraken_to_usual_code(code):
 
 def kraken_download_supported_pairs():
     PAIRS_URL = "https://api.kraken.com/0/public/AssetPairs"
-    resp = requests.get(PAIRS_URL)
+    resp = transport.get_json(PAIRS_URL, endpoint="kraken/AssetPairs")
     pairs = []
-    result = resp.json()["result"]
+    result = resp["result"]
     for _, pinfo in result.items():
         base = convert_kraken_to_usual_code(pinfo["base"])
         quote = convert_kraken_to_usual_code(pinfo["quote"])
@@ -170,28 +436,101 @@ def kraken_download_supported_pairs():
     return list(set(pairs))
 
 
-def kraken_download_next_trade_price(crypto, dtime):
+KrakenTradesPage = collections.namedtuple(
+    "KrakenTradesPage", ["since", "times", "prices"]
+)
+KrakenTradesPage.__doc__ = """The trades of a pair returned by one request of
+the Kraken Trades API: all the trades from since (a POSIX timestamp) until the
+last one of the page, with their sorted times and their prices as arrays"""
+
+
+def kraken_download_trades(crypto, since):
     TRADES_URL = "https://api.kraken.com/0/public/Trades"
     pair = crypto + "EUR"
-    since = int(dtime.timestamp())
     params = {"pair": pair, "since": since}
     logger.info(f"Downloading prices from {TRADES_URL}, parameters: {params}")
-    resp = requests.get(TRADES_URL, params=params)
-    result = resp.json()["result"]
+    resp = transport.get_json(TRADES_URL, params, endpoint="kraken/Trades")
+    result = resp["result"]
     trades = list(result.items())[0][1]
-    next_trade = trades[0]
-    price = next_trade[0]
-    return float(price)
+    times = np.array([float(t[2]) for t in trades])
+    prices = np.array([float(t[0]) for t in trades])
+    order = np.argsort(times, kind="stable")
+    return KrakenTradesPage(since, times[order], prices[order])
+
+
+def kraken_next_trade_index(times, since):
+    """Returns the index in the sorted times of the first trade returned by
+    the Trades API for since"""
+    return np.searchsorted(times, since, side="left")
+
+
+def kraken_download_next_trade_price(crypto, dtime):
+    page = kraken_download_trades(crypto, int(dtime.timestamp()))
+    return float(page.prices[0])
+
+
+class KrakenTradesPages:
+    """The pages of trades of one crypto-currency downloaded from Kraken.
+
+    A page answers the requests of the Trades API for any since from its own
+    since to the time of its last trade: the next trade is the first one of
+    the page from since on. Pages contained in another one are dropped, so
+    that pages sorted by since are also sorted by last trade time, and a
+    lookup is two binary searches. At most max_pages pages are kept, the
+    oldest ones being dropped first.
+    """
+
+    def __init__(self, max_pages=64):
+        self.max_pages = max_pages
+        # Sorted by since, and thus by last trade time
+        self.pages = []
+        self._added = collections.deque()
+
+    @staticmethod
+    def _contains(page, other):
+        return page.since <= other.since and other.times[-1] <= page.times[-1]
+
+    def add(self, page):
+        if len(page.times) == 0:
+            return
+        if any(self._contains(p, page) for p in self.pages):
+            return
+        self.pages = [p for p in self.pages if not self._contains(page, p)]
+        self._added = collections.deque(
+            p for p in self._added if not self._contains(page, p)
+        )
+        starts = [p.since for p in self.pages]
+        self.pages.insert(bisect.bisect_right(starts, page.since), page)
+        self._added.append(page)
+        while len(self.pages) > self.max_pages:
+            oldest = self._added.popleft()
+            self.pages = [p for p in self.pages if p is not oldest]
+
+    def next_trade_price(self, since):
+        """Returns the price of the next trade from since on, if a page
+        covers since, or None"""
+        starts = [p.since for p in self.pages]
+        position = bisect.bisect_right(starts, since) - 1
+        if position < 0:
+            return None
+        page = self.pages[position]
+        if since > page.times[-1]:
+            return None
+        return float(page.prices[kraken_next_trade_index(page.times, since)])
 
 
 class KrakenNextTradePriceDownloader(CachedPriceDownloader):
-    def __init__(self):
-        super().__init__()
-        self._supported_crypto_list = self._download_supported_crypto_list()
+    """Gets the price of the next trade on Kraken. The pages of trades
+    returned by the Trades API are kept, so that the prices of clustered
+    datetimes are answered from one page, without further requests."""
 
-    @property
-    def supported_crypto_list(self):
-        return self._supported_crypto_list
+    SOURCE_NAME = "kraken"
+    MAX_PAGES = 64
+
+    def __init__(self, store=None, cache=None):
+        super().__init__(store, cache)
+        self._pages = collections.defaultdict(lambda: KrakenTradesPages(self.MAX_PAGES))
+        self._pages_lock = threading.Lock()
 
     @staticmethod
     def _download_supported_crypto_list():
@@ -200,63 +539,260 @@ class KrakenNextTradePriceDownloader(CachedPriceDownloader):
             [p.base for p in pairs if p.quote == "EUR" and not is_fiat_currency(p.base)]
         )
 
-    def download_price(self, crypto, dtime):
-        cached_price = self.find_price_in_cache(crypto, dtime)
-        if cached_price is None:
-            self._download_price_add_to_cache(crypto, dtime)
-        cached_price = self.find_price_in_cache(crypto, dtime)
-        if cached_price is None:
-            raise RuntimeError(f"Could not download price for {crypto} at {dtime}")
-        return cached_price
+    def _find_price_in_pages(self, crypto, dtime):
+        with self._pages_lock:
+            return self._pages[crypto].next_trade_price(int(dtime.timestamp()))
+
+    def find_price_in_cache(self, crypto, dtime):
+        price = super().find_price_in_cache(crypto, dtime)
+        if price is None:
+            price = self._find_price_in_pages(crypto, dtime)
+            if price is not None:
+                self._add_price_to_cache(crypto, dtime, price)
+        return price
+
+    def find_prices_in_cache(self, crypto, dtimes):
+        prices = super().find_prices_in_cache(crypto, dtimes)
+        paged = []
+        for dtime in dtimes:
+            if dtime not in prices:
+                price = self._find_price_in_pages(crypto, dtime)
+                if price is not None:
+                    paged.append((dtime, price))
+        if len(paged) > 0:
+            self._add_prices_to_cache(crypto, paged)
+            prices.update(paged)
+        return prices
 
     def _download_price_add_to_cache(self, crypto, dtime):
-        price = kraken_download_next_trade_price(crypto, dtime)
-        self._add_price_to_cache(crypto, dtime, price)
+        since = int(dtime.timestamp())
+        page = kraken_download_trades(crypto, since)
+        with self._pages_lock:
+            self._pages[crypto].add(page)
+        index = kraken_next_trade_index(page.times, since)
+        if index == len(page.times):
+            raise MissingPriceError(f"No {crypto} trade on Kraken after {dtime}")
+        self._add_price_to_cache(crypto, dtime, float(page.prices[index]))
+
+
+def source_name(price_downloader):
+    return (
+        getattr(price_downloader, "SOURCE_NAME", None)
+        or type(price_downloader).__name__
+    )
 
 
 class MultiSourceFirstPriceDownloader(PriceDownloader):
     def __init__(self, price_downloaders):
         self.price_downloaders = price_downloaders
-        self._supported_crypto_list = self._make_supported_crypto_list()
 
     @property
     def supported_crypto_list(self):
-        return self._supported_crypto_list
-
-    def _make_supported_crypto_list(self):
         supported_cryptos = set()
         for source in self.price_downloaders:
-            source_pairs = source.supported_crypto_list
-            print(source_pairs)
-            supported_cryptos.update(source_pairs)
+            supported_cryptos.update(source.supported_crypto_list)
         return sorted(list(supported_cryptos))
 
+    def _supports(self, source, crypto):
+        return crypto in source.supported_crypto_list
+
+    def cached_price(self, crypto, dtime):
+        for source in self.price_downloaders:
+            price = source.cached_price(crypto, dtime)
+            if price is not None:
+                return price
+        return None
+
+    def cached_prices(self, crypto, dtimes):
+        prices = [None] * len(dtimes)
+        for source in self.price_downloaders:
+            missing = [i for i, price in enumerate(prices) if price is None]
+            if len(missing) == 0:
+                break
+            found = source.cached_prices(crypto, [dtimes[i] for i in missing])
+            for i, price in zip(missing, found):
+                prices[i] = price
+        return prices
+
+    def memory_cached_prices(self, crypto, dtimes):
+        prices = [None] * len(dtimes)
+        for source in self.price_downloaders:
+            missing = [i for i, price in enumerate(prices) if price is None]
+            if len(missing) == 0:
+                break
+            found = source.memory_cached_prices(crypto, [dtimes[i] for i in missing])
+            for i, price in zip(missing, found):
+                prices[i] = price
+        return prices
+
+    def prefetch(self, crypto, dtimes):
+        # Do not discover the supported cryptos if all prices are cached
+        dtimes = [d for d in dtimes if self.cached_price(crypto, d) is None]
+        if len(dtimes) == 0:
+            return
+        # Prices are prefetched from the first source supporting the crypto,
+        # which is the one download_price tries first
+        for source in self.price_downloaders:
+            if self._supports(source, crypto):
+                source.prefetch(crypto, dtimes)
+                return
+
+    def plan_downloads(self, crypto, dtimes):
+        # Do not discover the supported cryptos if all prices are cached
+        cached = self.cached_prices(crypto, dtimes)
+        missing = [d for d, price in zip(dtimes, cached) if price is None]
+        if len(missing) == 0:
+            return [list(dtimes)]
+        # Missing prices are planned by the first source supporting the
+        # crypto, which is the one download_prices tries first
+        groups = [[d for d, price in zip(dtimes, cached) if price is not None]]
+        for source in self.price_downloaders:
+            if self._supports(source, crypto):
+                groups.extend(source.plan_downloads(crypto, missing))
+                break
+        else:
+            groups.append(missing)
+        return [group for group in groups if len(group) > 0]
+
     def download_price(self, crypto, dtime):
+        # Serve cached prices without discovering the supported cryptos
+        for source in self.price_downloaders:
+            price = source.cached_price(crypto, dtime)
+            if price is not None:
+                metrics.record_cache(source_name(source), True)
+                return price
         for source in self.price_downloaders:
-            if crypto in source.supported_crypto_list:
+            if self._supports(source, crypto):
                 try:
                     price = source.download_price(crypto, dtime)
                     return price
-                except:
-                    pass
+                except Exception as e:
+                    name = source_name(source)
+                    logger.warning(
+                        f"Could not download {crypto} price at {dtime} from "
+                        f"{name}, trying the next source: {e}"
+                    )
+                    metrics.record_fallback(name, crypto)
         raise RuntimeError(f"Could not download price for {crypto} at {dtime}")
 
+    def download_prices(self, crypto, dtimes):
+        # Serve cached prices without discovering the supported cryptos
+        prices = [None] * len(dtimes)
+        for source in self.price_downloaders:
+            missing = [i for i, price in enumerate(prices) if price is None]
+            if len(missing) == 0:
+                return prices
+            found = source.cached_prices(crypto, [dtimes[i] for i in missing])
+            for i, price in zip(missing, found):
+                if price is not None:
+                    metrics.record_cache(source_name(source), True)
+                    prices[i] = price
+        missing = [i for i, price in enumerate(prices) if price is None]
+        if len(missing) == 0:
+            return prices
+        found = self._download_missing_prices(crypto, [dtimes[i] for i in missing])
+        for i, price in zip(missing, found):
+            prices[i] = price
+        for i in missing:
+            if prices[i] is None:
+                prices[i] = self.download_price(crypto, dtimes[i])
+        return prices
+
+    def _download_missing_prices(self, crypto, dtimes):
+        """Returns the list of the prices of crypto at dtimes, none of which
+        is cached. They are downloaded at once from the first source
+        supporting crypto. The prices left to None, for instance if this
+        fails, are then downloaded one by one by download_price, falling back
+        on the next sources."""
+        for source in self.price_downloaders:
+            if self._supports(source, crypto):
+                break
+        else:
+            return [None] * len(dtimes)
+        try:
+            return source.download_prices(crypto, dtimes)
+        except Exception as e:
+            logger.warning(
+                f"Could not download {len(dtimes)} {crypto} prices from "
+                f"{source_name(source)}, downloading them one by one: {e}"
+            )
+            return [None] * len(dtimes)
+
 
-__price_downloader = threading.local()
+_reference_price_downloader = None
+_reference_price_downloader_lock = threading.Lock()
 
 
 def reference_price_downloader():
-    price_downloader = None
-    try:
-        price_downloader = __price_downloader.instance
-    except AttributeError:
-        __price_downloader.instance = instantiate_reference_price_downloader()
-        price_downloader = __price_downloader.instance
+    """Returns the price downloader shared by all the threads of the process,
+    instantiated with instantiate_reference_price_downloader when first
+    needed, unless set with set_reference_price_downloader"""
+    global _reference_price_downloader
+    price_downloader = _reference_price_downloader
+    if price_downloader is None:
+        with _reference_price_downloader_lock:
+            if _reference_price_downloader is None:
+                _reference_price_downloader = instantiate_reference_price_downloader()
+            price_downloader = _reference_price_downloader
     return price_downloader
 
 
-def instantiate_reference_price_downloader():
-    bstamp = BitstampMinuteClosePriceDownloader()
-    kraken = KrakenNextTradePriceDownloader()
+def set_reference_price_downloader(price_downloader):
+    """Replaces the price downloader returned by reference_price_downloader,
+    and used by default by all the threads of the process. If
+    price_downloader is None, a new reference price downloader is
+    instantiated when next needed.
+
+    Returns:
+        PriceDownloader: The previous reference price downloader, or None.
+    """
+    global _reference_price_downloader
+    with _reference_price_downloader_lock:
+        previous = _reference_price_downloader
+        _reference_price_downloader = price_downloader
+    return previous
+
+
+def instantiate_reference_price_downloader(
+    store=None,
+    max_cached_prices=None,
+    cache_policy=None,
+    health_aware=False,
+    hedge_after=None,
+):
+    """Builds the price downloader used by coin2086, that gets prices from
+    Bitstamp, and from Kraken for crypto-currencies not traded on Bitstamp.
+
+    Args:
+        store (coin2086.pricestore.SQLitePriceStore): The persistent store
+            backing the price caches. If None, the store located at the path
+            given by the COIN2086_PRICE_STORE environment variable is used,
+            if this variable is set.
+        max_cached_prices (int): The maximum number of prices kept in the
+            in-memory cache of each source. If None, the
+            COIN2086_PRICE_CACHE_MAX_ENTRIES environment variable is used, and
+            the caches are unbounded if it is not set.
+        cache_policy (str): How cached prices are evicted, "lru" or "lfu"
+            (see :py:class:`coin2086.pricecache.PriceCache`). If None, the
+            COIN2086_PRICE_CACHE_POLICY environment variable is used, or "lru".
+        health_aware (bool): If True, prices are resolved across the sources
+            by a :py:class:`coin2086.resolution.HealthAwarePriceDownloader`,
+            that skips failing sources and remembers missing prices.
+        hedge_after (float): If given, a health aware downloader also requests
+            a price from Kraken when Bitstamp did not answer within
+            hedge_after seconds, and uses the first price received.
+    """
+    if store is None:
+        store = pricestore.default_price_store()
+    bstamp = BitstampMinuteClosePriceDownloader(
+        store, pricecache.default_price_cache(max_cached_prices, cache_policy)
+    )
+    kraken = KrakenNextTradePriceDownloader(
+        store, pricecache.default_price_cache(max_cached_prices, cache_policy)
+    )
+    if health_aware or hedge_after is not None:
+        from .resolution import HealthAwarePriceDownloader
+
+        return HealthAwarePriceDownloader([bstamp, kraken], hedge_after=hedge_after)
     multi = MultiSourceFirstPriceDownloader([bstamp, kraken])
     return multi
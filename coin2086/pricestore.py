@@ -0,0 +1,188 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+import datetime as dt
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+PRICE_STORE_ENV_VAR = "COIN2086_PRICE_STORE"
+
+
+def to_timestamp(dtime):
+    return int(dtime.timestamp())
+
+
+def from_timestamp(timestamp):
+    return dt.datetime.fromtimestamp(int(timestamp))
+
+
+class SQLitePriceStore:
+    """Persistent on-disk store of crypto-currency prices.
+
+    Prices are keyed by (source, crypto, timestamp), where source is the name
+    of the price downloader that produced the price (e.g. bitstamp or kraken)
+    and timestamp is the POSIX timestamp of the price. The store may be shared
+    by several threads and processes: each thread uses its own connection, and
+    the database is opened in WAL mode so that readers do not block writers.
+    The store also keeps the list of cryptos supported by each source.
+
+    Args:
+        path (str or pathlib.Path): Path of the SQLite database file. Parent
+            directories are created if they do not exist.
+        timeout (float): How many seconds a writer waits for the database lock
+            held by another connection before giving up.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = os.path.expanduser(os.fspath(path))
+        self.timeout = timeout
+        self._local = threading.local()
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prices ("
+                "source TEXT NOT NULL, "
+                "crypto TEXT NOT NULL, "
+                "timestamp INTEGER NOT NULL, "
+                "price REAL NOT NULL, "
+                "PRIMARY KEY (source, crypto, timestamp))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS supported_cryptos ("
+                "source TEXT PRIMARY KEY, "
+                "updated INTEGER NOT NULL, "
+                "cryptos TEXT NOT NULL)"
+            )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_price(self, source, crypto, dtime):
+        """Returns the price stored for (source, crypto, dtime), or None"""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT price FROM prices "
+                "WHERE source = ? AND crypto = ? AND timestamp = ?",
+                (source, crypto, to_timestamp(dtime)),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return row[0]
+
+    def get_prices(self, source, crypto, start, end):
+        """Returns a dict mapping datetimes to prices, for all prices of
+        (source, crypto) stored between start and end (inclusive)"""
+        rows = self._connection().execute(
+            "SELECT timestamp, price FROM prices WHERE source = ? AND crypto = ? "
+            "AND timestamp BETWEEN ? AND ?",
+            (source, crypto, to_timestamp(start), to_timestamp(end)),
+        )
+        return {from_timestamp(ts): price for ts, price in rows}
+
+    def put_prices(self, source, crypto, prices):
+        """Stores prices, an iterable of (datetime, price) pairs, in a single
+        transaction. Existing prices for the same keys are replaced."""
+        rows = [(source, crypto, to_timestamp(d), float(p)) for d, p in prices]
+        if len(rows) == 0:
+            return
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO prices (source, crypto, timestamp, price) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def get_supported_cryptos(self, source, max_age):
+        """Returns the list of cryptos supported by source, if it was stored
+        less than max_age (a datetime.timedelta) ago, or None"""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT updated, cryptos FROM supported_cryptos WHERE source = ?",
+                (source,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        updated, cryptos = row
+        if from_timestamp(updated) + max_age < dt.datetime.now():
+            return None
+        return json.loads(cryptos)
+
+    def put_supported_cryptos(self, source, cryptos):
+        """Stores the list of cryptos supported by source"""
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO supported_cryptos (source, updated, cryptos) "
+                "VALUES (?, ?, ?)",
+                (source, to_timestamp(dt.datetime.now()), json.dumps(cryptos)),
+            )
+
+    def summary(self):
+        """Returns a DataFrame with one line per (source, crypto), with the
+        number of stored prices and the first and last datetime stored"""
+        rows = self._connection().execute(
+            "SELECT source, crypto, COUNT(*), MIN(timestamp), MAX(timestamp) "
+            "FROM prices GROUP BY source, crypto ORDER BY source, crypto"
+        )
+        summary = pd.DataFrame(
+            rows.fetchall(), columns=["source", "crypto", "count", "first", "last"]
+        )
+        for col in ["first", "last"]:
+            summary[col] = summary[col].map(from_timestamp)
+        return summary
+
+    def prune(self, source=None, crypto=None, before=None, after=None):
+        """Deletes stored prices and returns the number of deleted prices.
+
+        Every given argument restricts the prices that are deleted: for
+        instance ``prune(source="kraken", before=dtime)`` deletes the Kraken
+        prices older than dtime. Calling ``prune()`` without arguments deletes
+        all prices.
+        """
+        clauses = []
+        params = []
+        if source is not None:
+            clauses.append("source = ?")
+            params.append(source)
+        if crypto is not None:
+            clauses.append("crypto = ?")
+            params.append(crypto)
+        if before is not None:
+            clauses.append("timestamp < ?")
+            params.append(to_timestamp(pd.to_datetime(before)))
+        if after is not None:
+            clauses.append("timestamp > ?")
+            params.append(to_timestamp(pd.to_datetime(after)))
+        query = "DELETE FROM prices"
+        if len(clauses) > 0:
+            query += " WHERE " + " AND ".join(clauses)
+        with self._connection() as conn:
+            deleted = conn.execute(query, params).rowcount
+        logger.info(f"Pruned {deleted} prices from {self.path}")
+        return deleted
+
+
+def default_price_store():
+    """Opens the price store whose path is given by the COIN2086_PRICE_STORE
+    environment variable, or returns None if the variable is not set"""
+    path = os.environ.get(PRICE_STORE_ENV_VAR)
+    if not path:
+        return None
+    return SQLitePriceStore(path)
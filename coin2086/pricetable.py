@@ -0,0 +1,214 @@
+"""A price store holding minute close prices in memory-mapped arrays, so
+that looking up a price costs an array access."""
+import os
+import json
+import logging
+import threading
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+EPOCH = np.datetime64("2010-01-01T00:00", "m")
+# Each price series is split in files of 2**16 minutes (about 45 days)
+BLOCK_BITS = 16
+BLOCK_MINUTES = 1 << BLOCK_BITS
+SUPPORTED_CRYPTOS_FILE = "supported_cryptos.json"
+
+
+def to_minutes(dtimes):
+    """Returns the number of minutes between EPOCH and each of dtimes, as an
+    int64 array, and a boolean array telling which dtimes are whole minutes"""
+    dtimes = pd.DatetimeIndex(dtimes).values
+    minutes = dtimes.astype("datetime64[m]")
+    whole = minutes == dtimes
+    return (minutes - EPOCH).astype(np.int64), whole
+
+
+def from_minutes(minutes):
+    return pd.DatetimeIndex(EPOCH + np.asarray(minutes).astype("timedelta64[m]"))
+
+
+class MinutePriceTable:
+    """Persistent store of minute close prices, held as memory-mapped
+    float64 arrays indexed by the number of minutes since EPOCH. Missing
+    prices are NaN. Looking up a price is an array access, and the pages of
+    the arrays are shared by all the processes using the table.
+
+    Each (source, crypto) price series is split in blocks of BLOCK_MINUTES
+    minutes, stored in <source>/<crypto>/<block>.f64 files that are only
+    created when a price of the block is stored.
+
+    The table implements the same methods as
+    :py:class:`coin2086.pricestore.SQLitePriceStore`, so that it can back the
+    cache of a price downloader. Only prices at whole minutes, after EPOCH,
+    are stored: other prices, such as the ones of the trades downloaded from
+    Kraken, are skipped and looked up again when needed.
+
+    Args:
+        directory (str or pathlib.Path): The directory of the table. It is
+            created if it does not exist.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.expanduser(os.fspath(directory))
+        os.makedirs(self.directory, exist_ok=True)
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def _path(self, source, *names):
+        return os.path.join(self.directory, source, *names)
+
+    def _block_path(self, source, crypto, block):
+        return self._path(source, crypto, f"{block}.f64")
+
+    def _block(self, source, crypto, block):
+        """Returns the memory-mapped prices of a block, or None if no price
+        of the block was stored"""
+        key = (source, crypto, block)
+        with self._lock:
+            array = self._blocks.get(key)
+            if array is None:
+                path = self._block_path(source, crypto, block)
+                if not os.path.exists(path):
+                    return None
+                array = np.memmap(path, dtype=np.float64, mode="r")
+                self._blocks[key] = array
+            return array
+
+    def _create_block(self, path):
+        """Creates the block file at path, filled with NaN, unless another
+        thread or process already did"""
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        np.full(BLOCK_MINUTES, np.nan).tofile(tmp_path)
+        try:
+            # Linking fails if the block exists, unlike renaming
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+
+    def lookup(self, crypto, dtimes, source="bitstamp"):
+        """Returns the close prices of crypto for the minutes each of dtimes
+        is rounded to, as a float64 array with NaN for unknown prices"""
+        minutes = pd.DatetimeIndex(dtimes).round("min")
+        positions, _ = to_minutes(minutes)
+        return self._lookup_positions(source, crypto, positions)
+
+    def _lookup_positions(self, source, crypto, positions):
+        prices = np.full(len(positions), np.nan)
+        valid = positions >= 0
+        blocks = positions >> BLOCK_BITS
+        for block in np.unique(blocks[valid]):
+            array = self._block(source, crypto, block)
+            if array is None:
+                continue
+            selected = valid & (blocks == block)
+            prices[selected] = array[positions[selected] & (BLOCK_MINUTES - 1)]
+        return prices
+
+    def get_price(self, source, crypto, dtime):
+        positions, whole = to_minutes([dtime])
+        if not whole[0]:
+            return None
+        price = self._lookup_positions(source, crypto, positions)[0]
+        return None if np.isnan(price) else float(price)
+
+    def get_prices(self, source, crypto, start, end):
+        """Returns a dict mapping datetimes to prices, for all prices of
+        (source, crypto) stored between start and end (inclusive)"""
+        first, _ = to_minutes([start])
+        last, _ = to_minutes([end])
+        positions = np.arange(max(first[0], 0), last[0] + 1)
+        prices = self._lookup_positions(source, crypto, positions)
+        known = ~np.isnan(prices)
+        dtimes = from_minutes(positions[known]).to_pydatetime()
+        return dict(zip(dtimes, prices[known].tolist()))
+
+    def put_prices(self, source, crypto, prices):
+        """Stores prices, an iterable of (datetime, price) pairs. Existing
+        prices for the same minutes are replaced."""
+        prices = list(prices)
+        if len(prices) == 0:
+            return
+        positions, whole = to_minutes([d for d, _ in prices])
+        values = np.array([p for _, p in prices], dtype=np.float64)
+        keep = whole & (positions >= 0)
+        if not keep.all():
+            logger.debug(f"Skipping {(~keep).sum()} {crypto} prices not at minutes")
+        positions, values = positions[keep], values[keep]
+        blocks = positions >> BLOCK_BITS
+        for block in np.unique(blocks):
+            selected = blocks == block
+            path = self._block_path(source, crypto, block)
+            self._create_block(path)
+            with open(path, "r+b") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                array = np.memmap(f, dtype=np.float64, mode="r+")
+                array[positions[selected] & (BLOCK_MINUTES - 1)] = values[selected]
+                array.flush()
+                del array
+
+    def get_supported_cryptos(self, source, max_age):
+        """Returns the list of cryptos supported by source, if it was stored
+        less than max_age (a datetime.timedelta) ago, or None"""
+        path = self._path(source, SUPPORTED_CRYPTOS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            stored = json.load(f)
+        if dt.datetime.fromtimestamp(stored["updated"]) + max_age < dt.datetime.now():
+            return None
+        return stored["cryptos"]
+
+    def put_supported_cryptos(self, source, cryptos):
+        """Stores the list of cryptos supported by source"""
+        path = self._path(source, SUPPORTED_CRYPTOS_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stored = {"updated": dt.datetime.now().timestamp(), "cryptos": cryptos}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        """Returns a DataFrame with one line per (source, crypto), with the
+        number of stored prices and the first and last datetime stored"""
+        rows = []
+        for source in sorted(os.listdir(self.directory)):
+            for crypto in sorted(os.listdir(self._path(source))):
+                if not os.path.isdir(self._path(source, crypto)):
+                    continue
+                blocks = sorted(
+                    int(name[: -len(".f64")])
+                    for name in os.listdir(self._path(source, crypto))
+                    if name.endswith(".f64")
+                )
+                known = np.concatenate(
+                    [np.empty(0, dtype=np.int64)]
+                    + [
+                        np.flatnonzero(~np.isnan(self._block(source, crypto, block)))
+                        + (block << BLOCK_BITS)
+                        for block in blocks
+                    ]
+                )
+                if len(known) == 0:
+                    continue
+                first, last = from_minutes(known[[0, -1]])
+                rows.append([source, crypto, len(known), first, last])
+        return pd.DataFrame(
+            rows, columns=["source", "crypto", "count", "first", "last"]
+        )
@@ -0,0 +1,423 @@
+"""Health-aware resolution of prices across several sources.
+
+:py:class:`HealthAwarePriceDownloader` tries the sources of a
+:py:class:`coin2086.pricedownload.MultiSourceFirstPriceDownloader` in the same
+order, but keeps track of the latency and errors of each source, skips the
+sources that keep failing for a while (a circuit breaker), remembers the
+prices a source does not have, and optionally sends a hedged request to the
+next source when a source is slow to answer.
+"""
+import time
+import logging
+import threading
+import collections
+import concurrent.futures
+
+import requests
+
+from . import metrics
+from .pricedownload import (
+    MissingPriceError,
+    MultiSourceFirstPriceDownloader,
+    round_datetime,
+    source_name,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def is_missing_price_error(error):
+    """Tells whether error means that a source does not have a price, rather
+    than that the source failed. Only client errors (other than rate
+    limiting) and the MissingPriceError raised when no bin or trade covers
+    the price mean the price is missing. Any other error, such as a network
+    error, a server error or an unexpected response, is a failure."""
+    if isinstance(error, requests.HTTPError):
+        status = getattr(error.response, "status_code", None)
+        return status is not None and 400 <= status < 500 and status != 429
+    return isinstance(error, MissingPriceError)
+
+
+class SourceHealth:
+    """The health of a price source, and its circuit breaker.
+
+    The breaker opens after failure_threshold consecutive failures: the source
+    is then skipped for reset_timeout seconds, after which a single trial
+    request is let through (the breaker is half-open). The breaker closes
+    again if the trial succeeds, and opens for another reset_timeout
+    otherwise. Another trial is let through every reset_timeout seconds
+    until one of them completes.
+
+    Args:
+        alpha (float): The weight of the last request in the exponentially
+            weighted moving average of the latency.
+        failure_threshold (int): The number of consecutive failures that opens
+            the breaker.
+        reset_timeout (float): How many seconds the breaker stays open.
+        clock (callable): Returns the current time in seconds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, alpha=0.2, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic
+    ):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def _record_latency(self, seconds):
+        self.requests += 1
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.alpha * (seconds - self.latency)
+
+    def allow_request(self):
+        """Tells whether a request may be sent to the source"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = self.clock()
+            if now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self, seconds):
+        with self._lock:
+            self._record_latency(seconds)
+            self.consecutive_failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self, seconds):
+        with self._lock:
+            self._record_latency(seconds)
+            self.failures += 1
+            self.consecutive_failures += 1
+            if (
+                self.state == self.HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "latency": self.latency,
+                "requests": self.requests,
+                "failures": self.failures,
+            }
+
+
+class NegativePriceCache:
+    """The (source, crypto, minute) keys of the prices known to be missing
+    from a source, keeping the max_entries last ones for ttl seconds: the
+    price of a recent minute may be published later.
+
+    Args:
+        max_entries (int): The maximum number of keys kept.
+        ttl (float): How many seconds a key is kept.
+        clock (callable): Returns the current time in seconds.
+    """
+
+    def __init__(self, max_entries=100000, ttl=600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        # Maps keys to their expiry time, from the first to expire
+        self._keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(source, crypto, dtime):
+        return (source_name(source), crypto, round_datetime(dtime, "min"))
+
+    def add(self, source, crypto, dtime):
+        key = self.key(source, crypto, dtime)
+        with self._lock:
+            self._keys[key] = self.clock() + self.ttl
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_entries:
+                self._keys.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            expiry = self._keys.get(key)
+            if expiry is None:
+                return False
+            if expiry <= self.clock():
+                del self._keys[key]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class HealthAwarePriceDownloader(MultiSourceFirstPriceDownloader):
+    """Gets each price from the first source that has it, as
+    MultiSourceFirstPriceDownloader does, while:
+
+    - skipping the sources whose circuit breaker is open (see
+      :py:class:`SourceHealth`), unless all the sources supporting the
+      crypto-currency are skipped,
+    - skipping the sources known not to have the price of the minute,
+    - if hedge_after is given, also requesting the prices from the next
+      source when a source did not answer within hedge_after seconds, and
+      using the first prices received. This applies to single prices and to
+      the prices download_prices requests at once. Hedged prices may then
+      come from a source later in the list than without hedging.
+
+    Args:
+        price_downloaders (list): The sources, in order of preference.
+        hedge_after (float): How many seconds to wait for a source before
+            also requesting the next one. No hedging if None.
+        failure_threshold (int): See :py:class:`SourceHealth`.
+        reset_timeout (float): See :py:class:`SourceHealth`.
+        missing_ttl (float): How many seconds a source is not asked again for
+            a price it does not have.
+        max_workers (int): The number of threads running hedged requests.
+            They are started when first needed, and shut down by close or
+            when leaving a with block.
+        clock (callable): Returns the current time in seconds.
+    """
+
+    def __init__(
+        self,
+        price_downloaders,
+        hedge_after=None,
+        failure_threshold=5,
+        reset_timeout=30.0,
+        missing_ttl=600.0,
+        max_workers=8,
+        clock=time.monotonic,
+    ):
+        super().__init__(price_downloaders)
+        self.hedge_after = hedge_after
+        self.max_workers = max_workers
+        self.clock = clock
+        self.health = {
+            source_name(source): SourceHealth(
+                failure_threshold=failure_threshold,
+                reset_timeout=reset_timeout,
+                clock=clock,
+            )
+            for source in price_downloaders
+        }
+        self.missing = NegativePriceCache(ttl=missing_ttl, clock=clock)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def health_stats(self):
+        """Returns a dict mapping each source to the as_dict of its health"""
+        return {name: health.as_dict() for name, health in self.health.items()}
+
+    def _supports(self, source, crypto):
+        try:
+            return crypto in source.supported_crypto_list
+        except Exception as e:
+            logger.warning(f"Could not list the cryptos of {source_name(source)}: {e}")
+            self.health[source_name(source)].record_failure(0.0)
+            return False
+
+    def _download_from(self, source, crypto, dtimes):
+        """Downloads the price of crypto at the single datetime of dtimes
+        from source, recording the health of source"""
+        name = source_name(source)
+        start = self.clock()
+        try:
+            price = source.download_price(crypto, dtimes[0])
+        except Exception as e:
+            seconds = self.clock() - start
+            if is_missing_price_error(e):
+                # The source answered, without the price
+                self.health[name].record_success(seconds)
+                self.missing.add(source, crypto, dtimes[0])
+            else:
+                self.health[name].record_failure(seconds)
+            raise
+        self.health[name].record_success(self.clock() - start)
+        return [price]
+
+    def _download_prices_from(self, source, crypto, dtimes):
+        """Downloads the prices of crypto at dtimes from source at once,
+        recording the health of source. The prices the source does not have
+        are left to None."""
+        name = source_name(source)
+        start = self.clock()
+        try:
+            prices = source.download_prices(crypto, dtimes)
+        except Exception as e:
+            seconds = self.clock() - start
+            if not is_missing_price_error(e):
+                self.health[name].record_failure(seconds)
+                raise
+            # The source answered, without some of the prices: keep the ones
+            # it gave. They are not known to be missing one by one, so they
+            # are not remembered as missing.
+            self.health[name].record_success(seconds)
+            return source.cached_prices(crypto, dtimes)
+        self.health[name].record_success(self.clock() - start)
+        return prices
+
+    def _on_source_error(self, source, crypto, dtimes, error):
+        name = source_name(source)
+        what = f"{crypto} price at {dtimes[0]}"
+        if len(dtimes) > 1:
+            what = f"{len(dtimes)} {crypto} prices"
+        logger.warning(
+            f"Could not download {what} from {name}, "
+            f"trying the next source: {type(error).__name__}: {error}"
+        )
+        metrics.record_fallback(name, crypto)
+
+    def _submit(self, download, source, crypto, dtimes):
+        """Runs download on the executor if requests are hedged, and at once
+        otherwise. Returns its future."""
+        if self.hedge_after is not None:
+            return self._get_executor().submit(download, source, crypto, dtimes)
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(download(source, crypto, dtimes))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _resolve(self, crypto, dtimes, download):
+        """Returns a dict mapping those of the distinct dtimes whose price of
+        crypto was received to their price.
+
+        The prices are requested with download(source, crypto, dtimes) from
+        the first source, and those it fails to give or does not have from
+        the next sources. If hedge_after is given, the prices still waited for
+        after hedge_after seconds are also requested from the next source.
+        The circuit breaker of a source is only checked when the source is
+        about to be requested, so that sources an earlier one answered for
+        are not counted as requested.
+        """
+        supporting = collections.deque(
+            s for s in self.price_downloaders if self._supports(s, crypto)
+        )
+        refused = []
+        prices = {}
+        # Maps the futures of the requests in flight to the order they were
+        # sent in, their source and their datetimes
+        pending = {}
+        sent = 0
+        forced = False
+
+        def request_next_source():
+            """Requests the prices not received yet from the next source that
+            may have them and whose breaker lets a request through. Returns
+            False if no source is left."""
+            nonlocal sent, forced
+            waited = [d for d in dtimes if d not in prices]
+            while len(supporting) > 0:
+                source = supporting.popleft()
+                wanted = [
+                    d
+                    for d in waited
+                    if self.missing.key(source, crypto, d) not in self.missing
+                ]
+                if len(wanted) == 0:
+                    continue
+                if not forced and not self.health[source_name(source)].allow_request():
+                    refused.append(source)
+                    if len(supporting) == 0 and sent == 0:
+                        logger.warning(
+                            f"All sources of {crypto} prices are failing, "
+                            "trying them anyway"
+                        )
+                        supporting.extend(refused)
+                        forced = True
+                    continue
+                future = self._submit(download, source, crypto, wanted)
+                pending[future] = (sent, source, wanted)
+                sent += 1
+                return True
+            return False
+
+        exhausted = not request_next_source()
+        while len(pending) > 0:
+            timeout = None if exhausted else self.hedge_after
+            done, _ = concurrent.futures.wait(
+                pending, timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if len(done) == 0:
+                _, source, wanted = next(iter(pending.values()))
+                logger.info(
+                    f"No answer from {source_name(source)} for {len(wanted)} "
+                    f"{crypto} prices after {self.hedge_after}s, hedging"
+                )
+                exhausted = not request_next_source()
+                continue
+            # Prefer the first sources when several answered
+            for future in sorted(done, key=lambda f: pending[f][0]):
+                _, source, wanted = pending.pop(future)
+                try:
+                    found = future.result()
+                except Exception as e:
+                    self._on_source_error(source, crypto, wanted, e)
+                    continue
+                for dtime, price in zip(wanted, found):
+                    if price is not None and dtime not in prices:
+                        prices[dtime] = price
+            if len(prices) == len(dtimes):
+                break
+            if not exhausted:
+                exhausted = not request_next_source()
+        return prices
+
+    def download_price(self, crypto, dtime):
+        # Serve cached prices without discovering the supported cryptos
+        for source in self.price_downloaders:
+            price = source.cached_price(crypto, dtime)
+            if price is not None:
+                metrics.record_cache(source_name(source), True)
+                return price
+        prices = self._resolve(crypto, [dtime], self._download_from)
+        if dtime in prices:
+            return prices[dtime]
+        raise RuntimeError(f"Could not download price for {crypto} at {dtime}")
+
+    def _download_missing_prices(self, crypto, dtimes):
+        distinct = list(dict.fromkeys(dtimes))
+        prices = self._resolve(crypto, distinct, self._download_prices_from)
+        return [prices.get(d) for d in dtimes]
+
+    def close(self, wait=True):
+        """Shuts down the threads running hedged requests, waiting for the
+        requests in flight if wait is True. Requests made afterwards start new
+        threads when needed."""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="coin2086-hedge"
+                )
+            return self._executor
@@ -0,0 +1,331 @@
+"""An opt-in cache of the results of valuate_portfolio and
+compute_taxable_pnls_detailed, for applications computing them again and
+again on unchanged trades::
+
+    from coin2086 import resultcache
+    resultcache.set_result_cache(resultcache.ResultCache("~/.cache/coin2086/results"))
+
+Results are keyed by a hash of the contents of the trades, of the other
+arguments, and of the configuration of the price downloader. They are kept
+in memory, up to max_entries results, and on disk, up to max_bytes, as
+columnar .npz files.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+import collections
+
+import numpy as np
+import pandas as pd
+
+from . import metrics
+from . import pricedownload
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_VERSION = 1
+
+
+def hash_trades(trades):
+    """Returns a hex digest of the contents of the trades DataFrame: its
+    columns, their dtypes, and the values of each row and of its index"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(zip(trades.columns, map(str, trades.dtypes)))).encode())
+    rows = pd.util.hash_pandas_object(trades, index=True).values
+    digest.update(np.ascontiguousarray(rows).tobytes())
+    return digest.hexdigest()
+
+
+def describe_price_downloader(price_downloader):
+    """Returns a description of the configuration of price_downloader, that
+    changes when the prices it gives may change: its class, the classes of
+    its sources, and its hedging delay"""
+    cls = type(price_downloader)
+    description = f"{cls.__module__}.{cls.__qualname__}"
+    sources = getattr(price_downloader, "price_downloaders", None)
+    if sources is not None:
+        description += f"({','.join(map(describe_price_downloader, sources))})"
+    hedge_after = getattr(price_downloader, "hedge_after", None)
+    if hedge_after is not None:
+        description += f"[hedge_after={hedge_after}]"
+    return description
+
+
+def encode_values(values):
+    """Returns the array to store for values, and the description needed to
+    decode it, or None if values cannot be stored"""
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        tz = str(values.tz)
+        try:
+            same_tz = pd.DatetimeTZDtype(tz=tz) == values.dtype
+        except Exception:
+            same_tz = False
+        if not same_tz:
+            # Timezones that cannot be found again from their name
+            return None
+        # Stored as UTC times, localized again when read
+        return values.asi8, {"kind": "datetime", "dtype": "datetime64[ns]", "tz": tz}
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.categories
+        if categories.dtype != object:
+            return None
+        return values.codes, {"kind": "category", "categories": list(categories)}
+    values = np.asarray(values)
+    if values.dtype.kind in "biuf":
+        return values, {"kind": "numeric"}
+    if values.dtype.kind == "M":
+        return values.view(np.int64), {"kind": "datetime", "dtype": str(values.dtype)}
+    if values.dtype == object and all(isinstance(v, str) for v in values):
+        return values.astype(str), {"kind": "str"}
+    return None
+
+
+def decode_values(values, description):
+    kind = description["kind"]
+    if kind == "category":
+        return pd.Categorical.from_codes(values, description["categories"])
+    if kind == "datetime":
+        values = values.view(description["dtype"])
+        tz = description.get("tz")
+        if tz is not None:
+            index = pd.DatetimeIndex(values).tz_localize("UTC").tz_convert(tz)
+            return index.array
+        return values
+    if kind == "str":
+        return values.astype(object)
+    return values
+
+
+def label_to_json(label):
+    return list(label) if isinstance(label, tuple) else label
+
+
+def label_from_json(label):
+    return tuple(label) if isinstance(label, list) else label
+
+
+def write_frame(path, frame):
+    """Writes frame to path as a .npz file holding one array per column.
+    Returns False, without writing anything, if frame holds values that
+    cannot be stored without pickling them."""
+    arrays = {}
+    columns = []
+    for position, (label, column) in enumerate(frame.items()):
+        encoded = encode_values(column.array)
+        if encoded is None:
+            return False
+        arrays[f"column{position}"], description = encoded
+        description["label"] = label_to_json(label)
+        columns.append(description)
+    encoded = encode_values(frame.index.array)
+    if encoded is None:
+        return False
+    arrays["index"], index = encoded
+    index["name"] = frame.index.name
+    meta = {
+        "columns": columns,
+        "column_names": list(frame.columns.names),
+        "index": index,
+    }
+    arrays["meta"] = np.array(json.dumps(meta))
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+    return True
+
+
+def read_frame(path):
+    with np.load(path, allow_pickle=False) as arrays:
+        meta = json.loads(str(arrays["meta"]))
+        data = {}
+        labels = []
+        for position, description in enumerate(meta["columns"]):
+            values = arrays[f"column{position}"]
+            data[position] = decode_values(values, description)
+            labels.append(label_from_json(description["label"]))
+        index = decode_values(arrays["index"], meta["index"])
+    frame = pd.DataFrame(data, index=pd.Index(index, name=meta["index"]["name"]))
+    if len(meta["column_names"]) > 1:
+        frame.columns = pd.MultiIndex.from_tuples(labels, names=meta["column_names"])
+    else:
+        frame.columns = pd.Index(labels, name=meta["column_names"][0])
+    return frame
+
+
+class ResultCache:
+    """Cache of DataFrame results, in memory and optionally on disk.
+
+    Args:
+        directory (str or pathlib.Path): The directory of the on-disk cache,
+            created if needed. Results are only kept in memory if None.
+        max_entries (int): The number of results kept in memory. The least
+            recently used ones are evicted first.
+        max_bytes (int): The maximum size of the on-disk cache. The least
+            recently used files are removed first, but never the file of the
+            result just cached.
+    """
+
+    def __init__(self, directory=None, max_entries=32, max_bytes=256 * 2**20):
+        self.directory = None
+        if directory is not None:
+            self.directory = os.path.expanduser(os.fspath(directory))
+            os.makedirs(self.directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._frames = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(function_name, trades, parameters, price_downloader):
+        """Returns the key of the result of function_name for trades, called
+        with the parameters dict and price_downloader. Keys of the same trades
+        start with the hash of the trades."""
+        from . import __version__
+
+        digest = hashlib.blake2b(digest_size=16)
+        configuration = [
+            FORMAT_VERSION,
+            __version__,
+            function_name,
+            parameters,
+            describe_price_downloader(price_downloader),
+        ]
+        digest.update(json.dumps(configuration, sort_keys=True, default=str).encode())
+        return f"{hash_trades(trades)}-{digest.hexdigest()}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """Returns a copy of the result cached for key, or None"""
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                return frame.copy()
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            frame = read_frame(path)
+            # Record the use of the file for the eviction of old files
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read cached result {path}: {e}")
+            return None
+        self._remember(key, frame)
+        return frame.copy()
+
+    def _remember(self, key, frame):
+        with self._lock:
+            self._frames[key] = frame
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.max_entries:
+                self._frames.popitem(last=False)
+
+    def put(self, key, frame):
+        """Caches a copy of the DataFrame frame for key"""
+        frame = frame.copy()
+        self._remember(key, frame)
+        if self.directory is None:
+            return
+        path = self._path(key)
+        if not write_frame(path, frame):
+            logger.debug(f"Result {key} cannot be written to disk")
+            return
+        self._evict_files(keep=path)
+
+    def _files(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def _evict_files(self, keep):
+        """Removes files other than keep until the on-disk cache holds at most
+        max_bytes"""
+        files = self._files()
+        size = sum(s for _, s, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def invalidate(self, trades=None):
+        """Removes the results cached for the trades DataFrame, or all the
+        cached results if trades is None"""
+        prefix = "" if trades is None else hash_trades(trades)
+        with self._lock:
+            for key in [k for k in self._frames if k.startswith(prefix)]:
+                del self._frames[key]
+        if self.directory is None:
+            return
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(".npz"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def size(self):
+        """Returns the number of results in memory, and the number and total
+        size in bytes of the results on disk"""
+        files = [] if self.directory is None else self._files()
+        return {
+            "entries": len(self._frames),
+            "files": len(files),
+            "bytes": sum(s for _, s, _ in files),
+        }
+
+
+_result_cache = None
+
+
+def set_result_cache(result_cache):
+    """Caches the results of valuate_portfolio and
+    compute_taxable_pnls_detailed in result_cache, a ResultCache, or stops
+    caching them if result_cache is None. Returns the previous cache."""
+    global _result_cache
+    previous = _result_cache
+    _result_cache = result_cache
+    return previous
+
+
+def get_result_cache():
+    return _result_cache
+
+
+def memoize(function_name, trades, parameters, price_downloader, compute):
+    """Returns the result of compute(), that computes function_name for the
+    validated trades with parameters and price_downloader, from the result
+    cache if it was set and holds it"""
+    cache = _result_cache
+    if cache is None:
+        return compute()
+    if price_downloader is None:
+        price_downloader = pricedownload.reference_price_downloader()
+    key = cache.key(function_name, trades, parameters, price_downloader)
+    result = cache.get(key)
+    metrics.record_cache("results", result is not None)
+    if result is None:
+        result = compute()
+        cache.put(key, result)
+    return result
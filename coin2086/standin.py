@@ -0,0 +1,304 @@
+"""Stand-in for the Bitstamp and Kraken public APIs, that replays recorded
+responses, so that coin2086 can run and be load-tested without any network.
+
+Recorded responses are kept in a fixtures directory laid out as follows::
+
+    bitstamp/trading-pairs-info.json   The response of /trading-pairs-info/
+    bitstamp/ohlc/<pair>.csv           The minute bins recorded for each pair
+    kraken/AssetPairs.json             The response of AssetPairs
+    kraken/Trades/<pair>.csv           The trades recorded for each pair
+
+Minute bins and trades are kept as tables rather than as raw responses, so
+that requests for any range of bins or trades are answered from them.
+"""
+import json
+import time
+import random
+import logging
+import pathlib
+import threading
+import socketserver
+import http.server
+import urllib.parse
+
+import requests
+import pandas as pd
+
+from .transport import Transport
+
+logger = logging.getLogger(__name__)
+
+
+BITSTAMP_OHLC_MAX_LIMIT = 1000
+KRAKEN_TRADES_PAGE_SIZE = 1000
+KRAKEN_TRADE_FIELDS = ["price", "volume", "time", "side", "type", "misc", "trade_id"]
+
+
+class ExchangeFixtures:
+    """Recorded exchange API responses, stored in directory.
+
+    Args:
+        directory (str or pathlib.Path): The fixtures directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _table_path(self, exchange, endpoint, pair):
+        return self.directory / exchange / endpoint / (pair + ".csv")
+
+    def _load_table(self, path):
+        with self._lock:
+            if path not in self._tables:
+                if path.exists():
+                    self._tables[path] = pd.read_csv(path, dtype=str)
+                else:
+                    self._tables[path] = None
+            return self._tables[path]
+
+    def _save_table(self, path, table):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table.to_csv(path, index=False)
+        with self._lock:
+            self._tables[path] = table
+
+    def _load_json(self, exchange, name):
+        path = self.directory / exchange / name
+        if not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+    def _save_json(self, exchange, name, data):
+        path = self.directory / exchange / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data, indent=1))
+
+    def respond(self, url, params=None):
+        """Returns the recorded response to a GET request, as decoded JSON.
+
+        Raises:
+            KeyError: If there is no recorded response for this request.
+        """
+        params = params or {}
+        path = urllib.parse.urlsplit(url).path.rstrip("/")
+        parts = path.split("/")
+        if path.endswith("/trading-pairs-info"):
+            response = self._load_json("bitstamp", "trading-pairs-info.json")
+        elif len(parts) >= 2 and parts[-2] == "ohlc":
+            response = self._respond_ohlc(parts[-1], params)
+        elif path.endswith("/AssetPairs"):
+            response = self._load_json("kraken", "AssetPairs.json")
+        elif path.endswith("/Trades"):
+            response = self._respond_trades(params)
+        else:
+            response = None
+        if response is None:
+            raise KeyError(f"No recorded response for {url} {params}")
+        return response
+
+    def _respond_ohlc(self, pair, params):
+        table = self._load_table(self._table_path("bitstamp", "ohlc", pair))
+        if table is None:
+            return None
+        start = int(params["start"])
+        step = int(params.get("step", 60))
+        limit = min(int(params.get("limit", BITSTAMP_OHLC_MAX_LIMIT)), 1000)
+        timestamps = table["timestamp"].astype(int)
+        selected = table[(timestamps >= start) & (timestamps < start + step * limit)]
+        selected = selected.iloc[timestamps[selected.index].argsort()]
+        bins = [
+            {k: v for k, v in b.items() if not pd.isna(v)}
+            for b in selected.to_dict(orient="records")
+        ]
+        name = pair[:-3].upper() + "/" + pair[-3:].upper()
+        return {"data": {"pair": name, "ohlc": bins}}
+
+    def _respond_trades(self, params):
+        pair = params["pair"]
+        table = self._load_table(self._table_path("kraken", "Trades", pair))
+        if table is None:
+            return None
+        since = float(params.get("since", 0))
+        times = table["time"].astype(float)
+        selected = table[times >= since]
+        selected = selected.iloc[times[selected.index].argsort()]
+        selected = selected.iloc[:KRAKEN_TRADES_PAGE_SIZE]
+        fields = [f for f in KRAKEN_TRADE_FIELDS if f in table.columns]
+        trades = []
+        for trade in selected.to_dict(orient="records"):
+            row = ["" if pd.isna(trade[f]) else trade[f] for f in fields]
+            row[fields.index("time")] = float(trade["time"])
+            trades.append(row)
+        last = since if len(trades) == 0 else float(selected["time"].iloc[-1])
+        return {"error": [], "result": {pair: trades, "last": str(int(last * 1e9))}}
+
+    def record(self, url, params, response):
+        """Adds a response received from an exchange API to the fixtures"""
+        params = params or {}
+        path = urllib.parse.urlsplit(url).path.rstrip("/")
+        parts = path.split("/")
+        if path.endswith("/trading-pairs-info"):
+            self._save_json("bitstamp", "trading-pairs-info.json", response)
+        elif len(parts) >= 2 and parts[-2] == "ohlc":
+            bins = pd.DataFrame(response["data"]["ohlc"], dtype=str)
+            self._merge_table(("bitstamp", "ohlc", parts[-1]), bins, "timestamp")
+        elif path.endswith("/AssetPairs"):
+            self._save_json("kraken", "AssetPairs.json", response)
+        elif path.endswith("/Trades"):
+            trades = list(response["result"].items())[0][1]
+            columns = KRAKEN_TRADE_FIELDS[: len(trades[0])] if trades else []
+            trades = pd.DataFrame(trades, columns=columns, dtype=str)
+            self._merge_table(("kraken", "Trades", params["pair"]), trades, "time")
+        else:
+            logger.warning(f"Not recording unknown request {url}")
+
+    def _merge_table(self, table_key, rows, sort_column):
+        if len(rows) == 0:
+            return
+        path = self._table_path(*table_key)
+        table = self._load_table(path)
+        if table is not None:
+            rows = pd.concat([table, rows], ignore_index=True)
+        rows = rows.drop_duplicates()
+        rows = rows.iloc[rows[sort_column].astype(float).argsort()]
+        self._save_table(path, rows.reset_index(drop=True))
+
+
+class StandInTransport(Transport):
+    """A transport that answers requests from recorded fixtures, with
+    optional injected latency and errors.
+
+    Args:
+        fixtures (ExchangeFixtures): The recorded responses.
+        latency (float): Seconds to wait before answering each request.
+        error_rate (float): The probability that a request fails with a
+            requests.ConnectionError.
+        seed (int): The seed of the random generator drawing errors.
+    """
+
+    def __init__(self, fixtures, latency=0.0, error_rate=0.0, seed=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.request_count = 0
+
+    def _inject(self, url):
+        with self._random_lock:
+            self.request_count += 1
+            failed = self._random.random() < self.error_rate
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if failed:
+            raise requests.ConnectionError(f"Injected error for {url}")
+
+    def get(self, url, params=None):
+        return json.dumps(self.get_json(url, params)).encode()
+
+    def get_json(self, url, params=None):
+        self._inject(url)
+        try:
+            return self.fixtures.respond(url, params)
+        except KeyError as e:
+            raise requests.HTTPError(str(e))
+
+
+class RecordingTransport(Transport):
+    """A transport that forwards requests to another transport, and records
+    the responses into fixtures, for later use by a StandInTransport.
+
+    Args:
+        transport (coin2086.transport.Transport): The transport to forward
+            requests to, usually a RequestsTransport.
+        fixtures (ExchangeFixtures): Where responses are recorded.
+    """
+
+    def __init__(self, transport, fixtures):
+        self.transport = transport
+        self.fixtures = fixtures
+
+    def get(self, url, params=None):
+        body = self.transport.get(url, params)
+        self.fixtures.record(url, params, json.loads(body))
+        return body
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    # http.server.ThreadingHTTPServer was added in Python 3.7
+    daemon_threads = True
+
+
+class StandInExchangeServer:
+    """A local HTTP server that answers exchange API requests from recorded
+    fixtures, with optional injected latency and errors. Point price
+    downloaders at it with ``RequestsTransport(redirect_url=server.url)``::
+
+        with StandInExchangeServer(ExchangeFixtures(directory)) as server:
+            transport.set_transport(RequestsTransport(redirect_url=server.url))
+            coin2086.valuate_portfolio(trades)
+
+    Injected errors are answered with a 503 status.
+
+    Args:
+        fixtures (ExchangeFixtures): The recorded responses.
+        latency (float): Seconds to wait before answering each request.
+        error_rate (float): The probability that a request fails.
+        seed (int): The seed of the random generator drawing errors.
+        host (str): The address to listen on.
+        port (int): The port to listen on. By default, a free port is used.
+    """
+
+    def __init__(
+        self, fixtures, latency=0.0, error_rate=0.0, seed=None, host="127.0.0.1", port=0
+    ):
+        standin = StandInTransport(fixtures, latency, error_rate, seed)
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(parts.query))
+                try:
+                    data = standin.get(parts.path, params)
+                    status = 200
+                except requests.ConnectionError as e:
+                    data, status = json.dumps({"error": [str(e)]}).encode(), 503
+                except requests.HTTPError as e:
+                    data, status = json.dumps({"error": [str(e)]}).encode(), 404
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self.standin = standin
+        self.server = _ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,216 @@
+import abc
+import json
+import time
+import logging
+import threading
+import urllib.parse
+
+import requests
+import requests.adapters
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Transport(abc.ABC):
+    """The HTTP layer used by price downloaders to call exchange APIs.
+
+    Replacing the transport (see :py:func:`set_transport`) allows running
+    coin2086 against recorded responses, without any network access.
+    """
+
+    @abc.abstractmethod
+    def get(self, url, params=None):
+        """Sends a GET request to url with the given query parameters, and
+        returns the body of the response as bytes"""
+        pass
+
+    def get_json(self, url, params=None):
+        """Sends a GET request as get does, and returns the decoded JSON
+        response"""
+        return json.loads(self.get(url, params))
+
+
+# The published limits of the public APIs, as (requests per second, burst)
+RATE_LIMITS = {
+    # 8000 requests per 10 minutes
+    "www.bitstamp.net": (8000 / 600, 20),
+    # The counter of public endpoints decreases by 1 every second
+    "api.kraken.com": (1.0, 1),
+}
+RETRIED_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """A rate limiter, that lets acquire return at most rate times per
+    second on average, with bursts of up to capacity calls. It may be shared
+    by several threads."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until a token is available, and takes it"""
+        with self._lock:
+            now = self.clock()
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+            # Take the token now, possibly going negative, so that waiting
+            # threads are served in turn
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            self.sleep(wait)
+
+
+class RequestsTransport(Transport):
+    """Sends requests to exchange APIs with the requests library.
+
+    Each exchange gets its own pooled session, so that connections are kept
+    alive across requests and threads, and its own rate limiter. Requests
+    that time out, fail to connect or are answered with a 429 or 5xx status
+    are retried with an exponential backoff.
+
+    Args:
+        redirect_url (str): If given, requests are sent to this base URL
+            instead of the exchanges, for instance to a
+            :py:class:`coin2086.standin.StandInExchangeServer`.
+        timeout (float or tuple): The connect and read timeouts, in seconds.
+        max_retries (int): The number of times a failed request is retried.
+        backoff (float): The wait before the first retry, in seconds, that
+            doubles with each retry. A Retry-After header takes precedence.
+        rate_limits (dict): Maps exchange hosts to their (requests per
+            second, burst) limits. Defaults to RATE_LIMITS.
+        pool_size (int): The maximum number of connections kept alive to
+            each exchange.
+    """
+
+    def __init__(
+        self,
+        redirect_url=None,
+        timeout=(5.0, 30.0),
+        max_retries=5,
+        backoff=0.5,
+        rate_limits=None,
+        pool_size=16,
+    ):
+        self.redirect_url = redirect_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limits = RATE_LIMITS if rate_limits is None else rate_limits
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def _redirect(self, url):
+        if self.redirect_url is None:
+            return url
+        redirect = urllib.parse.urlsplit(self.redirect_url)
+        parts = urllib.parse.urlsplit(url)
+        return urllib.parse.urlunsplit(
+            parts._replace(scheme=redirect.scheme, netloc=redirect.netloc)
+        )
+
+    def _session(self, host):
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.pool_size
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+                if host in self.rate_limits:
+                    self._limiters[host] = TokenBucket(*self.rate_limits[host])
+            return self._sessions[host], self._limiters.get(host)
+
+    def _retry_wait(self, attempt, resp):
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * 2**attempt
+
+    def get(self, url, params=None):
+        # Limits and sessions are per exchange, even when redirected
+        host = urllib.parse.urlsplit(url).netloc
+        session, limiter = self._session(host)
+        url = self._redirect(url)
+        for attempt in range(self.max_retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+            resp = None
+            try:
+                resp = session.get(url, params=params, timeout=self.timeout)
+                if resp.status_code not in RETRIED_STATUSES:
+                    resp.raise_for_status()
+                    return resp.content
+                error = f"status {resp.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            if attempt == self.max_retries:
+                break
+            wait = self._retry_wait(attempt, resp)
+            logger.warning(f"Retrying {url} in {wait:.2f}s after error: {error}")
+            time.sleep(wait)
+        if resp is not None:
+            resp.raise_for_status()
+        raise requests.ConnectionError(
+            f"Request to {url} failed after {self.max_retries} retries: {error}"
+        )
+
+    def close(self):
+        """Closes the connections kept alive"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_transport = RequestsTransport()
+
+
+def get_transport():
+    """Returns the transport currently used by price downloaders"""
+    return _transport
+
+
+def set_transport(transport):
+    """Makes price downloaders use transport, and returns the previous one"""
+    global _transport
+    previous = _transport
+    _transport = transport
+    return previous
+
+
+def get_json(url, params=None, endpoint=None):
+    """Sends a GET request with the current transport and returns the decoded
+    JSON response, recording its latency and size under endpoint (by default,
+    the host and path of url)"""
+    if not metrics.is_collecting():
+        return _transport.get_json(url, params)
+    if endpoint is None:
+        parts = urllib.parse.urlsplit(url)
+        endpoint = parts.netloc + parts.path
+    start = time.perf_counter()
+    try:
+        body = _transport.get(url, params)
+        data = json.loads(body)
+    except Exception:
+        metrics.record_http(endpoint, time.perf_counter() - start, 0, error=True)
+        raise
+    metrics.record_http(endpoint, time.perf_counter() - start, len(body))
+    return data
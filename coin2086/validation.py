@@ -1,5 +1,7 @@
 import pandas as pd
 
+from . import metrics
+
 SUPPORTED_CRYPTOS = [
     "AAVE",
     "BAT",
@@ -64,31 +66,35 @@ SUPPORTED_CRYPTOS = [
 ]
 
 
+MANDATORY_COLUMNS = [
+    "datetime",
+    "trade_side",
+    "cryptocurrency",
+    "quantity",
+    "price",
+    "base_currency",
+    "amount",
+    "fee",
+]
+
+
+UNSIGNED_COLUMNS = ["quantity", "price", "amount", "fee"]
+
+
 def check_trades(trades):
-    mandatory_columns = set(
-        [
-            "datetime",
-            "trade_side",
-            "cryptocurrency",
-            "quantity",
-            "price",
-            "base_currency",
-            "amount",
-            "fee",
-        ]
-    )
+    mandatory_columns = set(MANDATORY_COLUMNS)
     missing = mandatory_columns - set(trades.columns)
     if len(missing) > 0:
         raise ValueError(f"Missing columns from trades dataframe {missing}")
-    currencies = set(trades["base_currency"].drop_duplicates())
+    currencies = set(trades["base_currency"].unique())
     if currencies != set(["EUR"]):
         raise ValueError("Base currency (base_currency) must be EUR for all trades")
-    sides = set(trades["trade_side"].drop_duplicates())
+    sides = set(trades["trade_side"].unique())
     if sides != set(["SELL", "BUY"]):
         raise ValueError("Trade side (trade_side) must be either BUY or SELL")
     sorted_supported = ",".join(sorted(SUPPORTED_CRYPTOS))
     supported = set(SUPPORTED_CRYPTOS)
-    cryptos = set(trades["cryptocurrency"].drop_duplicates())
+    cryptos = set(trades["cryptocurrency"].unique())
     unsupported = cryptos - supported
     if len(unsupported) > 0:
         unsupported_sorted = ",".join(sorted(list(unsupported)))
@@ -96,7 +102,7 @@ def check_trades(trades):
             f"Unsupported cryptocurrencies: {unsupported_sorted} "
             + f"supported currencies are: {sorted_supported}"
         )
-    unsigned_cols = ["quantity", "price", "amount", "fee"]
+    unsigned_cols = UNSIGNED_COLUMNS
     subset = trades[unsigned_cols]
     any_negative = (subset < 0).any(axis=None)
     if any_negative:
@@ -104,12 +110,83 @@ def check_trades(trades):
         raise ValueError(
             f"The columns {cols} are unsigned. All values MUST be positive."
         )
-    sorted_trades = trades.sort_values("datetime").reset_index()
-    sorted_trades = sorted_trades.drop(columns="index")
-    if not sorted_trades.equals(trades):
+    # Check the order in a single pass, without sorting a copy of the trades
+    is_sorted = trades["datetime"].is_monotonic_increasing
+    has_range_index = trades.index.equals(pd.RangeIndex(len(trades)))
+    if not (is_sorted and has_range_index):
         raise ValueError(
             f"It looks like your trades are not sorted by increasing datetime "
             f"with a monotic index. This can usually be fixed with "
             f"trades.sort_values('datetime').reset_index().drop(columns='index')"
         )
     trades["datetime"] = pd.to_datetime(trades["datetime"])
+
+
+class ValidatedTrades:
+    """A DataFrame of trades that was checked by check_trades.
+
+    The functions of the public API of coin2086 accept a ValidatedTrades in
+    place of a DataFrame of trades, and do not check it again. The DataFrame
+    must not be modified after it was validated.
+    """
+
+    def __init__(self, trades):
+        with metrics.stage("check_trades"):
+            check_trades(trades)
+        self.trades = trades
+
+
+def validate_trades(trades):
+    """Checks a DataFrame of trades once, so that it can be passed to several
+    functions of coin2086 without being checked again::
+
+        trades = coin2086.validate_trades(trades)
+        valuation = coin2086.valuate_portfolio(trades)
+        sales = coin2086.compute_taxable_pnls_detailed(trades)
+
+    Args:
+        trades (pandas.DataFrame): .. include:: ../../docs/includes/arg_trades.rst
+
+    Returns:
+        coin2086.validation.ValidatedTrades: The validated trades.
+
+    Raises:
+        ValueError: If the trades do not follow the :ref:`Input Format`.
+    """
+    if isinstance(trades, ValidatedTrades):
+        return trades
+    return ValidatedTrades(trades)
+
+
+def unwrap_trades(trades):
+    """Returns the DataFrame of trades, checking it unless it was validated"""
+    return validate_trades(trades).trades
+
+
+def check_trade(trade, last_datetime=None):
+    """Checks a single trade, given as a dict or a pandas.Series, the same way
+    check_trades checks a DataFrame of trades. last_datetime is the datetime of
+    the previous trade, if any, that trade must not be older than."""
+    missing = set(MANDATORY_COLUMNS) - set(trade.keys())
+    if len(missing) > 0:
+        raise ValueError(f"Missing columns from trade {missing}")
+    if trade["base_currency"] != "EUR":
+        raise ValueError("Base currency (base_currency) must be EUR for all trades")
+    if trade["trade_side"] not in ("SELL", "BUY"):
+        raise ValueError("Trade side (trade_side) must be either BUY or SELL")
+    if trade["cryptocurrency"] not in SUPPORTED_CRYPTOS:
+        sorted_supported = ",".join(sorted(SUPPORTED_CRYPTOS))
+        raise ValueError(
+            f"Unsupported cryptocurrencies: {trade['cryptocurrency']} "
+            + f"supported currencies are: {sorted_supported}"
+        )
+    if any(trade[col] < 0 for col in UNSIGNED_COLUMNS):
+        cols = ",".join(UNSIGNED_COLUMNS)
+        raise ValueError(
+            f"The columns {cols} are unsigned. All values MUST be positive."
+        )
+    if last_datetime is not None and pd.to_datetime(trade["datetime"]) < last_datetime:
+        raise ValueError(
+            f"Trades must be sorted by increasing datetime, but a trade at "
+            f"{trade['datetime']} comes after a trade at {last_datetime}"
+        )
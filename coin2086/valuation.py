@@ -1,18 +1,29 @@
 import logging
 import collections
+import concurrent.futures
 import datetime as dt
 
+import numpy as np
 import requests
 import pandas as pd
+from pandas.api.types import is_integer_dtype
 
+from . import metrics
 from . import pricedownload
-from .validation import check_trades
+from . import resultcache
+from .validation import unwrap_trades
 
 
 logger = logging.getLogger(__name__)
 
 
-def valuate_portfolio(trades, initial_portfolio=None):
+def valuate_portfolio(
+    trades,
+    initial_portfolio=None,
+    max_workers=None,
+    sparse=False,
+    price_downloader=None,
+):
     """Determines the valuation of the porfolio before each sale
 
     The formula used to compute your taxable PnL (profit and loss) from each
@@ -62,77 +73,250 @@ def valuate_portfolio(trades, initial_portfolio=None):
     Args:
         trades (pandas.DataFrame): .. include:: ../../docs/includes/arg_trades.rst
         initial_portfolio (dict):  .. include:: ../../docs/includes/arg_initial_portfolio.rst
+        max_workers (int): If given, prices are downloaded concurrently on a
+            pool of max_workers threads. The result is the same as with the
+            default sequential download.
+        sparse (bool): If True, public prices are only downloaded when they
+            contribute to the value of the portfolio: the public prices of the
+            crypto-currency sold, and of the crypto-currencies not held at the
+            time of the sale, are left to NaN. The value columns are unchanged.
+        price_downloader (coin2086.pricedownload.PriceDownloader): The source of
+            public prices. Defaults to the reference price downloader, that
+            gets prices from Bitstamp, and from Kraken for the
+            crypto-currencies not traded on Bitstamp.
 
     Returns:
         pandas.DataFrame: The DataFrame containing the composition of the
             portfolio, the valuation of the portfolio and the reference
             prices used for valuation before each sale.
     """
-    check_trades(trades)
+    trades = unwrap_trades(trades)
+
+    def valuate():
+        portfolio = valuate_portfolio_arrays(
+            trades, initial_portfolio, max_workers, sparse, price_downloader
+        )
+        with metrics.stage("to_frame"):
+            return portfolio.to_frame()
+
+    parameters = {"initial_portfolio": initial_portfolio, "sparse": sparse}
+    return resultcache.memoize(
+        "valuate_portfolio", trades, parameters, price_downloader, valuate
+    )
+
+
+def valuate_portfolio_arrays(
+    trades,
+    initial_portfolio=None,
+    max_workers=None,
+    sparse=False,
+    price_downloader=None,
+):
+    """Valuates the portfolio before each sale as valuate_portfolio does, but
+    returns the dense PortfolioArrays without building the DataFrame"""
     sales = trades[trades["trade_side"] == "SELL"]
-    portfolio = unstack_portfolio_composition(trades, sales, initial_portfolio)
-    portfolio = add_sell_prices(portfolio, sales)
-    portfolio = add_public_prices(portfolio, sales)
-    portfolio = merge_rates_and_valuate(portfolio)
-    return portfolio[["quantity", "sell_price", "public_price", "ref_price", "value"]]
+    with metrics.stage("unstack_portfolio_composition"):
+        portfolio = unstack_portfolio_composition(trades, sales, initial_portfolio)
+    with metrics.stage("add_sell_prices"):
+        add_sell_prices(portfolio, sales)
+    with metrics.stage("add_public_prices"):
+        add_public_prices(portfolio, sales, max_workers, sparse, price_downloader)
+    with metrics.stage("merge_rates_and_valuate"):
+        merge_rates_and_valuate(portfolio)
+    return portfolio
 
 
-def add_initial_portfolio(portfolio, initial_portfolio):
-    if initial_portfolio is None:
-        return
-    for crypto, qty in initial_portfolio.items():
-        if crypto not in portfolio["quantity"].columns:
-            portfolio["quantity", crypto] = 0.0
-        portfolio["quantity", crypto] += qty
+class PortfolioArrays:
+    """The composition and valuation of the portfolio before each sale, as
+    dense float64 arrays of shape (number of sales, number of cryptos).
+
+    Crypto-currencies are sorted, and identified by their position in
+    cryptos. Prices that are not known are NaN. The dtypes dict gives the
+    dtype of the blocks that are integers in the output DataFrame: when
+    there is a single crypto-currency, integer quantities and prices of the
+    trades are kept as integers.
+    """
+
+    BLOCKS = ["quantity", "sell_price", "public_price", "ref_price", "value"]
+
+    def __init__(self, index, cryptos, quantity):
+        self.index = index
+        self.cryptos = cryptos
+        self.quantity = quantity
+        self.sell_price = np.full(quantity.shape, np.nan)
+        self.public_price = np.full(quantity.shape, np.nan)
+        self.ref_price = None
+        self.value = None
+        self.total = None
+        self.dtypes = {}
+
+    def to_frame(self):
+        """Builds the column multi-indexed DataFrame output by valuate_portfolio"""
+        columns = [(block, c) for block in self.BLOCKS for c in self.cryptos]
+        columns.append(("value", "TOTAL"))
+        data = [getattr(self, block) for block in self.BLOCKS]
+        data.append(self.total[:, np.newaxis])
+        frame = pd.DataFrame(
+            np.hstack(data),
+            index=self.index,
+            columns=pd.MultiIndex.from_tuples(columns, names=[None, "cryptocurrency"]),
+        )
+        dtypes = {col: self.dtypes[col[0]] for col in columns if col[0] in self.dtypes}
+        if len(dtypes) > 0:
+            frame = frame.astype(dtypes)
+        return frame
 
 
 def unstack_portfolio_composition(trades, sales, initial_portfolio):
-    portfolio = trades[["cryptocurrency", "quantity", "trade_side"]].copy()
+    initial_portfolio = initial_portfolio or {}
+    cryptos = sorted(set(trades["cryptocurrency"]) | set(initial_portfolio))
+    codes = pd.Index(cryptos).get_indexer(trades["cryptocurrency"])
     # Compute a signed quantity for each trade by multiplying by
     # -1 for sales and 1 for purchases
-    portfolio["sign"] = -1
-    portfolio.loc[portfolio["trade_side"] == "BUY", "sign"] = 1
-    portfolio["quantity"] = portfolio["quantity"] * portfolio["sign"]
-    portfolio = portfolio.drop(columns=["sign", "trade_side"])
-    # Unstack the composition of the portofolio after each transaction
-    portfolio = portfolio.set_index("cryptocurrency", append=True).unstack().fillna(0)
-    # We need the valuation of the portoflio *before* each transaction
-    # so shift by one
-    portfolio["quantity"] = portfolio["quantity"].cumsum().shift(1, fill_value=0)
-    # Add the initial portfolio to the first trade
-    add_initial_portfolio(portfolio, initial_portfolio)
-    return portfolio.reindex(sales.index)
+    sign = np.where(trades["trade_side"].values == "BUY", 1, -1)
+    signed_quantity = trades["quantity"].values * sign
+    # We need the composition of the portoflio *before* each sale, that is the
+    # cumulative sum of the quantities of each crypto traded before the sale
+    sale_positions = np.flatnonzero(trades.index.isin(sales.index))
+    quantity = np.zeros((len(sale_positions), len(cryptos)))
+    for code, crypto in enumerate(cryptos):
+        positions = np.flatnonzero(codes == code)
+        cumulative = np.concatenate([[0.0], np.cumsum(signed_quantity[positions])])
+        traded_before = np.searchsorted(positions, sale_positions, side="left")
+        quantity[:, code] = cumulative[traded_before]
+        # Add the initial portfolio to the traded quantities
+        if crypto in initial_portfolio:
+            quantity[:, code] += initial_portfolio[crypto]
+    portfolio = PortfolioArrays(sales.index, cryptos, quantity)
+    if len(cryptos) == 1 and is_integer_dtype(trades["quantity"]):
+        portfolio.dtypes["quantity"] = np.result_type(
+            trades["quantity"].dtype, *initial_portfolio.values()
+        )
+    return portfolio
 
 
 def merge_rates_and_valuate(portfolio):
-    portfolio = portfolio.stack()
-    portfolio["ref_price"] = portfolio["sell_price"].fillna(portfolio["public_price"])
-    portfolio["value"] = portfolio["ref_price"] * portfolio["quantity"]
-    portfolio = portfolio.unstack()
-    portfolio["value", "TOTAL"] = portfolio["value"].sum(axis=1)
-    return portfolio
+    sell_price = portfolio.sell_price
+    portfolio.ref_price = np.where(
+        np.isnan(sell_price), portfolio.public_price, sell_price
+    )
+    portfolio.value = portfolio.ref_price * portfolio.quantity
+    # Holdings of zero are worth zero, even when their price was not looked up
+    portfolio.value[portfolio.quantity == 0] = 0.0
+    portfolio.total = np.nansum(portfolio.value, axis=1)
+    if "sell_price" in portfolio.dtypes:
+        portfolio.dtypes["ref_price"] = portfolio.dtypes["sell_price"]
+        if "quantity" in portfolio.dtypes:
+            portfolio.dtypes["value"] = np.result_type(
+                portfolio.dtypes["sell_price"], portfolio.dtypes["quantity"]
+            )
 
 
 def add_sell_prices(portfolio, sales):
-    sell_prices = sales[["cryptocurrency", "price"]]
-    sell_prices = sell_prices.rename(columns={"price": "sell_price"})
-    sell_prices = sell_prices.set_index("cryptocurrency", append=True).unstack()
-    return portfolio.join(sell_prices, how="outer")
-
-
-def add_public_prices(portfolio, sales):
-    pricedown = pricedownload.reference_price_downloader()
-    dated_portfolio = portfolio["quantity"].join(sales["datetime"])
-    price_records = []
-    for rec in dated_portfolio.to_dict(orient="records"):
-        dtime = rec["datetime"]
-        del rec["datetime"]
-        price_rec = {}
-        for crypto in rec.keys():
-            price_rec[crypto] = pricedown.download_price(crypto, dtime.to_pydatetime())
-        price_records.append(price_rec)
-    public_prices = pd.DataFrame(price_records, index=sales.index)
-    public_prices.columns = pd.MultiIndex.from_product(
-        [["public_price"], public_prices.columns]
-    )
-    return portfolio.join(public_prices, how="outer")
+    codes = pd.Index(portfolio.cryptos).get_indexer(sales["cryptocurrency"])
+    rows = np.arange(len(sales))
+    portfolio.sell_price[rows, codes] = sales["price"].values
+    if len(portfolio.cryptos) == 1 and is_integer_dtype(sales["price"]):
+        portfolio.dtypes["sell_price"] = sales["price"].dtype
+
+
+def needed_public_prices(portfolio, sparse=False):
+    """Returns a boolean array telling which public prices of portfolio are
+    needed to valuate it. If sparse is True, prices that do not contribute to
+    the value of the portfolio (the price of the crypto-currency sold, and of
+    the ones not held) are not needed."""
+    if not sparse:
+        return np.ones(portfolio.quantity.shape, dtype=bool)
+    return (portfolio.quantity != 0) & np.isnan(portfolio.sell_price)
+
+
+def plan_public_prices(portfolio, sales, sparse=False):
+    """Returns a dict mapping each crypto-currency to the datetimes at which
+    its public price is needed to valuate the portfolio (see
+    needed_public_prices). The number of public prices a sparse valuation
+    skips is recorded as the sparse_skipped_lookups metric."""
+    needed = needed_public_prices(portfolio, sparse)
+    if sparse:
+        skipped = int(needed.size - needed.sum())
+        metrics.record_count("sparse_skipped_lookups", skipped)
+        logger.info(f"Sparse valuation: skipped {skipped} public price lookups")
+    dtimes = [d.to_pydatetime() for d in sales["datetime"]]
+    plan = {}
+    for code, crypto in enumerate(portfolio.cryptos):
+        crypto_dtimes = [d for d, n in zip(dtimes, needed[:, code]) if n]
+        if len(crypto_dtimes) > 0:
+            plan[crypto] = crypto_dtimes
+    return plan
+
+
+def map_concurrently(func, args_list, max_workers=None):
+    """Returns [func(*args) for args in args_list], calling func on a pool of
+    max_workers threads if max_workers is given"""
+    if max_workers is None:
+        return [func(*args) for args in args_list]
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(lambda args: func(*args), args_list))
+
+
+def add_public_prices(
+    portfolio, sales, max_workers=None, sparse=False, price_downloader=None
+):
+    pricedown = price_downloader
+    if pricedown is None:
+        pricedown = pricedownload.reference_price_downloader()
+    # Download the prices of each crypto at once, with as few requests as
+    # possible
+    plan = plan_public_prices(portfolio, sales, sparse)
+    prices = download_planned_prices(plan, pricedown, max_workers)
+    fill_public_prices(portfolio, sales, plan, prices, sparse)
+
+
+def download_planned_prices(plan, price_downloader, max_workers=None):
+    """Downloads the prices of plan, as returned by plan_public_prices, and
+    returns a dict mapping each (crypto, datetime) pair to its price. If
+    max_workers is given, the prices are downloaded concurrently on a pool of
+    max_workers threads, split along the requests of the price downloader
+    (see plan_downloads), so that the prices of a single crypto are also
+    downloaded concurrently."""
+
+    def download_crypto_prices(crypto, dtimes):
+        prices = price_downloader.download_prices(crypto, dtimes)
+        return [((crypto, d), p) for d, p in zip(dtimes, prices)]
+
+    # Download each distinct price once
+    plan = {crypto: list(dict.fromkeys(dtimes)) for crypto, dtimes in plan.items()}
+    if max_workers is None:
+        downloads = plan.items()
+    else:
+        downloads = [
+            (crypto, group)
+            for crypto, dtimes in plan.items()
+            for group in price_downloader.plan_downloads(crypto, dtimes)
+        ]
+    prices = map_concurrently(download_crypto_prices, downloads, max_workers)
+    return dict(item for crypto_prices in prices for item in crypto_prices)
+
+
+def plan_trades_prices(trades, initial_portfolio=None, sparse=False):
+    """Returns the plan_public_prices of the valuation of trades, without
+    downloading any price"""
+    trades = unwrap_trades(trades)
+    sales = trades[trades["trade_side"] == "SELL"]
+    portfolio = unstack_portfolio_composition(trades, sales, initial_portfolio)
+    add_sell_prices(portfolio, sales)
+    return plan_public_prices(portfolio, sales, sparse)
+
+
+def fill_public_prices(portfolio, sales, plan, prices, sparse=False):
+    """Fills the public prices of portfolio from prices, a dict mapping
+    each (crypto, datetime) pair of plan to its price. The public prices that
+    are not needed (see needed_public_prices) are left to NaN, even when the
+    price at the same datetime is known."""
+    needed = needed_public_prices(portfolio, sparse)
+    dtimes = [d.to_pydatetime() for d in sales["datetime"]]
+    for code, crypto in enumerate(portfolio.cryptos):
+        if crypto in plan:
+            public_price = [prices.get((crypto, d), np.nan) for d in dtimes]
+            portfolio.public_price[:, code] = np.where(
+                needed[:, code], public_price, np.nan
+            )
@@ -0,0 +1,86 @@
+import os
+import time
+import pathlib
+import datetime as dt
+
+import pytest
+
+from coin2086 import pricedownload
+from coin2086 import transport
+from coin2086.standin import ExchangeFixtures, StandInTransport
+
+FIXTURES_DIR = pathlib.Path(__file__).parent.absolute() / "fixtures" / "exchanges"
+
+DTIME = dt.datetime(2021, 5, 12, 11, 33)
+
+
+def tzset():
+    # time.tzset is only available on POSIX
+    if hasattr(time, "tzset"):
+        time.tzset()
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--live",
+        action="store_true",
+        help="Download prices from the exchange APIs instead of the fixtures",
+    )
+
+
+@pytest.fixture
+def exchange_fixtures():
+    return ExchangeFixtures(FIXTURES_DIR)
+
+
+@pytest.fixture(autouse=True)
+def offline_exchanges(request, exchange_fixtures):
+    """Answers exchange API requests from the fixtures, unless --live is
+    given. The fixtures are derived from the reference data rather than
+    recorded from the exchanges, so that offline runs only test the plumbing:
+    run with --live to test against the real APIs"""
+    if request.config.getoption("--live"):
+        yield
+        return
+    # Timestamps in the fixtures were computed in UTC
+    previous_tz = os.environ.get("TZ")
+    os.environ["TZ"] = "UTC"
+    tzset()
+    previous = transport.set_transport(StandInTransport(exchange_fixtures))
+    yield
+    transport.set_transport(previous)
+    if previous_tz is None:
+        del os.environ["TZ"]
+    else:
+        os.environ["TZ"] = previous_tz
+    tzset()
+
+
+def make_minute_bins(crypto, dtime, limit=100):
+    start = int(dtime.timestamp())
+    bins = [
+        {"timestamp": str(start + 60 * i), "close": str(100.0 + i)}
+        for i in range(limit)
+    ]
+    return {"data": {"pair": crypto + "/EUR", "ohlc": bins}}
+
+
+@pytest.fixture
+def bitstamp_requests(monkeypatch):
+    downloads = []
+
+    def fake_supported_pairs():
+        downloads.append("pairs")
+        return [pricedownload.TradingPair(base="BTC", quote="EUR")]
+
+    def fake_minute_bins(crypto, dtime, limit=100):
+        downloads.append((crypto, dtime, limit))
+        return make_minute_bins(crypto, dtime, limit)
+
+    monkeypatch.setattr(
+        pricedownload, "bitstamp_download_supported_pairs", fake_supported_pairs
+    )
+    monkeypatch.setattr(
+        pricedownload, "bitstamp_download_minute_bins", fake_minute_bins
+    )
+    return downloads
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+import pandas as pd
+import pytest
+
+import coin2086
+from coin2086 import aio
+from coin2086 import pricedownload
+from coin2086.pricestore import SQLitePriceStore
+
+from .test_non_regression import load_reference_dataframes
+
+
+def run_in_new_loop(coroutine):
+    # asyncio.run was added in Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class CountingPriceDownloader(pricedownload.PriceDownloader):
+    def __init__(self, price_downloader):
+        self.price_downloader = price_downloader
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def supported_crypto_list(self):
+        return self.price_downloader.supported_crypto_list
+
+    def download_price(self, crypto, dtime):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return self.price_downloader.download_price(crypto, dtime)
+        finally:
+            self.in_flight -= 1
+
+
+class ThreadRecordingPriceStore(SQLitePriceStore):
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+
+    def get_price(self, source, crypto, dtime):
+        self.threads.add(threading.get_ident())
+        return super().get_price(source, crypto, dtime)
+
+    def get_prices(self, source, crypto, start, end):
+        self.threads.add(threading.get_ident())
+        return super().get_prices(source, crypto, start, end)
+
+    def put_prices(self, source, crypto, prices):
+        self.threads.add(threading.get_ident())
+        return super().put_prices(source, crypto, prices)
+
+
+@pytest.mark.parametrize(
+    "trades_fname",
+    [
+        "real_world.csv",
+        "form_2086_notice.csv",
+        "interleaved_exotics_trades.csv",
+    ],
+)
+def test_async_against_reference(trades_fname):
+    trades, valuation_ref, pnl_ref = load_reference_dataframes(trades_fname)
+
+    async def run():
+        valuation = await coin2086.valuate_portfolio_async(trades)
+        pnl = await coin2086.compute_taxable_pnls_detailed_async(trades)
+        return valuation, pnl
+
+    valuation, pnl = run_in_new_loop(run())
+    pd.testing.assert_frame_equal(valuation, valuation_ref)
+    pd.testing.assert_frame_equal(pnl, pnl_ref)
+
+
+def test_async_concurrency_cap():
+    trades, valuation_ref, _ = load_reference_dataframes("interleaved_trades.csv")
+    downloader = CountingPriceDownloader(
+        pricedownload.instantiate_reference_price_downloader()
+    )
+    valuation = run_in_new_loop(
+        coin2086.valuate_portfolio_async(
+            trades, price_downloader=downloader, max_concurrency=2
+        )
+    )
+    pd.testing.assert_frame_equal(valuation, valuation_ref)
+    assert 0 < downloader.max_in_flight <= 2
+
+
+def test_async_store_lookups_leave_the_event_loop(tmp_path):
+    trades, valuation_ref, _ = load_reference_dataframes("real_world.csv")
+    store = ThreadRecordingPriceStore(tmp_path / "prices.sqlite")
+    for _ in range(2):
+        # The second downloader finds all the prices in the store
+        downloader = pricedownload.instantiate_reference_price_downloader(store)
+        valuation = run_in_new_loop(
+            coin2086.valuate_portfolio_async(trades, price_downloader=downloader)
+        )
+        pd.testing.assert_frame_equal(valuation, valuation_ref)
+    assert len(store.threads) > 0
+    assert threading.get_ident() not in store.threads
@@ -0,0 +1,48 @@
+import pandas as pd
+
+import coin2086
+from coin2086.batch import BatchPortfolio, as_batch_portfolio, plan_batch_prices
+from coin2086.pricestore import SQLitePriceStore
+
+from .test_non_regression import load_reference_dataframes, make_ref_path
+
+TRADES_FNAMES = [
+    "real_world.csv",
+    "interleaved_trades.csv",
+    "interleaved_multiyear_trades.csv",
+    "interleaved_exotics_trades.csv",
+]
+
+
+def test_compute_taxable_pnls_batch(tmp_path):
+    portfolios = {}
+    expected = {}
+    for fname in TRADES_FNAMES:
+        trades = load_reference_dataframes(fname)[0]
+        # Portfolios are given as paths, DataFrames or BatchPortfolio
+        portfolios[fname] = make_ref_path(fname, ".csv")
+        portfolios[fname + "_frame"] = trades
+        expected[fname] = expected[
+            fname + "_frame"
+        ] = coin2086.compute_taxable_pnls_by_year(trades.copy())
+    trades = load_reference_dataframes("form_2086_notice.csv")[0]
+    portfolios["initial"] = BatchPortfolio(trades, {"BTC": 0.5}, 3000.0)
+    expected["initial"] = coin2086.compute_taxable_pnls_by_year(
+        trades.copy(), initial_portfolio={"BTC": 0.5}, initial_purchase_price=3000.0
+    )
+    store = SQLitePriceStore(tmp_path / "prices.sqlite")
+    with coin2086.collect_metrics() as run:
+        reports = coin2086.compute_taxable_pnls_batch(
+            portfolios, max_processes=2, store=store
+        )
+    assert reports.keys() == portfolios.keys()
+    for name, report in reports.items():
+        assert report.keys() == expected[name].keys()
+        for year, (form2086, total) in expected[name].items():
+            pd.testing.assert_frame_equal(report[year][0], form2086)
+            assert report[year][1] == total
+    # The prices were downloaded once by the parent process, and then read
+    # from the store by the worker processes
+    plan = plan_batch_prices(as_batch_portfolio(p) for p in portfolios.values())
+    assert 0 < run.cache["bitstamp"]["misses"] <= sum(len(d) for d in plan.values())
+    assert len(store.summary()) > 0
@@ -0,0 +1,78 @@
+import io
+
+import pandas as pd
+
+import coin2086
+from coin2086 import bitstamp
+from coin2086.columnar import read_columnar_trades
+from coin2086.pricedownload import PriceDownloader
+
+BITSTAMP_EXPORT = """Type,Datetime,Account,Amount,Value,Rate,Fee,Sub Type
+Deposit,"Jul. 27, 2020, 09:00 AM",Main Account,10000.00000000 EUR,,,,
+Market,"Jul. 28, 2020, 10:20 AM",Main Account,1.00000000 BTC,9262.42 EUR,9262.42 EUR,46.31 EUR,Buy
+Market,"Sep. 01, 2020, 12:20 PM",Main Account,5.00000000 ETH,1967.90 EUR,393.58 EUR,9.84 EUR,Buy
+Withdrawal,"Sep. 02, 2020, 08:00 AM",Main Account,1.00000000 ETH,,,,
+Market,"Sep. 05, 2020, 04:50 PM",Main Account,0.50000000 BTC,4361.35 EUR,8722.70 EUR,21.81 EUR,Sell
+Market,"Sep. 08, 2020, 12:40 PM",Main Account,4.00000000 ETH,1140.28 EUR,285.07 EUR,5.70 EUR,Sell
+Market,"Dec. 21, 2020, 09:30 AM",Main Account,0.50000000 BTC,9765.85 EUR,19531.69 EUR,48.83 EUR,Sell
+"""
+
+
+class FixedPriceDownloader(PriceDownloader):
+    @property
+    def supported_crypto_list(self):
+        return ["BTC", "ETH"]
+
+    def download_price(self, crypto, dtime):
+        return 100.0
+
+
+def read_export():
+    return pd.read_csv(io.StringIO(BITSTAMP_EXPORT))
+
+
+def as_objects(trades):
+    return trades.astype({col: object for col in bitstamp.CATEGORICAL_COLUMNS})
+
+
+def test_normalize_bitstamp_transactions():
+    trades = bitstamp.normalize_bitstamp_transactions(read_export(), "2020-08-01")
+    assert list(trades.index) == [0, 1, 2, 3]
+    assert list(trades["trade_side"]) == ["BUY", "SELL", "SELL", "SELL"]
+    assert list(trades["cryptocurrency"]) == ["ETH", "BTC", "ETH", "BTC"]
+    assert trades["price"].iloc[1] == 8722.70
+    assert trades["datetime"].iloc[0] == pd.Timestamp("2020-09-01 12:20")
+
+
+def test_iter_bitstamp_transactions():
+    expected = bitstamp.normalize_bitstamp_transactions(read_export(), "2020-01-01")
+    batches = list(
+        bitstamp.iter_bitstamp_transactions(
+            io.StringIO(BITSTAMP_EXPORT), "2020-01-01", chunksize=2
+        )
+    )
+    assert len(batches) == 4
+    assert isinstance(batches[0]["cryptocurrency"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(as_objects(pd.concat(batches)), expected)
+
+
+def test_write_bitstamp_transactions(tmp_path):
+    expected = bitstamp.normalize_bitstamp_transactions(read_export(), "2020-01-01")
+    count = bitstamp.write_bitstamp_transactions(
+        io.StringIO(BITSTAMP_EXPORT), tmp_path / "trades", "2020-01-01", chunksize=3
+    )
+    assert count == len(expected)
+    for mmap in [False, True]:
+        trades = read_columnar_trades(tmp_path / "trades", mmap=mmap)
+        pd.testing.assert_frame_equal(as_objects(trades), expected)
+    # Categorical trades are accepted by the public API
+    pd.testing.assert_frame_equal(
+        coin2086.compute_taxable_pnls_detailed(
+            trades, price_downloader=FixedPriceDownloader()
+        ),
+        coin2086.compute_taxable_pnls_detailed(
+            expected, price_downloader=FixedPriceDownloader()
+        ),
+        check_dtype=False,
+        check_categorical=False,
+    )
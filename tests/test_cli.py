@@ -0,0 +1,77 @@
+import pandas as pd
+
+import coin2086
+from coin2086 import cli
+from coin2086 import pricedownload
+from coin2086 import transport
+from coin2086.pricestore import SQLitePriceStore
+
+from .test_non_regression import load_reference_dataframes, make_ref_path
+
+TRADES_FNAMES = ["real_world.csv", "interleaved_exotics_trades.csv"]
+
+
+def test_prefetch(tmp_path, capsys):
+    store_path = tmp_path / "prices.sqlite"
+    paths = [str(make_ref_path(fname, ".csv")) for fname in TRADES_FNAMES]
+    invalid = tmp_path / "invalid.csv"
+    invalid.write_text("datetime,price\n2021-01-01,1.0\n")
+    assert cli.main(["prefetch", "--store", str(store_path), *paths]) == 0
+    output = capsys.readouterr().err
+    assert "0 already in the store" in output
+    assert "ETA" in output
+    # Prefetching again downloads nothing, and reports invalid files
+    assert cli.main(["prefetch", "--store", str(store_path), *paths, str(invalid)]) == 1
+    output = capsys.readouterr().err
+    assert f"Skipping {invalid}" in output
+    assert " 0 to download" in output
+    # The portfolios are then valuated from the store only
+    transport.set_transport(None)
+    store = SQLitePriceStore(store_path)
+    for fname in TRADES_FNAMES:
+        trades, valuation, _ = load_reference_dataframes(fname)
+        price_downloader = pricedownload.instantiate_reference_price_downloader(store)
+        pd.testing.assert_frame_equal(
+            coin2086.valuate_portfolio(trades, price_downloader=price_downloader),
+            valuation,
+        )
+
+
+def test_prefetch_needs_a_store(monkeypatch, capsys):
+    monkeypatch.delenv("COIN2086_PRICE_STORE", raising=False)
+    assert cli.main(["prefetch", "trades.csv"]) == 2
+    assert "No price store" in capsys.readouterr().err
+
+
+def test_prefetch_counts_missing_prices(capsys):
+    class PartialPriceDownloader(pricedownload.PriceDownloader):
+        """Stores the prices of a chunk until the first one at an odd
+        minute, which is missing"""
+
+        def __init__(self):
+            self.prices = {}
+
+        @property
+        def supported_crypto_list(self):
+            return ["BTC", "ETH"]
+
+        def download_price(self, crypto, dtime):
+            if dtime.minute % 2 == 1:
+                raise RuntimeError(f"No {crypto} price at {dtime}")
+            self.prices[crypto, dtime] = 1.0
+            return 1.0
+
+        def download_prices(self, crypto, dtimes):
+            return [self.download_price(crypto, d) for d in dtimes]
+
+        def cached_price(self, crypto, dtime):
+            return self.prices.get((crypto, dtime))
+
+    paths = [str(make_ref_path("real_world.csv", ".csv"))]
+    downloader = PartialPriceDownloader()
+    failed = cli.prefetch(paths, None, chunk_size=10, price_downloader=downloader)
+    plan, _ = cli.plan_files_prices(paths, sparse=False)
+    planned = sum(len(dtimes) for dtimes in plan.values())
+    assert 0 < failed < planned
+    assert failed == planned - len(downloader.prices)
+    assert f"Could not download {failed} prices" in capsys.readouterr().err
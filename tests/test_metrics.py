@@ -0,0 +1,82 @@
+import datetime as dt
+
+import pytest
+import pandas as pd
+
+import coin2086
+from coin2086 import metrics
+from coin2086 import pricedownload
+from coin2086 import valuation
+
+from .test_non_regression import load_trades, make_ref_path
+
+
+class FailingPriceDownloader(pricedownload.PriceDownloader):
+    SOURCE_NAME = "failing"
+
+    @property
+    def supported_crypto_list(self):
+        return ["BTC"]
+
+    def download_price(self, crypto, dtime):
+        raise RuntimeError("Unavailable")
+
+
+class FixedPriceDownloader(FailingPriceDownloader):
+    SOURCE_NAME = "fixed"
+
+    def download_price(self, crypto, dtime):
+        return 100.0
+
+
+def test_collect_metrics():
+    trades = load_trades(make_ref_path("interleaved_trades.csv", ".csv"))
+    downloader = pricedownload.instantiate_reference_price_downloader()
+    with coin2086.collect_metrics() as run:
+        coin2086.compute_taxable_pnls_detailed(trades, price_downloader=downloader)
+    stats = run.as_dict()
+    for stage in [
+        "check_trades",
+        "unstack_portfolio_composition",
+        "add_public_prices",
+        "merge_rates_and_valuate",
+        "compute_purchase_price_fraction",
+    ]:
+        assert stats["stages"][stage]["calls"] == 1
+    assert stats["http"]["bitstamp/ohlc"]["requests"] > 0
+    assert stats["http"]["bitstamp/ohlc"]["bytes"] > 0
+    assert stats["http"]["bitstamp/trading-pairs-info"]["requests"] == 1
+    # Each distinct price needed is a miss, downloaded once
+    plan = valuation.plan_trades_prices(trades, sparse=True)
+    misses = sum(pd.DatetimeIndex(d).round("min").nunique() for d in plan.values())
+    assert stats["cache"]["bitstamp"] == {"hits": 0, "misses": misses}
+    # and then served from the cache
+    with coin2086.collect_metrics() as run:
+        coin2086.compute_taxable_pnls_detailed(trades, price_downloader=downloader)
+    assert "bitstamp/ohlc" not in run.http
+    assert run.cache_hit_rate("bitstamp") == 1.0
+
+
+def test_collect_metrics_fallbacks():
+    multi = pricedownload.MultiSourceFirstPriceDownloader(
+        [FailingPriceDownloader(), FixedPriceDownloader()]
+    )
+    with coin2086.collect_metrics() as run:
+        assert multi.download_price("BTC", dt.datetime(2021, 1, 1)) == 100.0
+    assert run.fallbacks == {"failing": 1}
+    assert not metrics.is_collecting()
+
+
+def test_metrics_hooks():
+    stages = []
+
+    class StageHook(metrics.Metrics):
+        def on_stage(self, name, seconds):
+            stages.append(name)
+
+    with coin2086.collect_metrics(StageHook()):
+        with metrics.stage("some_stage"):
+            pass
+    with metrics.stage("other_stage"):
+        pass
+    assert stages == ["some_stage"]
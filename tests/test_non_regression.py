@@ -54,14 +54,60 @@ def load_reference_dataframes(trades_fname):
         "interleaved_exotics_trades.csv",
     ],
 )
-def test_trades_against_reference(trades_fname):
+@pytest.mark.parametrize("max_workers", [None, 4])
+def test_trades_against_reference(trades_fname, max_workers):
     trades, valuation_ref, pnl_ref = load_reference_dataframes(trades_fname)
-    valuation = coin2086.valuate_portfolio(trades)
-    pnl = coin2086.compute_taxable_pnls_detailed(trades)
+    valuation = coin2086.valuate_portfolio(trades, max_workers=max_workers)
+    pnl = coin2086.compute_taxable_pnls_detailed(trades, max_workers=max_workers)
     pd.testing.assert_frame_equal(valuation, valuation_ref)
     pd.testing.assert_frame_equal(pnl, pnl_ref)
 
 
+@pytest.mark.parametrize(
+    "trades_fname",
+    [
+        "real_world.csv",
+        "form_2086_notice.csv",
+        "interleaved_trades.csv",
+        "interleaved_multiyear_trades.csv",
+        "interleaved_exotics_trades.csv",
+    ],
+)
+def test_incremental_engine_against_reference(trades_fname):
+    trades, _, pnl_ref = load_reference_dataframes(trades_fname)
+    engine = coin2086.IncrementalPnlEngine()
+    half = len(trades) // 2
+    first_sales = engine.push_many(trades.iloc[:half])
+    last_sales = engine.push_many(trades.iloc[half:])
+    pnl = pd.concat([first_sales, last_sales])
+    pd.testing.assert_frame_equal(pnl, pnl_ref)
+
+
+def test_sparse_valuation_against_reference():
+    trades_fname = "interleaved_exotics_trades.csv"
+    trades, valuation_ref, _ = load_reference_dataframes(trades_fname)
+    with coin2086.collect_metrics() as run:
+        valuation = coin2086.valuate_portfolio(trades, sparse=True)
+    pd.testing.assert_frame_equal(valuation["value"], valuation_ref["value"])
+    # Only the public prices of the cryptos held and not sold are looked up
+    needed = (valuation["quantity"] != 0) & valuation["sell_price"].isna()
+    public_price = valuation["public_price"]
+    public_price_ref = valuation_ref["public_price"].where(needed)
+    pd.testing.assert_frame_equal(public_price, public_price_ref)
+    skipped = run.as_dict()["counts"]["sparse_skipped_lookups"]
+    assert skipped == (~needed).values.sum() > 0
+
+
+def test_sparse_valuation_of_sales_at_the_same_datetime():
+    trades = load_trades(make_ref_path("interleaved_trades.csv", ".csv"))
+    sales = trades.index[trades["trade_side"] == "SELL"][:2]
+    trades.loc[sales[1], "datetime"] = trades.loc[sales[0], "datetime"]
+    trades = trades.sort_values("datetime", kind="stable")
+    valuation = coin2086.valuate_portfolio(trades, sparse=True)
+    needed = (valuation["quantity"] != 0) & valuation["sell_price"].isna()
+    assert valuation["public_price"].notna().equals(needed)
+
+
 def test_compute_pnl():
     trades = load_trades(make_ref_path("interleaved_multiyear_trades.csv", ".csv"))
     pnl_declare_path = make_ref_path(
@@ -73,3 +119,20 @@ def test_compute_pnl():
     pnl_declare, total_pnl = coin2086.compute_taxable_pnls(trades, 2020)
     print(pnl_declare)
     pd.testing.assert_frame_equal(pnl_declare, pnl_declare_ref)
+
+
+def test_compute_pnls_by_year():
+    trades = load_trades(make_ref_path("interleaved_multiyear_trades.csv", ".csv"))
+    pnl_declare_path = make_ref_path(
+        "interleaved_multiyear_trades.csv", "_2020_pnl.csv"
+    )
+    pnl_declare_ref = pd.read_csv(pnl_declare_path, index_col=0)
+    pnl_declare_ref.iloc[:, 1] = pd.to_datetime(pnl_declare_ref.iloc[:, 1])
+    reports = coin2086.compute_taxable_pnls_by_year(trades)
+    assert sorted(reports.keys()) == [2019, 2020, 2021]
+    pnl_declare, total_pnl = reports[2020]
+    pd.testing.assert_frame_equal(pnl_declare, pnl_declare_ref)
+    assert total_pnl == pytest.approx(pnl_declare_ref.iloc[:, -1].sum())
+    pnl_declare, total_pnl = coin2086.compute_taxable_pnls_by_year(trades, [2018])[2018]
+    assert len(pnl_declare) == 0
+    assert total_pnl == 0.0
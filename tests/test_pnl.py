@@ -0,0 +1,63 @@
+import sys
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from coin2086 import pnl
+
+from .test_non_regression import make_ref_path
+
+
+def run_purchase_price_fraction(compute, amount, value, purchase_price):
+    outputs = [np.zeros(len(amount)) for _ in range(3)]
+    compute(amount, value, purchase_price, *outputs)
+    return outputs
+
+
+def check_against_loop(amount, value, purchase_price):
+    expected = run_purchase_price_fraction(
+        pnl.compute_purchase_price_fraction_loop, amount, value, purchase_price
+    )
+    actual = run_purchase_price_fraction(
+        pnl.compute_purchase_price_fraction_vectorized, amount, value, purchase_price
+    )
+    for exp, act in zip(expected, actual):
+        np.testing.assert_allclose(act, exp, rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "trades_fname",
+    [
+        "real_world.csv",
+        "form_2086_notice.csv",
+        "interleaved_trades.csv",
+        "interleaved_multiyear_trades.csv",
+        "interleaved_exotics_trades.csv",
+    ],
+)
+def test_vectorized_purchase_price_fraction_reference(trades_fname):
+    sales = pd.read_csv(make_ref_path(trades_fname, "_detailed_pnl.csv"))
+    check_against_loop(
+        sales["amount"].values,
+        sales["portfolio_value"].values,
+        sales["portfolio_purchase_price"].values,
+    )
+
+
+def test_vectorized_purchase_price_fraction_synthetic():
+    rng = np.random.default_rng(2086)
+    n = 50000
+    value = rng.uniform(1000.0, 5000.0, n)
+    amount = value * rng.uniform(0.0, 0.5, n)
+    # Some sales sell the whole portfolio
+    whole = rng.integers(0, n, 50)
+    amount[whole] = value[whole]
+    purchase_price = np.cumsum(rng.uniform(0.0, 100.0, n))
+    check_against_loop(amount, value, purchase_price)
+
+
+def test_numba_is_imported_when_needed():
+    code = "import sys, coin2086; assert 'numba' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,77 @@
+import datetime as dt
+
+import pytest
+
+from coin2086 import pricedownload
+from coin2086.pricecache import PriceCache, default_price_cache
+
+from .conftest import DTIME
+
+DAY = dt.timedelta(days=1)
+
+
+def day_prices(day, n=2):
+    return [(DTIME + day * DAY + dt.timedelta(minutes=m), float(day)) for m in range(n)]
+
+
+def test_lru_evicts_least_recently_used_days():
+    cache = PriceCache(max_entries=4, policy="lru")
+    cache.put("BTC", day_prices(0))
+    cache.put("BTC", day_prices(1))
+    assert cache.get("BTC", DTIME) == 0.0
+    cache.put("BTC", day_prices(2))
+    # Day 1 was used less recently than day 0
+    assert cache.get("BTC", DTIME + DAY) is None
+    assert cache.get("BTC", DTIME) == 0.0
+    assert cache.get("BTC", DTIME + 2 * DAY) == 2.0
+    assert cache.stats() == {
+        "entries": 4,
+        "blocks": 2,
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+        "evicted_entries": 2,
+    }
+
+
+def test_lfu_evicts_least_frequently_used_days():
+    cache = PriceCache(max_entries=4, policy="lfu")
+    cache.put("BTC", day_prices(0))
+    cache.put("ETH", day_prices(0))
+    for _ in range(3):
+        cache.get("BTC", DTIME)
+    cache.get("ETH", DTIME)
+    cache.put("BTC", day_prices(1))
+    assert cache.get("ETH", DTIME) is None
+    assert cache.get("BTC", DTIME) == 0.0
+    # The block just stored is kept, even if larger than the cache
+    cache.put("BTC", day_prices(2, n=10))
+    assert len(cache) == 10
+    assert cache.get("BTC", DTIME + 2 * DAY) == 2.0
+
+
+def test_default_price_cache(monkeypatch):
+    assert default_price_cache().max_entries is None
+    monkeypatch.setenv("COIN2086_PRICE_CACHE_MAX_ENTRIES", "1000")
+    monkeypatch.setenv("COIN2086_PRICE_CACHE_POLICY", "lfu")
+    cache = default_price_cache()
+    assert (cache.max_entries, cache.policy) == (1000, "lfu")
+    cache = default_price_cache(10, "lru")
+    assert (cache.max_entries, cache.policy) == (10, "lru")
+    with pytest.raises(ValueError):
+        PriceCache(policy="fifo")
+
+
+def test_bounded_downloader_keeps_flat_memory(bitstamp_requests):
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader(
+        cache=PriceCache(max_entries=250)
+    )
+    for day in range(10):
+        assert bstamp.download_price("BTC", DTIME + day * DAY) == 100.0
+        assert len(bstamp.cache) <= 250
+    assert len(bitstamp_requests) == 10
+    # Recent days are still cached, and evicted ones are downloaded again
+    bstamp.download_price("BTC", DTIME + 9 * DAY)
+    bstamp.download_price("BTC", DTIME)
+    assert len(bitstamp_requests) == 11
+    assert bstamp.cache.stats()["evictions"] >= 8
@@ -0,0 +1,244 @@
+import time
+import asyncio
+import threading
+import datetime as dt
+import concurrent.futures
+
+import pytest
+import numpy as np
+
+from coin2086 import aio
+from coin2086 import pricedownload
+from coin2086 import valuation
+from coin2086.pricestore import SQLitePriceStore
+
+from .conftest import DTIME, make_minute_bins
+
+
+def test_plan_minute_bin_requests():
+    minutes = [DTIME + dt.timedelta(minutes=m) for m in [0, 5, 999, 1000, 5000]]
+    plan = pricedownload.plan_minute_bin_requests(minutes, 1000)
+    assert plan == [
+        (minutes[0], 1000),
+        (minutes[3], 1),
+        (minutes[4], 1),
+    ]
+
+
+def test_bitstamp_prefetch_coalesces_requests(bitstamp_requests):
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+    dtimes = [DTIME + dt.timedelta(minutes=m, seconds=10) for m in range(0, 900, 7)]
+    bstamp.prefetch("BTC", dtimes)
+    assert bitstamp_requests == [("BTC", DTIME, 897)]
+    prices = [bstamp.download_price("BTC", d) for d in dtimes]
+    assert prices == [100.0 + m for m in range(0, 900, 7)]
+    assert len(bitstamp_requests) == 1
+
+
+def test_supported_cryptos_discovered_lazily(bitstamp_requests, tmp_path):
+    store = SQLitePriceStore(tmp_path / "prices.sqlite")
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader(store)
+    multi = pricedownload.MultiSourceFirstPriceDownloader([bstamp])
+    assert bitstamp_requests == []
+    bstamp.download_price("BTC", DTIME)
+    assert bitstamp_requests == [("BTC", DTIME, 100)]
+    # Cached prices are served without discovering the supported cryptos
+    assert multi.download_price("BTC", DTIME) == 100.0
+    multi.prefetch("BTC", [DTIME])
+    assert bitstamp_requests == [("BTC", DTIME, 100)]
+    assert multi.supported_crypto_list == ["BTC"]
+    assert bitstamp_requests[-1] == "pairs"
+    # The supported cryptos are persisted in the store
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader(store)
+    assert bstamp.supported_crypto_list == ["BTC"]
+    assert bitstamp_requests.count("pairs") == 1
+
+
+def test_bitstamp_download_prices(bitstamp_requests):
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+    bstamp.download_price("BTC", DTIME)
+    minutes = [0, 5, 5, 1500, 150, 3]
+    dtimes = [DTIME + dt.timedelta(minutes=m, seconds=20) for m in minutes]
+    prices = bstamp.download_prices("BTC", dtimes)
+    # Bins are downloaded from the first missing minute
+    assert prices == [100.0, 105.0, 105.0, 100.0, 100.0, 103.0]
+    # Cached prices are not downloaded again, and missing ones are grouped
+    later = DTIME + dt.timedelta(minutes=150)
+    assert bitstamp_requests == [
+        ("BTC", DTIME, 100),
+        ("BTC", later, 1),
+        ("BTC", DTIME + dt.timedelta(minutes=1500), 1),
+    ]
+    assert bstamp.cached_prices("BTC", [DTIME, later]) == [100.0, 100.0]
+    assert bstamp.download_prices("BTC", []) == []
+
+
+def test_multi_source_download_prices_falls_back(bitstamp_requests, monkeypatch):
+    class FixedPriceDownloader(pricedownload.PriceDownloader):
+        supported_crypto_list = ["BTC"]
+
+        def download_price(self, crypto, dtime):
+            return -1.0
+
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+    multi = pricedownload.MultiSourceFirstPriceDownloader(
+        [bstamp, FixedPriceDownloader()]
+    )
+    bstamp.download_price("BTC", DTIME)
+    dtimes = [DTIME, DTIME + dt.timedelta(minutes=2000)]
+    # Cached prices are served without discovering the supported cryptos
+    assert multi.download_prices("BTC", dtimes[:1]) == [100.0]
+    assert "pairs" not in bitstamp_requests
+    # A price missing from Bitstamp falls back on the next source
+    monkeypatch.setattr(
+        pricedownload,
+        "bitstamp_download_minute_bins",
+        lambda crypto, dtime, limit=100: make_minute_bins(crypto, dtime, 0),
+    )
+    assert multi.download_prices("BTC", dtimes) == [100.0, -1.0]
+
+
+def test_plan_downloads(bitstamp_requests):
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+    bstamp.download_price("BTC", DTIME)
+    minutes = [0, 1500, 5, 3000, 1501]
+    dtimes = [DTIME + dt.timedelta(minutes=m, seconds=20) for m in minutes]
+    # Cached prices, then one group per OHLC range request
+    groups = [[dtimes[0], dtimes[2]], [dtimes[1], dtimes[4]], [dtimes[3]]]
+    assert bstamp.plan_downloads("BTC", dtimes) == groups
+    kraken = pricedownload.KrakenNextTradePriceDownloader()
+    multi = pricedownload.MultiSourceFirstPriceDownloader([bstamp, kraken])
+    assert multi.plan_downloads("BTC", dtimes) == groups
+    # Kraken downloads each price on its own
+    assert kraken.plan_downloads("BTC", dtimes[:2]) == [dtimes[:1], dtimes[1:2]]
+    assert len(bitstamp_requests) == 2
+
+
+def test_single_crypto_downloads_overlap(bitstamp_requests, monkeypatch):
+    # Each request waits for the two others, and fails if they are not sent
+    # concurrently
+    barrier = threading.Barrier(3, timeout=10)
+
+    def fake_minute_bins(crypto, dtime, limit=100):
+        barrier.wait()
+        return make_minute_bins(crypto, dtime, limit)
+
+    monkeypatch.setattr(
+        pricedownload, "bitstamp_download_minute_bins", fake_minute_bins
+    )
+    dtimes = [DTIME + dt.timedelta(days=d) for d in range(3)]
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+    multi = pricedownload.MultiSourceFirstPriceDownloader([bstamp])
+    prices = valuation.download_planned_prices({"BTC": dtimes}, multi, max_workers=3)
+    assert prices == {("BTC", d): 100.0 for d in dtimes}
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+    downloader = aio.ThreadedAsyncPriceDownloader(
+        bstamp, executor=concurrent.futures.ThreadPoolExecutor(3)
+    )
+    loop = asyncio.new_event_loop()
+    try:
+        prices = loop.run_until_complete(downloader.download_prices("BTC", dtimes))
+    finally:
+        loop.close()
+        downloader.executor.shutdown()
+    assert prices == [100.0] * 3
+
+
+def make_trades_page(since, times):
+    times = np.array(times, dtype=float)
+    return pricedownload.KrakenTradesPage(since, times, times / 1000)
+
+
+def test_kraken_trades_pages():
+    pages = pricedownload.KrakenTradesPages(max_pages=2)
+    pages.add(make_trades_page(1000, [1000.5, 1010, 1010, 1020]))
+    assert pages.next_trade_price(999) is None
+    assert pages.next_trade_price(1000) == 1.0005
+    assert pages.next_trade_price(1001) == 1.01
+    assert pages.next_trade_price(1020) == 1.02
+    assert pages.next_trade_price(1021) is None
+    # Pages contained in a new page are dropped
+    pages.add(make_trades_page(1015, [1020, 1030]))
+    pages.add(make_trades_page(900, [950, 1100]))
+    assert len(pages.pages) == 1
+    assert pages.next_trade_price(1021) == 1.1
+    # The oldest pages are dropped first
+    pages.add(make_trades_page(2000, [2000]))
+    pages.add(make_trades_page(3000, [3000]))
+    assert pages.next_trade_price(1000) is None
+    assert pages.next_trade_price(2000) == 2.0
+
+
+def test_kraken_serves_clustered_prices_from_pages(monkeypatch):
+    requests = []
+
+    def fake_download_trades(crypto, since):
+        requests.append(since)
+        return make_trades_page(since, range(since + 30, since + 3000, 60))
+
+    monkeypatch.setattr(pricedownload, "kraken_download_trades", fake_download_trades)
+    kraken = pricedownload.KrakenNextTradePriceDownloader()
+    since = int(DTIME.timestamp())
+    dtimes = [DTIME + dt.timedelta(seconds=s) for s in [0, 45, 100, 2000, 4000]]
+    prices = kraken.download_prices("ADA", dtimes)
+    assert prices == [(since + s) / 1000 for s in [30, 90, 150, 2010, 4030]]
+    assert requests == [since, since + 4000]
+    assert kraken.download_price("ADA", DTIME + dt.timedelta(seconds=500)) == (
+        (since + 510) / 1000
+    )
+    assert len(requests) == 2
+
+
+def test_missing_prices_raise_missing_price_error(bitstamp_requests, monkeypatch):
+    monkeypatch.setattr(
+        pricedownload,
+        "kraken_download_trades",
+        lambda crypto, since: make_trades_page(since, []),
+    )
+    kraken = pricedownload.KrakenNextTradePriceDownloader()
+    with pytest.raises(pricedownload.MissingPriceError):
+        kraken.download_price("ADA", DTIME)
+    monkeypatch.setattr(
+        pricedownload,
+        "bitstamp_download_minute_bins",
+        lambda crypto, dtime, limit=100: make_minute_bins(crypto, dtime, 0),
+    )
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+    with pytest.raises(pricedownload.MissingPriceError):
+        bstamp.download_prices("BTC", [DTIME])
+
+
+def test_concurrent_misses_download_once(bitstamp_requests, monkeypatch):
+    def slow_minute_bins(crypto, dtime, limit=100):
+        bitstamp_requests.append((crypto, dtime, limit))
+        time.sleep(0.05)
+        return make_minute_bins(crypto, dtime, limit)
+
+    monkeypatch.setattr(
+        pricedownload, "bitstamp_download_minute_bins", slow_minute_bins
+    )
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+    later = DTIME + dt.timedelta(minutes=1000)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        prices = list(executor.map(bstamp.download_price, ["BTC"] * 8, [DTIME] * 8))
+        batches = list(executor.map(bstamp.download_prices, ["BTC"] * 4, [[later]] * 4))
+    assert prices == [100.0] * 8
+    assert batches == [[100.0]] * 4
+    assert bitstamp_requests == [("BTC", DTIME, 100), ("BTC", later, 1)]
+
+
+def test_reference_price_downloader_is_shared():
+    previous = pricedownload.set_reference_price_downloader(None)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            instances = set(
+                executor.map(
+                    lambda _: id(pricedownload.reference_price_downloader()), range(8)
+                )
+            )
+        assert len(instances) == 1
+        bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+        pricedownload.set_reference_price_downloader(bstamp)
+        assert pricedownload.reference_price_downloader() is bstamp
+    finally:
+        pricedownload.set_reference_price_downloader(previous)
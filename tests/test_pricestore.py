@@ -0,0 +1,60 @@
+import datetime as dt
+
+from coin2086 import pricedownload
+from coin2086.pricestore import SQLitePriceStore
+
+
+DTIME = dt.datetime(2021, 5, 12, 11, 33)
+
+
+def make_minute_bins(crypto, dtime, limit=100):
+    start = int(dtime.timestamp())
+    bins = [
+        {"timestamp": str(start + 60 * i), "close": str(100.0 + i)}
+        for i in range(limit)
+    ]
+    return {"data": {"pair": crypto + "/EUR", "ohlc": bins}}
+
+
+def test_store_put_get_prune(tmp_path):
+    store = SQLitePriceStore(tmp_path / "prices.sqlite")
+    later = DTIME + dt.timedelta(minutes=1)
+    store.put_prices("bitstamp", "BTC", [(DTIME, 1.0), (later, 2.0)])
+    store.put_prices("kraken", "ADA", [(DTIME, 3.0)])
+    assert store.get_price("bitstamp", "BTC", DTIME) == 1.0
+    assert store.get_price("bitstamp", "ETH", DTIME) is None
+    assert store.get_prices("bitstamp", "BTC", DTIME, later) == {
+        DTIME: 1.0,
+        later: 2.0,
+    }
+    summary = store.summary()
+    assert list(summary["crypto"]) == ["BTC", "ADA"]
+    assert list(summary["count"]) == [2, 1]
+    assert store.prune(source="bitstamp", before=later) == 1
+    assert store.prune() == 2
+
+
+def test_bitstamp_downloader_served_from_store(tmp_path, monkeypatch):
+    downloads = []
+
+    def fake_minute_bins(crypto, dtime, limit=100):
+        downloads.append((crypto, dtime))
+        return make_minute_bins(crypto, dtime, limit)
+
+    monkeypatch.setattr(
+        pricedownload,
+        "bitstamp_download_supported_pairs",
+        lambda: [pricedownload.TradingPair(base="BTC", quote="EUR")],
+    )
+    monkeypatch.setattr(
+        pricedownload, "bitstamp_download_minute_bins", fake_minute_bins
+    )
+    path = tmp_path / "prices.sqlite"
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader(SQLitePriceStore(path))
+    assert bstamp.download_price("BTC", DTIME) == 100.0
+    assert len(downloads) == 1
+    # A new downloader, as in a new process, is served from the store
+    bstamp = pricedownload.BitstampMinuteClosePriceDownloader(SQLitePriceStore(path))
+    later = DTIME + dt.timedelta(minutes=10, seconds=10)
+    assert bstamp.download_price("BTC", later) == 110.0
+    assert len(downloads) == 1
@@ -0,0 +1,58 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from coin2086 import pricedownload
+from coin2086 import transport
+from coin2086.pricetable import BLOCK_MINUTES, MinutePriceTable
+
+from .test_non_regression_price import TEST_DTIME, load_reference_dataframe
+
+DTIME = dt.datetime(2021, 5, 12, 11, 33)
+
+
+def test_table_put_get(tmp_path):
+    table = MinutePriceTable(tmp_path / "prices")
+    later = DTIME + dt.timedelta(minutes=1)
+    far = DTIME + dt.timedelta(minutes=3 * BLOCK_MINUTES)
+    table.put_prices("bitstamp", "BTC", [(DTIME, 1.0), (later, 2.0)])
+    # Prices not at whole minutes are not stored
+    table.put_prices("bitstamp", "BTC", [(DTIME + dt.timedelta(seconds=5), 5.0)])
+    assert table.get_price("bitstamp", "BTC", DTIME) == 1.0
+    assert table.get_price("bitstamp", "BTC", DTIME + dt.timedelta(seconds=5)) is None
+    assert table.get_price("bitstamp", "ETH", DTIME) is None
+    assert table.get_price("kraken", "BTC", DTIME) is None
+    assert table.get_prices("bitstamp", "BTC", DTIME, far) == {DTIME: 1.0, later: 2.0}
+    # New blocks are seen by other instances
+    other = MinutePriceTable(tmp_path / "prices")
+    assert other.get_price("bitstamp", "BTC", far) is None
+    table.put_prices("bitstamp", "BTC", [(far, 3.0)])
+    assert other.get_price("bitstamp", "BTC", far) == 3.0
+    summary = other.summary()
+    assert summary.values.tolist() == [["bitstamp", "BTC", 3, DTIME, far]]
+
+
+def test_table_lookup(tmp_path):
+    table = MinutePriceTable(tmp_path / "prices")
+    minutes = pd.date_range(DTIME, periods=10, freq="min")
+    table.put_prices("bitstamp", "BTC", zip(minutes[::2], range(5)))
+    dtimes = minutes + pd.Timedelta(seconds=20)
+    prices = table.lookup("BTC", dtimes)
+    expected = [0.0, np.nan, 1.0, np.nan, 2.0, np.nan, 3.0, np.nan, 4.0, np.nan]
+    np.testing.assert_array_equal(prices, expected)
+    before_epoch = [dt.datetime(2000, 1, 1), dt.datetime(2100, 1, 1)]
+    assert np.isnan(table.lookup("BTC", before_epoch)).all()
+    assert np.isnan(table.lookup("ETH", dtimes)).all()
+
+
+def test_table_backs_price_downloader(tmp_path):
+    prices = load_reference_dataframe(TEST_DTIME).set_index("cryptocurrency")
+    table = MinutePriceTable(tmp_path / "prices")
+    downloader = pricedownload.instantiate_reference_price_downloader(table)
+    assert downloader.download_price("BTC", TEST_DTIME) == prices.loc["BTC", "price"]
+    # Prices are served by the table without any request
+    transport.set_transport(None)
+    downloader = pricedownload.instantiate_reference_price_downloader(table)
+    assert downloader.download_price("BTC", TEST_DTIME) == prices.loc["BTC", "price"]
+    assert table.lookup("BTC", [TEST_DTIME]) == [prices.loc["BTC", "price"]]
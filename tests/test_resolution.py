@@ -0,0 +1,207 @@
+import time
+import datetime as dt
+
+import pytest
+import requests
+import pandas as pd
+
+import coin2086
+from coin2086 import pricedownload
+from coin2086.resolution import (
+    HealthAwarePriceDownloader,
+    SourceHealth,
+    is_missing_price_error,
+)
+
+from .conftest import DTIME
+from .test_non_regression import load_reference_dataframes
+
+
+class FakeSource(pricedownload.PriceDownloader):
+    def __init__(self, name, price, error=None, delay=0.0, cryptos=("BTC",)):
+        self.SOURCE_NAME = name
+        self.price = price
+        self.error = error
+        self.delay = delay
+        self.cryptos = list(cryptos)
+        self.calls = 0
+
+    @property
+    def supported_crypto_list(self):
+        return self.cryptos
+
+    def download_price(self, crypto, dtime):
+        return self.download_prices(crypto, [dtime])[0]
+
+    def download_prices(self, crypto, dtimes):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [self.price] * len(dtimes)
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker():
+    clock = FakeClock()
+    health = SourceHealth(failure_threshold=2, reset_timeout=10.0, clock=clock)
+    health.record_failure(1.0)
+    assert health.allow_request()
+    health.record_failure(3.0)
+    assert not health.allow_request()
+    clock.now = 10.0
+    # A single trial request is let through, and it fails
+    assert health.allow_request()
+    assert not health.allow_request()
+    health.record_failure(1.0)
+    assert health.state == "open"
+    clock.now = 20.0
+    assert health.allow_request()
+    health.record_success(1.0)
+    assert health.as_dict() == {
+        "state": "closed",
+        "latency": pytest.approx(1.256),
+        "requests": 4,
+        "failures": 3,
+    }
+
+
+def test_failing_source_is_skipped():
+    clock = FakeClock()
+    failing = FakeSource("failing", 1.0, requests.ConnectionError("down"))
+    backup = FakeSource("backup", 2.0)
+    multi = HealthAwarePriceDownloader(
+        [failing, backup], failure_threshold=3, reset_timeout=60.0, clock=clock
+    )
+    for minute in range(10):
+        assert multi.download_price("BTC", DTIME + dt.timedelta(minutes=minute)) == 2.0
+    assert failing.calls == 3
+    assert multi.health_stats()["failing"]["state"] == "open"
+    # The source is tried again once recovered
+    clock.now = 60.0
+    failing.error = None
+    assert multi.download_price("BTC", DTIME) == 1.0
+    assert multi.health_stats()["failing"]["state"] == "closed"
+
+
+def test_missing_prices_are_not_retried():
+    clock = FakeClock()
+    missing = FakeSource("missing", 1.0, pricedownload.MissingPriceError("No bin"))
+    backup = FakeSource("backup", 2.0)
+    multi = HealthAwarePriceDownloader(
+        [missing, backup], failure_threshold=1, missing_ttl=60.0, clock=clock
+    )
+    for _ in range(3):
+        assert multi.download_price("BTC", DTIME) == 2.0
+    assert multi.download_prices("BTC", [DTIME, DTIME]) == [2.0, 2.0]
+    assert missing.calls == 1
+    # Missing prices are not failures of the source
+    assert multi.health_stats()["missing"]["state"] == "closed"
+    multi.download_price("BTC", DTIME + dt.timedelta(minutes=1))
+    assert missing.calls == 2
+    # The price may be published later
+    clock.now = 60.0
+    multi.download_price("BTC", DTIME)
+    assert missing.calls == 3
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        KeyError("result"),
+        ValueError("Expecting value"),
+        requests.HTTPError(response=FakeResponse(429)),
+        requests.HTTPError(response=FakeResponse(502)),
+    ],
+)
+def test_unexpected_errors_are_failures(error):
+    failing = FakeSource("failing", 1.0, error)
+    backup = FakeSource("backup", 2.0)
+    multi = HealthAwarePriceDownloader([failing, backup], failure_threshold=5)
+    for _ in range(2):
+        assert multi.download_price("BTC", DTIME) == 2.0
+    assert failing.calls == 2
+    assert multi.health_stats()["failing"]["failures"] == 2
+
+
+def test_is_missing_price_error():
+    assert is_missing_price_error(pricedownload.MissingPriceError("No bin"))
+    assert is_missing_price_error(requests.HTTPError(response=FakeResponse(404)))
+    assert not is_missing_price_error(RuntimeError("Unexpected"))
+    assert not is_missing_price_error(IndexError("index 0 is out of bounds"))
+    assert not is_missing_price_error(requests.ConnectionError("down"))
+
+
+def test_hedged_requests():
+    slow = FakeSource("slow", 1.0, delay=0.5)
+    fast = FakeSource("fast", 2.0)
+    with HealthAwarePriceDownloader([slow, fast], hedge_after=0.05) as multi:
+        start = time.monotonic()
+        assert multi.download_price("BTC", DTIME) == 2.0
+        assert time.monotonic() - start < 0.4
+        # Without a slow source, the first source is used
+        slow.delay = 0.0
+        assert multi.download_price("BTC", DTIME) == 1.0
+        assert fast.calls == 1
+        threads = list(multi._get_executor()._threads)
+    # The threads are shut down when leaving the with block
+    assert len(threads) > 0
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_hedged_batches():
+    slow = FakeSource("slow", 1.0, delay=1.0)
+    fast = FakeSource("fast", 2.0)
+    multi = HealthAwarePriceDownloader([slow, fast], hedge_after=0.05)
+    dtimes = [DTIME + dt.timedelta(minutes=m) for m in range(100)]
+    start = time.monotonic()
+    assert multi.download_prices("BTC", dtimes) == [2.0] * 100
+    assert time.monotonic() - start < 0.5
+    assert (slow.calls, fast.calls) == (1, 1)
+    multi.close(wait=False)
+
+
+def test_hedged_valuation():
+    trades, _, _ = load_reference_dataframes("interleaved_exotics_trades.csv")
+    cryptos = trades["cryptocurrency"].unique()
+    fast = FakeSource("fast", 2.0, cryptos=cryptos)
+    expected = coin2086.valuate_portfolio(
+        trades,
+        price_downloader=pricedownload.MultiSourceFirstPriceDownloader([fast]),
+    )
+    slow = FakeSource("slow", 1.0, delay=1.0, cryptos=cryptos)
+    multi = HealthAwarePriceDownloader([slow, fast], hedge_after=0.05)
+    start = time.monotonic()
+    valuation = coin2086.valuate_portfolio(trades, price_downloader=multi)
+    assert time.monotonic() - start < 0.5
+    pd.testing.assert_frame_equal(valuation, expected)
+    multi.close(wait=False)
+
+
+def test_breakers_are_checked_when_requesting():
+    clock = FakeClock()
+    first = FakeSource("first", 1.0)
+    second = FakeSource("second", 2.0)
+    multi = HealthAwarePriceDownloader(
+        [first, second], failure_threshold=1, reset_timeout=10.0, clock=clock
+    )
+    multi.health["second"].record_failure(1.0)
+    clock.now = 10.0
+    assert multi.download_price("BTC", DTIME) == 1.0
+    # The trial request of the second source is left for when it is needed
+    assert multi.health_stats()["second"]["state"] == "open"
+    first.error = requests.ConnectionError("down")
+    assert multi.download_price("BTC", DTIME) == 2.0
+    assert multi.health_stats()["second"]["state"] == "closed"
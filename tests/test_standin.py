@@ -0,0 +1,65 @@
+import datetime as dt
+
+import pytest
+import requests
+
+from coin2086 import pricedownload
+from coin2086 import transport
+from coin2086.standin import (
+    ExchangeFixtures,
+    RecordingTransport,
+    StandInExchangeServer,
+    StandInTransport,
+)
+
+from .test_non_regression_price import TEST_DTIME, load_reference_dataframe
+
+
+def test_standin_server(exchange_fixtures):
+    prices = load_reference_dataframe(TEST_DTIME).set_index("cryptocurrency")
+    with StandInExchangeServer(exchange_fixtures) as server:
+        previous = transport.set_transport(
+            transport.RequestsTransport(redirect_url=server.url, rate_limits={})
+        )
+        try:
+            downloader = pricedownload.instantiate_reference_price_downloader()
+            for crypto in ["BTC", "ADA"]:
+                price = downloader.download_price(crypto, TEST_DTIME)
+                assert price == prices.loc[crypto, "price"]
+        finally:
+            transport.set_transport(previous)
+        assert server.standin.request_count == 4
+
+
+def test_standin_error_injection(exchange_fixtures):
+    standin = StandInTransport(exchange_fixtures, error_rate=0.5, seed=2086)
+    transport.set_transport(standin)
+    errors = 0
+    for _ in range(20):
+        bstamp = pricedownload.BitstampMinuteClosePriceDownloader()
+        try:
+            bstamp.supported_crypto_list
+        except requests.ConnectionError:
+            errors += 1
+    assert 0 < errors < 20
+    assert standin.request_count == 20
+
+
+def test_standin_unknown_request(exchange_fixtures):
+    standin = StandInTransport(exchange_fixtures)
+    with pytest.raises(requests.HTTPError):
+        standin.get_json(
+            "https://www.bitstamp.net/api/v2/ohlc/nopeeur/",
+            {"start": int(dt.datetime(2021, 1, 1).timestamp()), "limit": 10},
+        )
+
+
+def test_recording_transport(exchange_fixtures, tmp_path):
+    recorded = ExchangeFixtures(tmp_path)
+    recorder = RecordingTransport(StandInTransport(exchange_fixtures), recorded)
+    transport.set_transport(recorder)
+    downloader = pricedownload.instantiate_reference_price_downloader()
+    prices = [downloader.download_price(c, TEST_DTIME) for c in ["BTC", "ADA"]]
+    transport.set_transport(StandInTransport(recorded))
+    downloader = pricedownload.instantiate_reference_price_downloader()
+    assert [downloader.download_price(c, TEST_DTIME) for c in ["BTC", "ADA"]] == prices
@@ -0,0 +1,50 @@
+import pytest
+import requests
+
+from coin2086 import transport
+from coin2086.standin import StandInExchangeServer
+
+PAIRS_URL = "https://www.bitstamp.net/api/v2/trading-pairs-info/"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = transport.TokenBucket(10.0, 2, clock=clock, sleep=clock.sleep)
+    for _ in range(2):
+        bucket.acquire()
+    assert clock.now == 0.0
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_requests_transport_retries(exchange_fixtures):
+    with StandInExchangeServer(exchange_fixtures, error_rate=0.5, seed=4) as server:
+        client = transport.RequestsTransport(
+            redirect_url=server.url, backoff=0.0, max_retries=20, rate_limits={}
+        )
+        pairs = [client.get_json(PAIRS_URL) for _ in range(10)]
+        assert all(p == exchange_fixtures.respond(PAIRS_URL) for p in pairs)
+        assert server.standin.request_count > 10
+        client.close()
+
+
+def test_requests_transport_gives_up(exchange_fixtures):
+    with StandInExchangeServer(exchange_fixtures, error_rate=1.0) as server:
+        client = transport.RequestsTransport(
+            redirect_url=server.url, backoff=0.0, max_retries=2, rate_limits={}
+        )
+        with pytest.raises(requests.HTTPError):
+            client.get(PAIRS_URL)
+        assert server.standin.request_count == 3
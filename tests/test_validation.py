@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from coin2086 import validation
+
+from .test_non_regression import load_trades, make_ref_path
+
+
+def load_reference_trades():
+    return load_trades(make_ref_path("interleaved_trades.csv", ".csv"))
+
+
+def test_check_trades_order():
+    trades = load_reference_trades()
+    validation.check_trades(trades)
+    with pytest.raises(ValueError, match="not sorted"):
+        validation.check_trades(trades.iloc[::-1])
+    with pytest.raises(ValueError, match="not sorted"):
+        validation.check_trades(trades.set_index(trades.index + 1))
+
+
+def test_validate_trades_checks_once(monkeypatch):
+    trades = load_reference_trades()
+    checked = []
+    check_trades = validation.check_trades
+    monkeypatch.setattr(
+        validation,
+        "check_trades",
+        lambda trades: checked.append(True) or check_trades(trades),
+    )
+    validated = validation.validate_trades(trades)
+    assert validation.validate_trades(validated) is validated
+    assert validation.unwrap_trades(validated) is trades
+    assert len(checked) == 1
+    with pytest.raises(ValueError, match="Base currency"):
+        validation.validate_trades(trades.assign(base_currency="USD"))